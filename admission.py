@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Очередь допуска перед handle_message: приоритеты, лимиты и деградация.
+
+Порядок обработки:
+    0 moderation — сообщения недоверенных: только moderate_message (спам удаляем
+                   первым делом), уцелевшее встаёт обратно со своим классом ниже
+    1 reply      — реплаи коту
+    2 owner      — сообщения владельца в группах
+    3 chatter    — обычная болтовня
+Команды (/stats, /usage...) идут мимо очереди — их Application обрабатывает сразу.
+Отчёты владельцу — самое неважное: их первыми отключает деградация.
+
+Под нагрузкой (длина очереди):
+    ≥ ADMISSION_DEGRADE_EXTRAS   — без веб-поиска и отчётов владельцу;
+    ≥ ADMISSION_DEGRADE_INTEREST — без классификатора интересности:
+                                    отвечаем только на реплаи коту, моделью FUN.
+Очередь переполнена → выкидываем самое неважное; просроченные по
+ADMISSION_MAX_AGE выкидываем при извлечении. Счётчики — admission.* в /stats.
+
+Один чат — одно сообщение за раз: воркер не берёт апдейт чата, который сейчас
+обрабатывает другой воркер, — тот дождётся в куче (как в sharding.py, где чат
+всегда в одном процессе). Внутри чата порядок — по приоритету, затем по приходу.
+"""
+
+import heapq
+import asyncio
+import logging
+import itertools
+
+import metrics
+from config import (
+    OWNER_ID,
+    ADMISSION_WORKERS,
+    ADMISSION_MAX_QUEUE,
+    ADMISSION_MAX_AGE,
+    ADMISSION_DEGRADE_EXTRAS,
+    ADMISSION_DEGRADE_INTEREST,
+)
+from moderator import is_trusted, moderate_message
+from sharding import update_chat_id
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = ("moderation", "reply", "owner", "chatter")
+
+# уровни деградации
+DEGRADE_NONE = 0
+DEGRADE_EXTRAS = 1     # без поиска и отчётов
+DEGRADE_INTEREST = 2   # без классификатора, только реплаи, FUN
+
+_queue = None
+
+
+def classify(update, bot_id=None, moderated=False) -> int:
+    """
+    Приоритет апдейта (меньше — важнее); только дешёвые проверки, без LLM.
+    moderated=True — модерацию уже прошло, нужен его настоящий класс.
+    """
+    msg = update.message
+    if msg is None:
+        return PRIORITIES.index("chatter")
+    if not moderated and not is_trusted(msg):
+        return PRIORITIES.index("moderation")
+    reply = msg.reply_to_message
+    if reply and reply.from_user and reply.from_user.is_bot and (bot_id is None or reply.from_user.id == bot_id):
+        return PRIORITIES.index("reply")
+    if msg.from_user and msg.from_user.id == OWNER_ID:
+        return PRIORITIES.index("owner")
+    return PRIORITIES.index("chatter")
+
+
+def degrade_level(backlog: int) -> int:
+    if backlog >= ADMISSION_DEGRADE_INTEREST:
+        return DEGRADE_INTEREST
+    if backlog >= ADMISSION_DEGRADE_EXTRAS:
+        return DEGRADE_EXTRAS
+    return DEGRADE_NONE
+
+
+class AdmissionQueue:
+    """
+    Куча (priority, seq) → задача. handler(update, context, degrade, moderated)
+    и moderate(update, context) вызывают воркеры; submit() сразу возвращает
+    Future, который завершится после обработки (True) или выбрасывания (False).
+    """
+
+    def __init__(self, handler, moderate=moderate_message, workers=ADMISSION_WORKERS,
+                 max_queue=ADMISSION_MAX_QUEUE, max_age=ADMISSION_MAX_AGE):
+        self.handler = handler
+        self.moderate = moderate
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_age = max_age
+        self._heap = []
+        self._seq = itertools.count()
+        self._ready = asyncio.Event()
+        self._busy = set()  # чаты, которые сейчас в обработке
+        self._tasks = []
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _shed(self, item, reason):
+        priority, _, _, _, _, _, future, _ = item
+        metrics.inc(f"admission.shed.{reason}.{PRIORITIES[priority]}")
+        if not future.done():
+            future.set_result(False)
+
+    def submit(self, update, context, priority=None, moderated=False, future=None, seq=None):
+        """future и seq — прежние при повторной постановке после модерации: место среди ровесников сохраняется"""
+        loop = asyncio.get_running_loop()
+        if priority is None:
+            priority = classify(update, getattr(context.bot, "id", None), moderated)
+        if future is None:
+            future = loop.create_future()
+        if seq is None:
+            seq = next(self._seq)
+        item = (priority, seq, loop.time(), update_chat_id(update), update, context, future, moderated)
+        metrics.inc(f"admission.in.{PRIORITIES[priority]}")
+
+        if len(self._heap) >= self.max_queue:
+            worst = max(self._heap)
+            if item > worst:
+                # новое не важнее всего, что уже ждёт
+                self._shed(item, "overflow")
+                return future
+            self._heap.remove(worst)
+            heapq.heapify(self._heap)
+            self._shed(worst, "overflow")
+
+        heapq.heappush(self._heap, item)
+        self._ready.set()
+        return future
+
+    def _pop_ready(self, now):
+        """Самое важное из непросроченного, чей чат сейчас свободен; None — такого нет."""
+        skipped = []
+        found = None
+        while self._heap:
+            item = heapq.heappop(self._heap)
+            priority, _, enqueued, chat_id, _, _, _, _ = item
+            waited = now - enqueued
+            limit = self.max_age.get(PRIORITIES[priority])
+            if limit is not None and waited > limit:
+                self._shed(item, "expired")
+                continue
+            if chat_id in self._busy:
+                skipped.append(item)
+                continue
+            metrics.observe(f"admission.wait.{PRIORITIES[priority]}", waited)
+            found = item
+            break
+        for item in skipped:
+            heapq.heappush(self._heap, item)
+        return found
+
+    async def _next(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = self._pop_ready(loop.time())
+            if item is not None:
+                return item
+            # ждём новое сообщение или освободившийся чат
+            self._ready.clear()
+            await self._ready.wait()
+
+    async def _run(self, item):
+        """True — обработано (или выброшено модерацией), False — ещё ждёт в очереди."""
+        priority, seq, _, _, update, context, future, moderated = item
+        try:
+            if PRIORITIES[priority] == "moderation":
+                with metrics.span("stage.moderation"):
+                    keep = await self.moderate(update, context)
+                if keep:
+                    self.submit(update, context, moderated=True, future=future, seq=seq)
+                    return False
+                return True
+            level = degrade_level(len(self._heap))
+            if level:
+                metrics.inc(f"admission.degraded.{level}")
+            await self.handler(update, context, degrade=level, moderated=moderated)
+        except Exception as e:
+            logger.error("❌ Ошибка обработки сообщения из очереди: %s", e, exc_info=True)
+        return True
+
+    async def _worker(self):
+        while True:
+            item = await self._next()
+            chat_id, future = item[3], item[6]
+            self._busy.add(chat_id)
+            done = True
+            try:
+                done = await self._run(item)
+            finally:
+                self._busy.discard(chat_id)
+                if self._heap:
+                    self._ready.set()  # сообщения этого чата могли ждать освобождения
+                if done and not future.done():
+                    future.set_result(True)
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+        return self
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for item in self._heap:
+            self._shed(item, "shutdown")
+        self._heap.clear()
+
+
+def start(handler, **kwargs):
+    """Запускает общую очередь (нужен работающий event loop)"""
+    global _queue
+    _queue = AdmissionQueue(handler, **kwargs).start()
+    return _queue
+
+
+def stop():
+    global _queue
+    if _queue:
+        _queue.stop()
+        _queue = None
+
+
+def get_queue():
+    return _queue
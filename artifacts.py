@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Крупные производные тексты (веб-резюме, анализ фото) — в отдельной таблице
+artifacts, адресуемой по sha256 содержимого. В history остаётся короткая
+метка и ссылка artifact_hash: одинаковый текст хранится один раз,
+а сборка контекста по хэшу кладёт каждый артефакт в промпт не больше одного раза.
+"""
+
+import hashlib
+
+# что остаётся в history.content вместо самого текста (видно в /find, резюме старых БД и т.п.)
+ARTIFACT_LABELS = {
+    "web": "🌍 [результат веб-поиска]",
+    "vision": "🔎 [анализ фото]",
+}
+
+
+def artifact_hash(content: str) -> str:
+    return hashlib.sha256((content or "").strip().encode("utf-8")).hexdigest()
+
+
+def store_artifact(conn, kind, content) -> str:
+    """Кладёт артефакт (если такого ещё нет) в транзакции conn; возвращает хэш."""
+    digest = artifact_hash(content)
+    conn.execute(
+        "INSERT OR IGNORE INTO artifacts (hash, kind, content) VALUES (?, ?, ?)",
+        (digest, kind, content.strip()),
+    )
+    return digest
+
+
+def gc_artifacts(conn) -> int:
+    """Удаляет артефакты, на которые больше не ссылается ни одна строка history."""
+    cur = conn.execute(
+        """
+        DELETE FROM artifacts
+        WHERE NOT EXISTS (SELECT 1 FROM history h WHERE h.artifact_hash = artifacts.hash)
+        """
+    )
+    return cur.rowcount
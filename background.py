@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Фоновые задачи «выстрелил и забыл»: реакции, отчёты владельцу — всё,
+чего не ждёт ответ пользователю.
+
+- задача наследует contextvars (corr в логах, закреплённый runtime_config);
+- ошибка не теряется: лог + счётчик background.errors.<имя>;
+- задач не больше BACKGROUND_MAX_TASKS: сверх лимита новые выбрасываются
+  (background.dropped.<имя>) — под нагрузкой отчёты не должны копиться без конца;
+- flush() при остановке бота дожидается оставшихся (не дольше таймаута).
+"""
+
+import asyncio
+import logging
+
+import metrics
+from config import BACKGROUND_MAX_TASKS, BACKGROUND_FLUSH_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundTasks:
+    def __init__(self, limit=BACKGROUND_MAX_TASKS):
+        self.limit = limit
+        self._tasks = set()
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def spawn(self, coro, name: str) -> bool:
+        """Запускает coro в фоне; False — лимит исчерпан, корутина закрыта без запуска."""
+        if len(self._tasks) >= self.limit:
+            coro.close()
+            metrics.inc(f"background.dropped.{name}")
+            logger.warning("⚠️ Фоновых задач уже %s — «%s» пропущена", len(self._tasks), name)
+            return False
+        task = asyncio.get_running_loop().create_task(self._run(coro, name), name=f"bg:{name}")
+        self._tasks.add(task)  # держим ссылку, иначе задачу может собрать GC
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _run(self, coro, name):
+        try:
+            with metrics.span(f"background.{name}"):
+                await coro
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            metrics.inc(f"background.errors.{name}")
+            logger.error("❌ Фоновая задача «%s» упала: %s", name, e, exc_info=True)
+
+    async def flush(self, timeout=BACKGROUND_FLUSH_TIMEOUT):
+        """Ждёт оставшиеся задачи; не успевшие за timeout отменяет. Возвращает число отменённых."""
+        if not self._tasks:
+            return 0
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            logger.warning("⚠️ %s фоновых задач не успели завершиться и отменены", len(pending))
+        return len(pending)
+
+
+_tasks = BackgroundTasks()
+
+
+def spawn(coro, name: str) -> bool:
+    return _tasks.spawn(coro, name)
+
+
+async def flush(timeout=BACKGROUND_FLUSH_TIMEOUT):
+    return await _tasks.flush(timeout)
+
+
+def pending() -> int:
+    return len(_tasks)
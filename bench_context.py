@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк сборщика контекста на реальной истории из group_history.db.
+
+Для каждого чата берём N последних сообщений как «текущие» и сравниваем
+старый контекст (15 строк целиком) с новым (build_context в бюджете модели).
+
+    python bench_context.py [--chat ID] [--samples 50] [--model claude-3-5-haiku-20241022]
+"""
+
+import os
+import time
+import sqlite3
+import argparse
+
+from config import CONTEXT_FETCH_ROWS
+from context_builder import build_context, estimate_tokens, format_entry
+from records import HistoryEntry
+
+DB_PATH = os.path.join(os.getcwd(), "group_history.db")
+
+
+def old_context_tokens(rows, final_message):
+    """Как считал старый get_chat_history: 15 строк, все целиком."""
+    total = estimate_tokens(final_message["content"])
+    for row in rows[-15:]:
+        if row.content:
+            total += estimate_tokens(format_entry(row.role, row.first_name, row.content, row.is_interesting)["content"])
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Экономия токенов контекста на реальной истории")
+    parser.add_argument("--chat", type=int, default=None)
+    parser.add_argument("--samples", type=int, default=50, help="сообщений на чат")
+    parser.add_argument("--model", default="claude-3-5-haiku-20241022")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    if args.chat:
+        chats = [args.chat]
+    else:
+        chats = [r[0] for r in cur.execute("SELECT DISTINCT chat_id FROM history")]
+
+    old_total = new_total = samples = 0
+    build_time = 0.0
+    for chat_id in chats:
+        rows = cur.execute(
+            """
+            SELECT h.role, h.first_name, COALESCE(a.content, h.content),
+                   h.is_interesting, h.source, h.artifact_hash
+            FROM history h
+            LEFT JOIN artifacts a ON a.hash = h.artifact_hash
+            WHERE h.chat_id = ?
+            ORDER BY h.created DESC LIMIT ?
+            """,
+            (chat_id, args.samples + CONTEXT_FETCH_ROWS),
+        ).fetchall()[::-1]
+        rows = [HistoryEntry.from_row(r) for r in rows]
+
+        chat_old = chat_new = 0
+        for i in range(max(len(rows) - args.samples, 1), len(rows)):
+            row = rows[i]
+            if row.role != "user" or not row.content:
+                continue
+            final = {"role": "user", "content": f"‼️ Вот последнее сообщение, на которое нужно ответить: {row.first_name}: {row.content}"}
+            window = rows[max(i - CONTEXT_FETCH_ROWS, 0):i]
+
+            started = time.perf_counter()
+            _, stats = build_context(window, final_message=final, model=args.model)
+            build_time += time.perf_counter() - started
+
+            chat_old += old_context_tokens(window, final)
+            chat_new += stats["tokens"]
+            samples += 1
+
+        if chat_old:
+            print(f"💬 {chat_id}: {chat_old} → {chat_new} ток. ({100 * (chat_old - chat_new) / chat_old:.1f}% экономии)")
+        old_total += chat_old
+        new_total += chat_new
+    conn.close()
+
+    if not samples:
+        print("История пуста — нечего мерить.")
+        return
+
+    print(
+        f"\n📊 {samples} ответов: было {old_total} ток., стало {new_total} ток., "
+        f"сэкономлено {old_total - new_total} ({100 * (old_total - new_total) / old_total:.1f}%)\n"
+        f"⏱ build_context: {1000 * build_time / samples:.3f} мс на сообщение"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк FTS5-поиска по истории на большом архиве.
+
+Во временную БД (схема из init_group_db, с триггерами FTS) пишется N строк
+синтетической болтовни, затем замеряется задержка search_history()
+(BM25, top-k в одном чате) и, для сравнения, LIKE-скана (чтобы ранжировать, ему нужны все совпадения).
+
+    python bench_fts.py --rows 2000000 --chats 20 --queries 200
+"""
+
+import os
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+import init_group_db
+import history_search
+
+VOCAB = (
+    "нейросеть модель обучение датасет сервер питон митап встреча книга фильм кот погода "
+    "отпуск работа проект релиз баг тест архитектура трансформер видеокарта кластер "
+    "статья новости конференция доклад ипотека машина ремонт квартира футбол поход горы "
+    "море самолёт билет концерт музыка гитара рецепт пицца кофе чай утро вечер выходные "
+    "сегодня завтра вчера неделя думаю кажется помню обсуждали решили договорились "
+    "prompt token gpu docker kubernetes python rust postgres sqlite index benchmark"
+).split()
+
+
+SYLLABLES = "ка ло ми ру та не зо ва пе ди ку ры сто мо ль гра шу бе ян фо".split()
+
+
+def make_vocab(size, rng):
+    """Настоящие слова + синтетические; частоты по Ципфу, как в живой речи."""
+    words = list(VOCAB)
+    seen = set(words)
+    while len(words) < size:
+        w = "".join(rng.choices(SYLLABLES, k=rng.randint(2, 4)))
+        if w not in seen:
+            seen.add(w)
+            words.append(w)
+    rng.shuffle(words)
+    cum, total = [], 0.0
+    for rank in range(len(words)):
+        total += 1 / (rank + 1)
+        cum.append(total)
+    return words, cum
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)] if values else 0.0
+
+
+def fill(conn, rows, chats, vocab, cum_weights, batch=20_000):
+    start = datetime.now() - timedelta(days=365)
+    step = timedelta(days=365) / rows
+    chat_ids = [-100_000_000 - i for i in range(chats)]
+    written = 0
+    while written < rows:
+        n = min(batch, rows - written)
+        data = []
+        for i in range(written, written + n):
+            words = random.choices(vocab, cum_weights=cum_weights, k=random.randint(3, 25))
+            data.append((
+                random.choice(chat_ids), i, random.randint(1, 5000), f"user{i % 500}",
+                "user", start + step * i, " ".join(words),
+            ))
+        conn.executemany(
+            "INSERT INTO history (chat_id, message_id, user_id, first_name, role, created, content) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            data,
+        )
+        conn.commit()
+        written += n
+    return chat_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк FTS5 по истории")
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--like-queries", type=int, default=5)
+    parser.add_argument("--vocab", type=int, default=30_000, help="размер словаря синтетики")
+    parser.add_argument("--db", help="готовая БД (по умолчанию — временная, заполняется синтетикой)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="neurocat-fts-"), "group_history.db")
+    init_group_db.DB_PATH = db_path
+    history_search.DB_PATH = db_path
+    init_group_db.init_db()
+
+    vocab, cum_weights = make_vocab(args.vocab, random.Random(args.seed))
+    conn = history_search.get_db_connection()
+    if args.db:
+        chat_ids = [r[0] for r in conn.execute("SELECT DISTINCT chat_id FROM history")]
+    else:
+        started = time.perf_counter()
+        chat_ids = fill(conn, args.rows, args.chats, vocab, cum_weights)
+        elapsed = time.perf_counter() - started
+        print(f"📥 {args.rows} строк с FTS-триггерами за {elapsed:.1f} с ({args.rows / elapsed:.0f} строк/с)")
+    size_mb = os.path.getsize(db_path) / 1024 / 1024
+    print(f"🗂 {db_path}: {size_mb:.0f} МБ")
+
+    # вопросы из слов средней частоты (самые частые — как стоп-слова, редкие почти не встречаются)
+    mid = vocab[len(vocab) // 100:len(vocab) // 5]
+    questions = [" ".join(random.sample(mid, random.randint(2, 5))) + "?" for _ in range(args.queries)]
+
+    latencies = []
+    hits = 0
+    for q in questions:
+        started = time.perf_counter()
+        rows = history_search.search_history(random.choice(chat_ids), q, k=3)
+        latencies.append(time.perf_counter() - started)
+        hits += bool(rows)
+    print(
+        f"🔎 FTS5 top-3: p50 {percentile(latencies, 0.5) * 1000:.1f} мс | "
+        f"p95 {percentile(latencies, 0.95) * 1000:.1f} мс | max {max(latencies) * 1000:.1f} мс | "
+        f"с результатом {hits}/{len(questions)}"
+    )
+
+    like = []
+    for q in questions[:args.like_queries]:
+        word = q.split()[0]
+        started = time.perf_counter()
+        conn.execute(
+            "SELECT id, content FROM history WHERE chat_id = ? AND content LIKE ?",
+            (random.choice(chat_ids), f"%{word}%"),
+        ).fetchall()
+        like.append(time.perf_counter() - started)
+    conn.close()
+    if like:
+        print(f"🐢 LIKE-скан (1 слово): p50 {percentile(like, 0.5) * 1000:.1f} мс | max {max(like) * 1000:.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк памяти: записи records.py против прежнего представления.
+
+    history  — кортеж из sqlite3          vs HistoryEntry (роль и источник интернированы)
+    interest — dict из json.loads с list   vs InterestResult
+    usage    — кортеж в буфере usage_tracker vs UsageEvent
+
+Для каждого вида в памяти держится --count записей (по умолчанию 1 млн),
+байты на запись — по tracemalloc, включая сами строки (текст сообщения одинаков
+в обоих вариантах, разница — в обёртке и повторяющихся коротких строках).
+Время построения меряется под tracemalloc — сравнивать только между собой.
+
+    python bench_records.py [--count 1000000] [--only history,interest,usage]
+"""
+
+import gc
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tracemalloc
+from datetime import datetime
+
+from records import HistoryEntry, InterestResult, UsageEvent
+
+ROLES = ("user", "user", "user", "assistant")
+SOURCES = (None, None, "web", "vision")
+MODELS = ("gpt-4o-mini", "claude-3-5-haiku-20241022", "claude-sonnet-4-5-20250929")
+STAGES = ("interest", "web_summary", "reply", "summary")
+
+
+def _history_rows(count):
+    """Строки так, как их отдаёт fetch_history_rows: каждая строка — новые объекты str."""
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE history (role, first_name, content, is_interesting, source, artifact_hash)")
+    rng = random.Random(1)
+    conn.executemany(
+        "INSERT INTO history VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            (rng.choice(ROLES), f"user{i % 500}", f"сообщение {i}: как дела у кота?", i % 2, rng.choice(SOURCES), None)
+            for i in range(count)
+        ),
+    )
+    return conn, "SELECT role, first_name, content, is_interesting, source, artifact_hash FROM history"
+
+
+def _interest_json(count):
+    rng = random.Random(2)
+    return [
+        json.dumps({
+            "INTEREST": rng.choice(("YES", "NO")),
+            "REACTION": [rng.choice(("🔥", "😁", "🤔"))],
+            "SEARCH": "NO",
+            "QUERY": "",
+            "MODEL": rng.choice(("FUN", "SMART")),
+        }, ensure_ascii=False)
+        for _ in range(count)
+    ]
+
+
+def _usage_args(count):
+    rng = random.Random(3)
+    now = datetime.now()
+    return [
+        (now, -100 - i % 50, i % 5000, rng.choice(MODELS), rng.choice(STAGES), 900, 60, 512, 850)
+        for i in range(count)
+    ]
+
+
+def measure(build):
+    """(байт удерживается, секунд на построение) для списка, который возвращает build()."""
+    gc.collect()
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    started = time.perf_counter()
+    items = build()
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    count = len(items)
+    del items
+    return (held - base) / count, elapsed
+
+
+def bench_history(count):
+    conn, sql = _history_rows(count)
+    old = measure(lambda: conn.execute(sql).fetchall())
+    new = measure(lambda: [HistoryEntry.from_row(r) for r in conn.execute(sql)])
+    conn.close()
+    return old, new
+
+
+def bench_interest(count):
+    raw = _interest_json(count)
+    old = measure(lambda: [json.loads(s) for s in raw])
+    new = measure(lambda: [InterestResult.from_dict(json.loads(s)) for s in raw])
+    return old, new
+
+
+def bench_usage(count):
+    args = _usage_args(count)
+    old = measure(lambda: [tuple([*a]) for a in args])  # новый кортеж, как в record_usage
+    new = measure(lambda: [UsageEvent(*a) for a in args])
+    return old, new
+
+
+BENCHES = {
+    "history": ("tuple", "HistoryEntry", bench_history),
+    "interest": ("dict", "InterestResult", bench_interest),
+    "usage": ("tuple", "UsageEvent", bench_usage),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Память на запись: __slots__ против tuple/dict")
+    parser.add_argument("--count", type=int, default=1_000_000)
+    parser.add_argument("--only", help="через запятую: " + ",".join(BENCHES))
+    args = parser.parse_args()
+
+    names = args.only.split(",") if args.only else list(BENCHES)
+    print(f"📦 {args.count:,} записей каждого вида".replace(",", " "))
+    for name in names:
+        old_name, new_name, bench = BENCHES[name]
+        (old_bytes, old_time), (new_bytes, new_time) = bench(args.count)
+        print(
+            f"🧮 {name:9} {old_name:6} {old_bytes:6.0f} Б/запись ({old_time:5.2f} с) → "
+            f"{new_name:14} {new_bytes:6.0f} Б/запись ({new_time:5.2f} с) | "
+            f"{100 * (new_bytes - old_bytes) / old_bytes:+.0f}% "
+            f"(экономия {(old_bytes - new_bytes) * args.count / 2 ** 20:.0f} МБ на {args.count:,})".replace(",", " ")
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк шардирования: пропускная способность при 1, 2, 4... воркерах.
+
+Конвейер тот же, что в loadtest.py (заглушки LLM/Telegram/сети, временная БД),
+но сообщения раскидываются супервизором по процессам через shard_for().
+Чтобы нагрузка была похожа на боевую по CPU, поиск включён почти всегда,
+а «скачанные» страницы большие — их парсит настоящий BeautifulSoup.
+
+    python bench_shards.py --workers 1,2,4 --groups 16 --messages 400
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import functools
+from types import SimpleNamespace
+
+import loadtest
+from sharding import Supervisor
+
+
+def _big_page(paragraphs: int) -> str:
+    body = "".join(
+        f"<div class='p'><p>Абзац {i}: <b>содержимое</b> страницы, <a href='/x{i}'>ссылка</a>.</p></div>"
+        for i in range(paragraphs)
+    )
+    return f"<html><head><script>var x = 1;</script></head><body>{body}</body></html>"
+
+
+async def _bench_worker_loop(args, shard, inbox, done):
+    from bot_ai import safe_handle
+
+    bot = loadtest.FakeBot(loadtest.Latency(args.tg_latency))
+    context = SimpleNamespace(bot=bot, args=[])
+    loop = asyncio.get_running_loop()
+    tasks = []
+    while True:
+        item = await loop.run_in_executor(None, inbox.get)
+        if item is None:
+            break
+        update = loadtest.make_update(bot, item["chat_id"], item["message_id"], user_id=item["user_id"])
+        tasks.append(asyncio.create_task(safe_handle(update, context)))
+    await asyncio.gather(*tasks)
+    done.put((shard, len(tasks)))
+
+
+def bench_worker(args, done, shard, inbox):
+    sys.stdout = open(os.devnull, "w")
+    asyncio.run(_bench_worker_loop(args, shard, inbox, done))
+
+
+def run(args, workers, groups, items):
+    import multiprocessing as mp
+
+    ctx = mp.get_context("fork")  # воркеры наследуют подменённые клиенты
+    done = ctx.Queue()
+    supervisor = Supervisor(workers, target=functools.partial(bench_worker, args, done), start_method="fork")
+    supervisor.start()
+
+    started = time.perf_counter()
+    for item in items:
+        supervisor.route(item["chat_id"], item)
+    for q in supervisor.queues:
+        q.put(None)
+    per_shard = dict(done.get() for _ in range(workers))
+    elapsed = time.perf_counter() - started
+    supervisor.stop()
+    return elapsed, per_shard
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк шардирования НейроКота")
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--groups", type=int, default=16)
+    parser.add_argument("--messages", type=int, default=400)
+    parser.add_argument("--page-paragraphs", type=int, default=50, help="размер «скачанной» страницы")
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--web-latency", type=float, default=0.02)
+    parser.add_argument("--tg-latency", type=float, default=0.01)
+    parser.add_argument("--p-search", type=float, default=0.9)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    groups = [-100_000_000 - i for i in range(args.groups)]
+    items = [
+        {"chat_id": random.choice(groups), "message_id": i + 1, "user_id": random.randint(1, 5000)}
+        for i in range(args.messages)
+    ]
+
+    fake_args = SimpleNamespace(
+        llm_latency=args.llm_latency, web_latency=args.web_latency, error_rate=0.0,
+        p_interest=1.0, p_search=args.p_search,
+    )
+    page = _big_page(args.page_paragraphs)
+
+    async def fake_fetch_html(session, url, timeout=5):
+        await asyncio.sleep(args.web_latency)
+        return page
+
+    baseline = None
+    for n in [int(x) for x in args.workers.split(",")]:
+        db_path = os.path.join(tempfile.mkdtemp(prefix="neurocat-shards-"), "group_history.db")
+        loadtest.install_fakes(fake_args, db_path, groups)
+        import web_search
+        web_search.fetch_html = fake_fetch_html
+
+        elapsed, per_shard = run(args, n, groups, items)
+        throughput = len(items) / elapsed
+        baseline = baseline or throughput
+        spread = ", ".join(f"#{k}: {v}" for k, v in sorted(per_shard.items()))
+        print(
+            f"⚙️ воркеров {n:>2} | ⚡ {throughput:6.1f} msg/s | x{throughput / baseline:.2f} | "
+            f"{elapsed:.1f} с | по шардам: {spread}"
+        )
+
+
+if __name__ == "__main__":
+    main()
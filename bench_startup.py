@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк холодного старта: каждый замер — в свежем процессе python.
+
+    import <модуль>        — сколько платит CLI-утилита или бот за импорт
+    build_app              — импорт bot_ai + сборка Application (без сети)
+    warm_up                — clients.warm_up без сети: то, что бот делает в post_init
+
+    python bench_startup.py [--runs 5] [--top 15]
+
+--top показывает самые дорогие модули по `python -X importtime -c "import bot_ai"`.
+"""
+
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+SCENARIOS = {
+    "init_group_db": "import init_group_db",
+    "interest": "import interest",
+    "retention": "import retention",
+    "message_handler": "import message_handler",
+    "bot_ai": "import bot_ai",
+    "build_app": "import bot_ai; bot_ai.build_app()",
+    "warm_up": "import asyncio, clients; asyncio.run(clients.warm_up(network=False))",
+}
+
+TIMER = (
+    "import time; _t = time.perf_counter()\n"
+    "{code}\n"
+    "print(time.perf_counter() - _t)"
+)
+
+
+def measure(code, runs):
+    times = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", TIMER.format(code=code)],
+            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)) or ".",
+        )
+        if out.returncode != 0:
+            raise RuntimeError(out.stderr.strip().splitlines()[-1] if out.stderr.strip() else "ошибка")
+        times.append(float(out.stdout.strip().splitlines()[-1]))
+    return times
+
+
+def import_top(module, top):
+    """Прямые импорты модуля по cumulative-времени (строки `-X importtime` с глубиной 1)."""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True,
+    )
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line.split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            rows.append((int(cumulative_us), name.strip()))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время холодного старта")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="0 — не показывать разбор importtime")
+    parser.add_argument("--only", help="сценарии через запятую: " + ",".join(SCENARIOS))
+    args = parser.parse_args()
+
+    names = args.only.split(",") if args.only else list(SCENARIOS)
+    for name in names:
+        try:
+            times = measure(SCENARIOS[name], args.runs)
+        except RuntimeError as e:
+            print(f"❌ {name:16} {e}")
+            continue
+        print(
+            f"⏱ {name:16} медиана {statistics.median(times) * 1000:7.0f} мс | "
+            f"min {min(times) * 1000:6.0f} | max {max(times) * 1000:6.0f}"
+        )
+
+    if args.top:
+        print("\n📦 Самые дорогие прямые импорты bot_ai:")
+        for cumulative_us, name in import_top("bot_ai", args.top):
+            print(f"   {cumulative_us / 1000:8.1f} мс  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import time
+import asyncio
 import logging
 from telegram import Update
 from telegram.ext import Application, MessageHandler, filters, CommandHandler, ContextTypes
@@ -8,19 +10,36 @@ from telegram.ext import Application, MessageHandler, filters, CommandHandler, C
 from message_handler import handle_message
 from prompt_updater import register_handlers
 from moderator import register_moderator_handlers
-from config import BOT_TOKEN, OWNER_ID, get_current_time
+from usage_tracker import register_usage_handlers, flush_usage, run_flusher as run_usage_flusher
+from metrics import inc, register_metrics_handlers, start_metrics_server
+from history_search import register_search_handlers
+from loop_watchdog import LoopWatchdog
+from logs import setup_logging, log_context, new_corr_id
+import admission
+import background
+import clients
+import cassette
+import idle_scheduler
+import retention
+import runtime_config
+from runtime_config import register_config_handlers
+from init_group_db import init_db, DB_PATH
+from config import (
+    BOT_TOKEN,
+    OWNER_ID,
+    METRICS_HOST,
+    METRICS_PORT,
+    UPDATE_MODE,
+    SHARD_WORKERS,
+    IDLE_ENABLED,
+    WARMUP_ENABLED,
+    get_current_time,
+)
 
 
-# 🔹 Логирование
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
+# 🔹 Логирование: настраивается в main() (logs.setup_logging — очередь + фоновый поток)
 logger = logging.getLogger(__name__)
 
-# 🔇 Отключаем лишние логи от httpx и telegram
-logging.getLogger("httpx").setLevel(logging.WARNING)
-logging.getLogger("telegram").setLevel(logging.WARNING)
-
 
 def load_start_message():
     """Загружаем приветственный текст из файла"""
@@ -50,38 +69,141 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Не удалось отправить сообщение админу: {e}", exc_info=True)
 
 
-async def safe_handle(update, context):
-    """Обертка для обработки ошибок в handle_message"""
-    try:
-        await handle_message(update, context)
-    except Exception as e:
-        logger.error(f"Ошибка в handle_message: {e}", exc_info=True)
+async def process_message(update, context, degrade=0, moderated=False):
+    """
+    Обертка для обработки ошибок в handle_message; все логи сообщения помечены его corr.
+    Возвращает False, если обработка упала (счётчик handle_message.errors).
+    """
+    msg = update.effective_message
+    with log_context(
+        corr=new_corr_id(),
+        update_id=update.update_id,
+        chat_id=msg.chat_id if msg else None,
+        message_id=msg.message_id if msg else None,
+    ):
+        try:
+            # одна версия настроек на всё сообщение, даже если конфиг сменится посередине
+            with runtime_config.pinned():
+                await handle_message(update, context, degrade=degrade, moderated=moderated)
+            return True
+        except Exception as e:
+            inc("handle_message.errors")
+            logger.error("Ошибка в handle_message: %s", e, exc_info=True)
+            return False
 
 
-def main():
+async def safe_handle(update, context):
+    """Ставит сообщение в очередь допуска; без очереди (тесты, бенчмарки) — обрабатывает сразу"""
+    msg = update.effective_message
+    if msg is not None and msg.chat_id not in runtime_config.current().allowed_groups:
+        return  # чужие чаты handle_message всё равно пропустит — не занимаем ими очередь
+    queue = admission.get_queue()
+    if queue is None:
+        await process_message(update, context)
+    else:
+        queue.submit(update, context)
+
+
+async def on_startup(app):
+    """Фоновые службы, которым нужен запущенный event loop"""
+    if WARMUP_ENABLED:
+        # до начала polling: импорт тяжёлых модулей, клиенты API, первое соединение
+        started = time.perf_counter()
+        await clients.warm_up(network=not cassette.enabled())
+        logger.info("🔥 Прогрев за %.2f с", time.perf_counter() - started)
+    if METRICS_PORT:
+        # у воркера шарда свой порт: METRICS_PORT + номер шарда
+        port = METRICS_PORT + app.bot_data.get("shard", 0)
+        app.bot_data["metrics_server"] = await start_metrics_server(METRICS_HOST, port)
+    app.bot_data["watchdog"] = LoopWatchdog(app.bot).start()
+    admission.start(process_message)
+    app.bot_data["config_task"] = asyncio.get_running_loop().create_task(runtime_config.watch())
+    app.bot_data["usage_task"] = asyncio.get_running_loop().create_task(run_usage_flusher())
+    shard = app.bot_data.get("shard")
+    if shard in (None, 0):
+        # архивация истории — одна на всю БД, даже при шардах
+        app.bot_data["retention_task"] = asyncio.get_running_loop().create_task(retention.run_scheduler())
+    if IDLE_ENABLED:
+        owns = None
+        if shard is not None:
+            from sharding import shard_for
+            owns = lambda chat_id: shard_for(chat_id, SHARD_WORKERS) == shard
+        idle_scheduler.seed_from_db(DB_PATH, owns=owns)
+        app.bot_data["idle_task"] = asyncio.get_running_loop().create_task(idle_scheduler.run(app.bot))
+
+
+async def on_shutdown(app):
+    """Дописываем накопленный учёт токенов и фоновые задачи перед выходом"""
+    admission.stop()
+    await background.flush()
+    for name in ("idle_task", "retention_task", "config_task", "usage_task"):
+        task = app.bot_data.get(name)
+        if task:
+            task.cancel()
+    flush_usage()
+    watchdog = app.bot_data.get("watchdog")
+    if watchdog:
+        watchdog.stop()
+    server = app.bot_data.get("metrics_server")
+    if server:
+        server.close()
+
+
+def build_app(with_updater=True):
+    """Application со всеми обработчиками (воркеры шардов — без собственного updater)"""
     # Создаем приложение с увеличенными таймаутами
-    app = (
+    builder = (
         Application.builder()
         .token(BOT_TOKEN)
         .read_timeout(60)    # максимум ожидания ответа от Telegram API
         .write_timeout(60)   # максимум времени на отправку
         .connect_timeout(30) # максимум на установку соединения
         .pool_timeout(30)    # ожидание свободного соединения
-        .build()
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
     )
+    if not with_updater:
+        builder = builder.updater(None)
+    app = builder.build()
 
     # Регистрируем обработчики апдейтера промпта (inline-кнопки Да/Нет)
     register_handlers(app)
     register_moderator_handlers(app)
+    register_usage_handlers(app)
+    register_metrics_handlers(app)
+    register_search_handlers(app)
+    register_config_handlers(app)
 
     # 🔹 Команда /start
     app.add_handler(CommandHandler("start", start))
 
     # Обработчик всех типов сообщений (текст, фото и т.д.)
     app.add_handler(MessageHandler(filters.ALL, safe_handle))
+    return app
+
+
+def main():
+    setup_logging()
+    # Создаём/обновляем таблицы БД (идемпотентно)
+    init_db()
+
+    if SHARD_WORKERS:
+        from sharding import run_sharded
+
+        logger.info("🤖 Бот запущен: супервизор + %s воркеров...", SHARD_WORKERS)
+        run_sharded(SHARD_WORKERS)
+        return
+
+    app = build_app()
+
+    if UPDATE_MODE == "webhook":
+        from webhook_server import run_webhook
 
-    print("🤖 Бот запущен, слушает группы...")
-    app.run_polling()
+        logger.info("🤖 Бот запущен в режиме webhook...")
+        run_webhook(app)
+    else:
+        logger.info("🤖 Бот запущен, слушает группы...")
+        app.run_polling()
 
 
 if __name__ == "__main__":
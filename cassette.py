@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Запись и воспроизведение внешних вызовов (LLM и загрузка страниц).
+
+    NEUROCAT_CASSETTE_MODE=record  — вызовы идут в сеть, пары запрос/ответ
+                                     и время пишутся в кассету (gzip JSONL);
+    NEUROCAT_CASSETTE_MODE=replay  — ответы берутся из кассеты, сеть не нужна.
+
+Запросы сопоставляются по хэшу нормализованного запроса: дата и время
+вырезаются, поэтому ⚡️ «Сейчас 13.09.2025 09:45» не мешает совпадению.
+NEUROCAT_CASSETTE_MATCH=loose дополнительно игнорирует system-промпты —
+так можно прогнать старый трафик через новый промпт и оценить разницу
+в токенах (входные токены пересчитываются по оценке длины запроса).
+"""
+
+import re
+import os
+import json
+import gzip
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+
+from config import CASSETTE_MODE, CASSETTE_PATH, CASSETTE_MATCH, CASSETTE_REPLAY_LATENCY
+from context_builder import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+_TIME_PATTERNS = [
+    re.compile(r"\d{2}\.\d{2}\.\d{4}(?:,?\s+\d{1,2}:\d{2}(?::\d{2})?)?"),
+    re.compile(r"\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?"),
+]
+
+_lock = threading.Lock()
+_tape = None        # key → список записей (replay)
+_cursor = {}        # key → сколько записей уже отдали
+
+
+class CassetteMiss(Exception):
+    """В кассете нет ответа на такой запрос."""
+
+
+def enabled() -> bool:
+    return CASSETTE_MODE in ("record", "replay")
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        for pattern in _TIME_PATTERNS:
+            value = pattern.sub("<TIME>", value)
+        return value
+    if isinstance(value, dict):
+        if CASSETTE_MATCH == "loose":
+            if "system" in value:
+                value = {k: v for k, v in value.items() if k != "system"}
+            if value.get("role") == "system":
+                return None
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [n for n in (_normalize(v) for v in value) if n is not None]
+    return value
+
+
+def request_key(kind: str, request) -> str:
+    payload = json.dumps(_normalize(request), ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(f"{kind}\n{payload}".encode("utf-8")).hexdigest()
+
+
+def _request_tokens(request) -> int:
+    return estimate_tokens(json.dumps(request, ensure_ascii=False, default=str))
+
+
+def _load_tape():
+    global _tape
+    if _tape is not None:
+        return _tape
+    tape = {}
+    if os.path.exists(CASSETTE_PATH):
+        with gzip.open(CASSETTE_PATH, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    tape.setdefault(entry["key"], []).append(entry)
+    _tape = tape
+    logger.info("📼 Кассета %s: %s записей", CASSETTE_PATH, sum(len(v) for v in tape.values()))
+    return tape
+
+
+def _append(entry):
+    os.makedirs(os.path.dirname(CASSETTE_PATH) or ".", exist_ok=True)
+    line = json.dumps(entry, ensure_ascii=False) + "\n"
+    with _lock:
+        # каждая запись — отдельный gzip-member, файл остаётся читаемым целиком
+        with gzip.open(CASSETTE_PATH, "at", encoding="utf-8") as f:
+            f.write(line)
+
+
+def _lookup(kind, request):
+    key = request_key(kind, request)
+    with _lock:
+        entries = _load_tape().get(key)
+        if not entries:
+            raise CassetteMiss(f"{kind}: запрос {key[:10]} не записан")
+        # одинаковые запросы отдаём по очереди, последний — повторяем
+        i = _cursor.get(key, 0)
+        _cursor[key] = i + 1
+        entry = entries[min(i, len(entries) - 1)]
+
+    response = entry["response"]
+    usage = isinstance(response, dict) and response.get("usage")
+    if usage and CASSETTE_MATCH == "loose":
+        # запрос мог измениться (новый промпт) → сдвигаем входные токены на разницу длины
+        delta = _request_tokens(request) - entry.get("request_tokens", 0)
+        usage = dict(usage, input_tokens=max(usage.get("input_tokens", 0) + delta, 0))
+        response = dict(response, usage=usage)
+    return response, entry.get("elapsed", 0.0)
+
+
+def _record(kind, request, response, elapsed):
+    _append({
+        "kind": kind,
+        "key": request_key(kind, request),
+        "request_tokens": _request_tokens(request),
+        "response": response,
+        "elapsed": round(elapsed, 4),
+        "ts": time.time(),
+    })
+
+
+async def acall(kind: str, request, func):
+    """
+    Асинхронный вызов через кассету. func() — корутина-фабрика, возвращающая
+    JSON-сериализуемый результат. Возвращает (result, elapsed_seconds).
+    """
+    if CASSETTE_MODE == "replay":
+        response, elapsed = _lookup(kind, request)
+        if CASSETTE_REPLAY_LATENCY:
+            await asyncio.sleep(elapsed)
+        return response, elapsed
+
+    started = time.perf_counter()
+    response = await func()
+    elapsed = time.perf_counter() - started
+    if CASSETTE_MODE == "record":
+        _record(kind, request, response, elapsed)
+    return response, elapsed
+
+
+def call(kind: str, request, func):
+    """Синхронный вариант acall (для anthropic.Anthropic)."""
+    if CASSETTE_MODE == "replay":
+        response, elapsed = _lookup(kind, request)
+        if CASSETTE_REPLAY_LATENCY:
+            time.sleep(elapsed)
+        return response, elapsed
+
+    started = time.perf_counter()
+    response = func()
+    elapsed = time.perf_counter() - started
+    if CASSETTE_MODE == "record":
+        _record(kind, request, response, elapsed)
+    return response, elapsed
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+
+from config import (
+    SUMMARY_EVERY_N,
+    SUMMARY_MAX_ROWS,
+    SUMMARY_MODEL,
+    DB_BUSY_TIMEOUT,
+)
+from usage_tracker import extract_usage, record_usage
+from metrics import span, timed
+from clients import get_anthropic
+
+DB_PATH = os.path.join(os.getcwd(), "group_history.db")
+PROMPT_FILE = os.path.join("data", "summary_prompt.txt")
+
+logger = logging.getLogger(__name__)
+
+# chat_id → сколько новых строк с последнего обновления (None = ещё не считали)
+_pending = {}
+_in_flight = set()
+_lock = threading.Lock()
+
+
+def get_db_connection():
+    return sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT)
+
+
+def load_prompt():
+    with open(PROMPT_FILE, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+@timed("sqlite.summary")
+def get_summary(chat_id):
+    """Возвращает (summary, last_history_id) или (None, 0)."""
+    conn = get_db_connection()
+    try:
+        row = conn.execute(
+            "SELECT summary, last_history_id FROM chat_summary WHERE chat_id = ?",
+            (chat_id,),
+        ).fetchone()
+    finally:
+        conn.close()
+    if not row or not row[0]:
+        return None, 0
+    return row[0], row[1] or 0
+
+
+def _count_unsummarized(chat_id) -> int:
+    """Один раз на чат досчитываем, сколько строк накопилось с прошлого резюме."""
+    _, last_id = get_summary(chat_id)
+    conn = get_db_connection()
+    try:
+        return conn.execute(
+            "SELECT COUNT(*) FROM history WHERE chat_id = ? AND id > ?",
+            (chat_id, last_id),
+        ).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def note_new_message(chat_id):
+    """
+    Вызывается после каждой записи в history.
+    Дёшево считает новые строки и, когда их набралось SUMMARY_EVERY_N,
+    запускает обновление резюме фоновой задачей — ответ бота его не ждёт.
+    """
+    with _lock:
+        count = _pending.get(chat_id)
+    if count is None:
+        count = _count_unsummarized(chat_id)
+    else:
+        count += 1
+
+    with _lock:
+        _pending[chat_id] = count
+        if count < SUMMARY_EVERY_N or chat_id in _in_flight:
+            return
+        _in_flight.add(chat_id)
+
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # нет event loop (CLI/скрипты) — просто не обновляем
+        with _lock:
+            _in_flight.discard(chat_id)
+        return
+    loop.create_task(_refresh_in_background(chat_id))
+
+
+async def _refresh_in_background(chat_id):
+    try:
+        await asyncio.to_thread(refresh_summary, chat_id)
+    except Exception as e:
+        logger.warning("⚠️ Ошибка обновления резюме чата %s: %s", chat_id, e)
+    finally:
+        with _lock:
+            _in_flight.discard(chat_id)
+
+
+def refresh_summary(chat_id):
+    """Синхронно обновляет резюме чата по строкам, появившимся после прошлого."""
+    old_summary, last_id = get_summary(chat_id)
+
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            """
+            SELECT h.id, h.role, h.first_name, COALESCE(a.content, h.content)
+            FROM history h
+            LEFT JOIN artifacts a ON a.hash = h.artifact_hash
+            WHERE h.chat_id = ? AND h.id > ?
+            ORDER BY h.id
+            LIMIT ?
+            """,
+            (chat_id, last_id, SUMMARY_MAX_ROWS),
+        ).fetchall()
+    finally:
+        conn.close()
+
+    if not rows:
+        return
+
+    lines = []
+    for _, role, name, content in rows:
+        if not content:
+            continue
+        who = "НейроКот" if role == "assistant" else (name or "?")
+        lines.append(f"{who}: {content[:500]}")
+
+    started = time.perf_counter()
+    with span("anthropic.messages"):
+        response = get_anthropic().messages.create(
+            model=SUMMARY_MODEL,
+            max_tokens=600,
+            temperature=0,
+            system=load_prompt(),
+            messages=[{
+                "role": "user",
+                "content": (
+                    f"Прежнее резюме:\n{old_summary or '(пусто)'}\n\n"
+                    "Новые сообщения:\n" + "\n".join(lines)
+                ),
+            }],
+        )
+    record_usage("summary", SUMMARY_MODEL, extract_usage(response), time.perf_counter() - started, chat_id=chat_id)
+    summary = "".join(b.text for b in response.content if b.type == "text").strip()
+    if not summary:
+        return
+
+    new_last_id = rows[-1][0]
+    conn = get_db_connection()
+    try:
+        conn.execute(
+            """
+            INSERT INTO chat_summary (chat_id, summary, last_history_id, updated)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET
+                summary = excluded.summary,
+                last_history_id = excluded.last_history_id,
+                updated = excluded.updated
+            """,
+            (chat_id, summary, new_last_id, datetime.now()),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    with _lock:
+        # строки, пришедшие во время обновления, остаются в счётчике
+        _pending[chat_id] = max(_pending.get(chat_id, 0) - len(rows), 0)
+    logger.info("🧾 Резюме чата %s обновлено (%s новых строк)", chat_id, len(rows))
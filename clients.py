@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Клиенты внешних API — по одному на провайдера, общие для всех модулей.
+
+openai и anthropic импортируются тяжело (~1–2 с), поэтому клиент создаётся
+при первом обращении: CLI-утилиты (init_group_db, interest test, retention)
+не платят за то, чем не пользуются. Бот при старте вызывает warm_up():
+импорт, создание клиентов и первое соединение с API случаются до того,
+как пошли сообщения.
+
+loadtest и тесты подменяют клиентов через set_client().
+"""
+
+import asyncio
+import logging
+import importlib
+import threading
+
+from config import OPENAI_API_KEY, ANTHROPIC_API_KEY, WARMUP_TIMEOUT, WARMUP_PRELOAD
+
+logger = logging.getLogger(__name__)
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def _build_openai():
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(api_key=OPENAI_API_KEY)
+
+
+def _build_anthropic():
+    import anthropic
+    return anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+
+
+def _build_async_anthropic():
+    import anthropic
+    return anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY)  # для стриминга
+
+
+_BUILDERS = {
+    "openai": _build_openai,
+    "anthropic": _build_anthropic,
+    "async_anthropic": _build_async_anthropic,
+}
+
+
+def _get(name):
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = _BUILDERS[name]()
+    return client
+
+
+def get_openai():
+    """AsyncOpenAI: классификатор интереса, конспект веб-поиска."""
+    return _get("openai")
+
+
+def get_anthropic():
+    """Синхронный Anthropic: ответы (в потоке), резюме беседы."""
+    return _get("anthropic")
+
+
+def get_async_anthropic():
+    """AsyncAnthropic: стриминговые ответы."""
+    return _get("async_anthropic")
+
+
+def set_client(name, client):
+    """Подмена клиента (loadtest, тесты); None — вернуть ленивое создание."""
+    with _lock:
+        if client is None:
+            _clients.pop(name, None)
+        else:
+            _clients[name] = client
+
+
+async def _ping(name, call):
+    try:
+        await asyncio.wait_for(call(), WARMUP_TIMEOUT)
+        logger.info("🔥 %s: соединение установлено", name)
+    except Exception as e:
+        # ответ с ошибкой (ключ, лимиты) тоже прогревает пул соединений
+        logger.info("🔥 %s: прогрев без ответа (%s)", name, type(e).__name__)
+
+
+async def warm_up(network=True):
+    """
+    Импорт тяжёлых модулей и создание клиентов — в потоке, чтобы не стоял event loop;
+    затем (network=True) по лёгкому запросу к каждому API, чтобы пулы уже держали TLS-соединение.
+    """
+    for module in WARMUP_PRELOAD:
+        await asyncio.to_thread(importlib.import_module, module)
+    openai_client = await asyncio.to_thread(get_openai)
+    anthropic_client = await asyncio.to_thread(get_anthropic)
+    async_anthropic = await asyncio.to_thread(get_async_anthropic)
+    if not network:
+        return
+
+    await asyncio.gather(
+        _ping("openai", lambda: openai_client.models.list()),
+        _ping("anthropic", lambda: asyncio.to_thread(anthropic_client.models.list, limit=1)),
+        _ping("anthropic (async)", lambda: async_anthropic.models.list(limit=1)),
+    )
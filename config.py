@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import os
 import datetime
 
 # 🔹 Часовой пояс (смещение в часах от времени сервера)
@@ -55,3 +56,140 @@ TRUSTED_CHANNELS = [
 
 # 🔹 Основной канал (опционально)
 CHANNEL_ID = -1001234567890
+
+# 🔹 Учёт токенов (usage ledger)
+USAGE_FLUSH_SIZE = 20        # сколько записей копим в памяти перед записью в БД
+USAGE_FLUSH_INTERVAL = 30    # макс. секунд между записями в БД
+USAGE_CHECK_INTERVAL = 1     # как часто фоновая задача смотрит, не пора ли писать, с
+
+# 🔹 Цены моделей, $ за 1M токенов: (вход, вход из кэша, выход)
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "claude-3-5-haiku-20241022": (0.80, 0.08, 4.00),
+    "claude-sonnet-4-20250514": (3.00, 0.30, 15.00),
+    "claude-sonnet-4-5-20250929": (3.00, 0.30, 15.00),
+}
+
+# 🔹 Контекст для Claude: бюджет токенов истории по моделям
+CONTEXT_TOKEN_BUDGET = {
+    "claude-3-5-haiku-20241022": 1500,
+    "claude-sonnet-4-20250514": 3000,
+    "claude-sonnet-4-5-20250929": 3000,
+}
+CONTEXT_DEFAULT_BUDGET = 2000
+CONTEXT_FETCH_ROWS = 40        # сколько строк истории берём из БД как кандидатов
+CONTEXT_MAX_ENTRY_TOKENS = 300     # длинное сообщение режем до стольких токенов
+CONTEXT_LOW_VALUE_TOKENS = 60      # неинтересные сообщения и веб-блоки режем сильнее
+
+# 🔹 Резюме беседы (фоновое обновление)
+SUMMARY_EVERY_N = 30           # обновляем резюме каждые N новых строк истории
+SUMMARY_RECENT_TURNS = 8       # сколько свежих строк отправляем вместе с резюме
+SUMMARY_MAX_ROWS = 200         # максимум новых строк за одно обновление
+SUMMARY_MODEL = "claude-3-5-haiku-20241022"
+
+# 🔹 Стриминг ответов Claude (правка сообщения по мере генерации)
+STREAM_REPLIES = False         # True → показываем ответ по кускам
+STREAM_FIRST_CHUNK_CHARS = 60  # после скольких символов отправляем первое сообщение
+STREAM_EDIT_INTERVAL = 1.5     # не чаще одной правки в N секунд (лимиты Telegram)
+
+# 🔹 Метрики (/stats у владельца и Prometheus-текст по HTTP)
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = None            # например 9108; None → HTTP не поднимаем
+
+# 🔹 Запись/воспроизведение вызовов LLM и веба (cassette.py)
+CASSETTE_MODE = os.environ.get("NEUROCAT_CASSETTE_MODE", "off")   # off | record | replay
+CASSETTE_PATH = os.environ.get("NEUROCAT_CASSETTE", os.path.join("cassettes", "default.jsonl.gz"))
+CASSETTE_MATCH = os.environ.get("NEUROCAT_CASSETTE_MATCH", "strict")  # strict | loose (без system-промптов)
+CASSETTE_REPLAY_LATENCY = os.environ.get("NEUROCAT_CASSETTE_LATENCY", "0") == "1"  # ждать записанное время
+
+# 🔹 Сторож event loop (лаг и блокирующие вызовы)
+WATCHDOG_INTERVAL = 0.1        # как часто меряем лаг, сек
+WATCHDOG_THRESHOLD = 0.25      # лаг больше — считаем, что loop был заблокирован
+WATCHDOG_DEBUG = os.environ.get("NEUROCAT_WATCHDOG_DEBUG", "0") == "1"  # снимать стек виновника
+WATCHDOG_REPORT_INTERVAL = 3600  # сводка владельцу раз в N секунд (0 — не слать)
+
+# 🔹 Приём апдейтов: "polling" (getUpdates) или "webhook" (свой HTTP-сервер)
+UPDATE_MODE = "polling"
+WEBHOOK_LISTEN = "127.0.0.1"   # где слушаем (обычно за nginx)
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "/telegram"
+WEBHOOK_URL = None             # публичный https-адрес для setWebhook; None → не регистрируем (локальный тест)
+WEBHOOK_SECRET = os.environ.get("NEUROCAT_WEBHOOK_SECRET", "change-me")  # со значением по умолчанию сервер не стартует
+WEBHOOK_QUEUE_SIZE = 1000      # сколько апдейтов держим в очереди, дальше — 503 (Telegram повторит)
+WEBHOOK_WORKERS = 4            # сколько апдейтов обрабатываем параллельно
+
+# 🔹 Шардирование по процессам: 0 — всё в одном процессе,
+# N > 0 — супервизор + N воркеров, чат → воркер по crc32(chat_id) % N
+SHARD_WORKERS = 0
+SHARD_CHECK_INTERVAL = 5       # как часто проверяем, живы ли воркеры, с
+DB_BUSY_TIMEOUT = 30           # сколько писатель SQLite ждёт блокировку, с (несколько процессов на одной БД)
+
+# 🔹 Приём входящих под нагрузкой (admission.py)
+ADMISSION_WORKERS = 8              # сколько сообщений обрабатываем одновременно
+ADMISSION_MAX_QUEUE = 500          # больше — выкидываем самое неважное
+ADMISSION_MAX_AGE = {              # сколько сообщение может ждать в очереди, с (None — без лимита)
+    "moderation": 600,             # недоверенные: только модерация, потом — в свой класс ниже
+    "reply": 120,
+    "owner": 300,
+    "chatter": 30,
+}
+ADMISSION_DEGRADE_EXTRAS = 50      # очередь длиннее → без веб-поиска и отчётов владельцу
+ADMISSION_DEGRADE_INTEREST = 200   # очередь длиннее → без классификатора, отвечаем только на реплаи, FUN
+
+# 🔹 Бюджет времени на сообщение и предохранители внешних сервисов (resilience.py)
+MESSAGE_DEADLINE = 90          # всё сообщение целиком, с
+STAGE_TIMEOUTS = {             # потолок на отдельный вызов, с (но не больше остатка бюджета)
+    "interest": 15,
+    "vision": 30,
+    "ddg": 10,
+    "fetch": 5,
+    "web_summary": 15,
+    "web_search": 25,
+    "claude": 60,
+    "telegram": 15,
+}
+BREAKER_FAILURES = 5           # столько ошибок подряд → провайдер «выключен»
+BREAKER_RESET = 30             # через столько секунд пробуем снова (один пробный вызов)
+
+# 🔹 Реплики «первым», когда в чате тишина (idle_scheduler.py, промпт data/prompt_idle.txt)
+IDLE_ENABLED = False
+IDLE_AFTER = 3 * 3600          # тишина дольше — пишем первыми, с
+IDLE_JITTER = 30 * 60          # случайная добавка, чтобы не писать «по часам»
+IDLE_QUIET_HOURS = (23, 9)     # ночью не пишем (локальное время get_current_time)
+IDLE_MAX_SILENCE = 7 * 24 * 3600  # совсем заброшенные чаты не будим
+IDLE_CHECK_INTERVAL = 60       # максимальный сон планировщика, с
+
+# 🔹 Поиск по давней истории (FTS5, history_search.py)
+RETRIEVAL_TOP_K = 3            # сколько релевантных старых сообщений подмешивать в контекст Claude
+RETRIEVAL_MAX_TOKENS = 400     # общий бюджет на этот блок
+
+# 🔹 Хранение истории (retention.py): старое уезжает в архив, живая БД остаётся маленькой
+RETENTION_DAYS = 90            # строки history старше — в архив
+ARCHIVE_DIR = "archive"        # gzip JSONL по месяцам: history-2025-09.jsonl.gz
+RETENTION_WINDOW = (3, 6)      # когда чистим (локальные часы get_current_time), ночью
+RETENTION_BATCH = 5000         # строк за транзакцию, чтобы не держать блокировку записи
+RETENTION_VACUUM_PAGES = 5000  # страниц за один PRAGMA incremental_vacuum
+
+# 🔹 Логи (logs.py): очередь + фоновый поток, JSON по строке на запись
+LOG_LEVEL = "INFO"             # DEBUG — включает дампы промптов (с выборкой ниже)
+LOG_JSON = True                # False — обычный текст
+LOG_FILE = None                # None → stderr
+LOG_QUEUE_SIZE = 10000         # записей в очереди; при переполнении лишние выбрасываются
+LOG_DUMP_SAMPLE = 0.05         # доля сообщений, для которых на DEBUG пишем полный промпт/резюме
+
+# 🔹 Старт бота (clients.py): клиенты API создаются лениво, на старте — прогрев
+WARMUP_ENABLED = True          # до начала polling: импорт, клиенты, первое соединение с API
+WARMUP_TIMEOUT = 10            # на каждый пробный запрос, с
+WARMUP_PRELOAD = ("aiohttp", "bs4", "ddgs")  # тяжёлые модули веб-поиска — тоже заранее
+
+# 🔹 Настройки без перезапуска (runtime_config.py): группы, системные ID, каналы, лимиты, задержки.
+# Значения выше — умолчания; файл и переменные NEUROCAT_<КЛЮЧ> их перекрывают.
+RUNTIME_CONFIG_PATH = os.path.join("data", "runtime_config.json")
+RUNTIME_CONFIG_CHECK_INTERVAL = 5   # как часто смотрим mtime файла, с
+
+# 🔹 Фоновые задачи (background.py): реакции и отчёты владельцу не задерживают ответ
+BACKGROUND_MAX_TASKS = 200     # больше одновременно — новые выбрасываются
+BACKGROUND_FLUSH_TIMEOUT = 10  # сколько ждём их при остановке бота, с
+
+# 🔹 Склейка одинаковых одновременных запросов (singleflight.py): веб-поиск и классификатор
+COALESCE_MIN_TEXT = 20         # текст короче классифицируем отдельно — его смысл в истории чата
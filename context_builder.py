@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from config import (
+    CONTEXT_TOKEN_BUDGET,
+    CONTEXT_DEFAULT_BUDGET,
+    CONTEXT_MAX_ENTRY_TOKENS,
+    CONTEXT_LOW_VALUE_TOKENS,
+)
+from artifacts import ARTIFACT_LABELS, artifact_hash
+
+ARTIFACT_SOURCES = set(ARTIFACT_LABELS)  # source строк history, где лежат артефакты
+
+
+def estimate_tokens(text) -> int:
+    """
+    Быстрая локальная оценка числа токенов без токенизатора.
+    ASCII ≈ 4 символа на токен, кириллица и прочее ≈ 2.5 символа на токен.
+    Считаем через длину UTF-8: каждый не-ASCII символ даёт лишние байты.
+    """
+    if not text:
+        return 0
+    if not isinstance(text, str):
+        # контент со списком блоков (фото + текст) — считаем только текст
+        return sum(estimate_tokens(b.get("text", "")) for b in text if isinstance(b, dict))
+    chars = len(text)
+    extra = len(text.encode("utf-8")) - chars
+    non_ascii = min(extra, chars)
+    return int((chars - non_ascii) / 4 + non_ascii / 2.5) + 1
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Обрезает текст примерно до max_tokens токенов."""
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    keep = int(len(text) * max_tokens / tokens)
+    return text[:keep].rstrip() + "…"
+
+
+def get_budget(model) -> int:
+    return CONTEXT_TOKEN_BUDGET.get(model, CONTEXT_DEFAULT_BUDGET)
+
+
+def format_entry(role, name, content, is_interesting):
+    """Строка истории → сообщение для Claude (как раньше в get_chat_history)."""
+    if role == "assistant":
+        return {"role": "assistant", "content": content}
+
+    if is_interesting == 1:
+        interest_text = "(✨ помечено как интересное)"
+    elif is_interesting == 0:
+        interest_text = "(😴 помечено как неинтересное)"
+    else:
+        interest_text = "(без оценки)"
+    return {"role": "user", "content": f"{name}: {content} {interest_text}"}
+
+
+def merge_turns(messages):
+    """Склеивает подряд идущие реплики одной роли в одну."""
+    merged = []
+    for m in messages:
+        if merged and merged[-1]["role"] == m["role"]:
+            prev = merged[-1]["content"]
+            cur = m["content"]
+            if isinstance(prev, str) and isinstance(cur, str):
+                merged[-1] = {"role": m["role"], "content": f"{prev}\n{cur}"}
+            else:
+                # есть блоки (фото) → приводим обе части к списку блоков
+                blocks = prev if isinstance(prev, list) else [{"type": "text", "text": prev}]
+                blocks = blocks + (cur if isinstance(cur, list) else [{"type": "text", "text": cur}])
+                merged[-1] = {"role": m["role"], "content": blocks}
+        else:
+            merged.append(dict(m))
+    return merged
+
+
+def build_context(rows, final_message=None, model=None, skip_texts=()):
+    """
+    Собирает историю для Claude в рамках бюджета токенов модели.
+
+    rows — записи records.HistoryEntry от старых к новым.
+    final_message — последнее сообщение, на которое отвечаем; всегда идёт целиком.
+    skip_texts — тексты, которые уже есть в системном промпте (веб-резюме),
+    их повтор в истории выкидываем.
+
+    Каждый артефакт (веб-резюме, анализ фото) попадает в контекст не больше
+    одного раза — берётся самое свежее упоминание.
+
+    Возвращает (messages, stats); stats["ids"] — history.id строк, попавших в контекст.
+    """
+    budget = get_budget(model)
+    seen_artifacts = {artifact_hash(t) for t in skip_texts if t}
+
+    used = estimate_tokens(final_message["content"]) if final_message else 0
+    raw = used
+    picked = []
+    ids = []
+    dropped = truncated = 0
+
+    # идём от новых к старым, пока влезает
+    for row in reversed(rows):
+        content, source, is_interesting, digest = row.content, row.source, row.is_interesting, row.artifact_hash
+        if not content:
+            continue
+        raw += estimate_tokens(content)
+
+        if digest or source in ARTIFACT_SOURCES:
+            # строки до появления таблицы artifacts хэшируем по тексту
+            key = digest or artifact_hash(content)
+            if key in seen_artifacts:
+                dropped += 1
+                continue
+            seen_artifacts.add(key)
+
+        low_value = source == "web" or is_interesting == 0
+        limit = CONTEXT_LOW_VALUE_TOKENS if low_value else CONTEXT_MAX_ENTRY_TOKENS
+        short = truncate_to_tokens(content, limit)
+        if short is not content:
+            truncated += 1
+
+        entry = format_entry(row.role, row.first_name, short, is_interesting)
+        cost = estimate_tokens(entry["content"])
+        if used + cost > budget:
+            dropped += 1
+            if low_value:
+                continue  # малоценное пропускаем, может влезет что-то старше
+            break
+        used += cost
+        picked.append(entry)
+        if row.id is not None:
+            ids.append(row.id)
+
+    picked.reverse()
+    if final_message:
+        picked.append(final_message)
+
+    stats = {"raw_tokens": raw, "tokens": used, "dropped": dropped, "truncated": truncated, "ids": ids}
+    return merge_turns(picked), stats
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Поиск по всей истории чата через FTS5 (таблица history_fts, см. init_group_db.py).
+
+Сообщения, которые уже попали в контекст Claude, поиск пропускает (по id);
+отсюда берутся давние, но релевантные вопросу (BM25, top-k) —
+«а что мы решили на прошлой неделе?».
+Владельцу доступна команда /find.
+"""
+
+import os
+import re
+import asyncio
+import logging
+import sqlite3
+from telegram import Update
+from telegram.ext import ContextTypes, CommandHandler
+
+from config import OWNER_ID, RETRIEVAL_TOP_K, RETRIEVAL_MAX_TOKENS, DB_BUSY_TIMEOUT
+from context_builder import estimate_tokens, truncate_to_tokens
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.path.join(os.getcwd(), "group_history.db")
+
+# частые слова, по которым искать бессмысленно
+STOP_WORDS = {
+    "это", "как", "что", "так", "вот", "там", "тут", "где", "когда", "кто", "для",
+    "или", "если", "есть", "был", "была", "было", "были", "уже", "еще", "ещё", "мне",
+    "меня", "тебя", "тебе", "его", "она", "они", "оно", "мы", "вы", "ты", "все", "всё",
+    "нет", "да", "ну", "же", "ли", "бы", "по", "на", "не", "то", "за", "из", "от",
+    "про", "под", "над", "при", "без", "кот", "котик", "нейрокот",
+    "the", "and", "for", "you", "are", "what", "how",
+}
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def get_db_connection():
+    return sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT)
+
+
+def build_fts_query(text: str, max_terms: int = 8):
+    """
+    Текст вопроса → выражение MATCH: значимые слова через OR.
+    Длинные слова ищем по префиксу (грубая замена стемминга для русских окончаний).
+    """
+    terms = []
+    for word in _WORD_RE.findall((text or "").lower()):
+        if len(word) < 3 or word in STOP_WORDS or word.isdigit():
+            continue
+        term = f'"{word[:-2]}"*' if len(word) > 6 else f'"{word}"'
+        if term not in terms:
+            terms.append(term)
+    if not terms:
+        return None
+    return " OR ".join(terms[:max_terms])
+
+
+@timed("sqlite.fts_search")
+def search_history(chat_id, text, k=RETRIEVAL_TOP_K, exclude_ids=()):
+    """
+    Top-k сообщений чата, релевантных text (BM25), кроме exclude_ids
+    (строки, которые уже в контексте). Возвращает [(id, created, first_name, role, content), ...]
+    от старых к новым.
+    """
+    query = build_fts_query(text)
+    if not query:
+        return []
+
+    exclude_ids = list(exclude_ids)
+    sql = """
+        SELECT h.id, h.created, h.first_name, h.role, h.content
+        FROM history_fts
+        JOIN history h ON h.id = history_fts.rowid
+        WHERE history_fts MATCH ? AND h.chat_id = ?
+    """
+    if exclude_ids:
+        sql += f" AND h.id NOT IN ({', '.join('?' * len(exclude_ids))})"
+    sql += " ORDER BY bm25(history_fts) LIMIT ?"
+
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(sql, (query, chat_id, *exclude_ids, k)).fetchall()
+    except sqlite3.OperationalError as e:
+        logger.warning("⚠️ FTS-поиск не удался: %s", e)
+        return []
+    finally:
+        conn.close()
+    return sorted(rows)
+
+
+def format_retrieved(rows, max_tokens=RETRIEVAL_MAX_TOKENS) -> str:
+    """Найденные сообщения → блок для системного промпта в рамках бюджета токенов."""
+    if not rows:
+        return ""
+    per_entry = max(max_tokens // len(rows), 40)
+    lines = []
+    used = 0
+    for _, created, name, role, content in rows:
+        who = "НейроКот" if role == "assistant" else (name or "?")
+        line = f"- [{str(created)[:10]}] {who}: {truncate_to_tokens(content or '', per_entry)}"
+        used += estimate_tokens(line)
+        if used > max_tokens:
+            break
+        lines.append(line)
+    return "\n".join(lines)
+
+
+# ------------------ команды ------------------
+
+async def find_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/find [archive] [chat_id] слова — поиск по всей истории (только владелец)"""
+    if update.message.chat.id != OWNER_ID:
+        return
+
+    args = list(context.args or [])
+    in_archive = bool(args) and args[0] == "archive"
+    if in_archive:
+        args.pop(0)
+    chat_id = None
+    if args and re.fullmatch(r"-?\d+", args[0]):
+        chat_id = int(args.pop(0))
+
+    if in_archive:
+        await _find_in_archive(update, args, chat_id)
+        return
+    query = build_fts_query(" ".join(args), max_terms=12)
+    if not query:
+        await update.message.reply_text("Использование: /find [chat_id] слова для поиска")
+        return
+
+    try:
+        rows = await asyncio.to_thread(_find_rows, query, chat_id)
+    except sqlite3.OperationalError as e:
+        logger.warning("⚠️ /find: FTS-поиск не удался: %s", e)
+        await update.message.reply_text(f"⚠️ Поиск не удался: {e}")
+        return
+
+    if not rows:
+        await update.message.reply_text("🔍 Ничего не найдено.")
+        return
+    lines = [f"🔍 {query}"]
+    for cid, created, name, snippet in rows:
+        lines.append(f"\n💬 {cid} | {str(created)[:16]} | {name or '?'}\n{snippet}")
+    text = "\n".join(lines)
+    for i in range(0, len(text), 3500):
+        await update.message.reply_text(text[i:i + 3500])
+
+
+@timed("sqlite.fts_find")
+def _find_rows(query, chat_id=None):
+    sql = """
+        SELECT h.chat_id, h.created, h.first_name,
+               snippet(history_fts, 0, '«', '»', '…', 16)
+        FROM history_fts
+        JOIN history h ON h.id = history_fts.rowid
+        WHERE history_fts MATCH ?
+    """
+    params = [query]
+    if chat_id is not None:
+        sql += " AND h.chat_id = ?"
+        params.append(chat_id)
+    sql += " ORDER BY bm25(history_fts) LIMIT 10"
+
+    conn = get_db_connection()
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+async def _find_in_archive(update, words, chat_id):
+    from retention import search_archive
+
+    if not words:
+        await update.message.reply_text("Использование: /find archive [chat_id] слова")
+        return
+    rows = await asyncio.to_thread(search_archive, words, chat_id)
+    if not rows:
+        await update.message.reply_text("🗄 В архиве ничего не найдено.")
+        return
+    lines = [f"🗄 Архив: {' '.join(words)}"]
+    for row in rows:
+        content = row.get("content") or ""
+        lines.append(
+            f"\n💬 {row.get('chat_id')} | {str(row.get('created'))[:16]} | {row.get('first_name') or '?'}\n"
+            f"{content[:300]}"
+        )
+    text = "\n".join(lines)
+    for i in range(0, len(text), 3500):
+        await update.message.reply_text(text[i:i + 3500])
+
+
+def register_search_handlers(app):
+    app.add_handler(CommandHandler("find", find_command))
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Планировщик реплик «первым», когда в чате тишина (IDLE_ENABLED в config.py).
+
+Для каждого чата храним момент, когда он «затихнет»: время последнего
+сообщения человека + IDLE_AFTER + случайный джиттер. Моменты лежат в куче,
+save_message() обновляет их за O(log n); старые записи кучи не удаляем,
+а пропускаем при извлечении (ленивое удаление) и изредка перестраиваем кучу.
+Планировщик спит до ближайшего момента и будит только те чаты, чей срок
+подошёл — БД не опрашивается.
+
+Ответы кота и собственные idle-реплики чат не «взводят»: после idle-сообщения
+следующая реплика будет только после нового сообщения человека.
+"""
+
+import time
+import heapq
+import random
+import asyncio
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+import metrics
+import runtime_config
+from config import (
+    IDLE_AFTER,
+    IDLE_JITTER,
+    IDLE_QUIET_HOURS,
+    IDLE_MAX_SILENCE,
+    IDLE_CHECK_INTERVAL,
+    DB_BUSY_TIMEOUT,
+    get_current_time,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class IdleScheduler:
+    def __init__(self, idle_after=IDLE_AFTER, jitter=IDLE_JITTER):
+        self.idle_after = idle_after
+        self.jitter = jitter
+        self._heap = []   # (due, chat_id), в т.ч. устаревшие
+        self._due = {}    # chat_id → актуальный due
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._due)
+
+    def schedule(self, chat_id, due: float):
+        with self._lock:
+            self._due[chat_id] = due
+            heapq.heappush(self._heap, (due, chat_id))
+            # устаревших записей накопилось много → перестраиваем кучу
+            if len(self._heap) > 2 * len(self._due) + 64:
+                self._heap = [(d, c) for c, d in self._due.items()]
+                heapq.heapify(self._heap)
+
+    def touch(self, chat_id, ts: float = None):
+        """Сообщение человека: чат затихнет через IDLE_AFTER (+джиттер) от ts."""
+        ts = time.time() if ts is None else ts
+        self.schedule(chat_id, ts + self.idle_after + random.uniform(0, self.jitter))
+
+    def cancel(self, chat_id):
+        with self._lock:
+            self._due.pop(chat_id, None)
+
+    def _drop_stale(self):
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def next_due(self):
+        with self._lock:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float = None):
+        """Чаты, чей срок подошёл (снимаются с учёта до следующего touch)."""
+        now = time.time() if now is None else now
+        due_chats = []
+        with self._lock:
+            while True:
+                self._drop_stale()
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                _, chat_id = heapq.heappop(self._heap)
+                del self._due[chat_id]
+                due_chats.append(chat_id)
+        return due_chats
+
+
+_scheduler = IdleScheduler()
+
+
+def touch(chat_id, ts: float = None):
+    _scheduler.touch(chat_id, ts)
+
+
+def quiet_seconds_left() -> float:
+    """Сколько секунд осталось до конца «тихих часов» (0 — сейчас можно писать)."""
+    start, end = IDLE_QUIET_HOURS
+    now = datetime.strptime(get_current_time("%Y-%m-%d %H:%M:%S"), "%Y-%m-%d %H:%M:%S")
+    hour = now.hour
+    quiet = (start <= hour or hour < end) if start > end else (start <= hour < end)
+    if not quiet:
+        return 0.0
+    wake = now.replace(hour=end, minute=0, second=0)
+    if wake <= now:
+        wake += timedelta(days=1)
+    return (wake - now).total_seconds()
+
+
+def seed_from_db(db_path, owns=None, scheduler=None):
+    """
+    Стартовое состояние из БД: по последнему сообщению каждого чата.
+    Чат, где последним было idle-сообщение кота, не взводим.
+    owns(chat_id) — фильтр для шардов (воркер планирует только свои чаты).
+    """
+    scheduler = scheduler or _scheduler
+    now = time.time()
+    conn = sqlite3.connect(db_path, timeout=DB_BUSY_TIMEOUT)
+    try:
+        for chat_id in runtime_config.current().allowed_groups:
+            if owns and not owns(chat_id):
+                continue
+            row = conn.execute(
+                """
+                SELECT created, source, role FROM history
+                WHERE chat_id = ?
+                ORDER BY created DESC
+                LIMIT 1
+                """,
+                (chat_id,),
+            ).fetchone()
+            if not row or row[1] == "idle":
+                continue
+            try:
+                ts = datetime.fromisoformat(str(row[0])).timestamp()
+            except ValueError:
+                continue
+            if now - ts > IDLE_MAX_SILENCE:
+                continue
+            scheduler.touch(chat_id, ts)
+    finally:
+        conn.close()
+    logger.info("💤 Idle-планировщик: отслеживаем %s чатов", len(scheduler))
+
+
+async def post_idle(bot, chat_id):
+    from responder_claude import generate_idle_message
+    from message_handler import save_message
+
+    text = await asyncio.to_thread(generate_idle_message, chat_id)
+    if not text:
+        return
+    sent = await bot.send_message(chat_id=chat_id, text=text)
+    save_message(chat_id, sent.message_id, 0, "Neurocat", "assistant", text, source="idle")
+    metrics.inc("idle.posted")
+    logger.info("💬 Idle-сообщение в чат %s: %s", chat_id, text[:80])
+
+
+async def run(bot, scheduler=None):
+    """Фоновая задача: спит до ближайшего срока и будит подошедшие чаты."""
+    scheduler = scheduler or _scheduler
+    while True:
+        next_due = scheduler.next_due()
+        delay = IDLE_CHECK_INTERVAL if next_due is None else min(max(next_due - time.time(), 0), IDLE_CHECK_INTERVAL)
+        await asyncio.sleep(delay)
+
+        for chat_id in scheduler.pop_due():
+            wait = quiet_seconds_left()
+            if wait:
+                # ночь → переносим на утро (с джиттером)
+                scheduler.schedule(chat_id, time.time() + wait + random.uniform(0, scheduler.jitter))
+                metrics.inc("idle.deferred_quiet")
+                continue
+            try:
+                await post_idle(bot, chat_id)
+            except Exception as e:
+                logger.error("❌ Ошибка idle-сообщения в чат %s: %s", chat_id, e)
@@ -4,13 +4,22 @@
 import sqlite3
 import os
 
+from config import DB_BUSY_TIMEOUT
+
 DB_PATH = os.path.join(os.getcwd(), "group_history.db")
 
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT)
     cursor = conn.cursor()
 
+    # Освобождённые страницы возвращаются порциями (retention.py), без полного VACUUM.
+    # На новой базе действует сразу, на старой — после одного `python retention.py --vacuum-full`.
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+
+    # WAL: читатели не блокируют запись (режим сохраняется в файле БД)
+    cursor.execute("PRAGMA journal_mode=WAL")
+
     # Таблица пользователей
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -41,6 +50,113 @@ def init_db():
         )
     """)
 
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_history_chat_created ON history (chat_id, created)
+    """)
+
+    # Крупные производные тексты (веб-резюме, анализ фото) по sha256, см. artifacts.py
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS artifacts (
+            hash TEXT PRIMARY KEY,
+            kind TEXT,
+            content TEXT,
+            created TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    history_columns = {row[1] for row in cursor.execute("PRAGMA table_info(history)")}
+    if "artifact_hash" not in history_columns:
+        cursor.execute("ALTER TABLE history ADD COLUMN artifact_hash TEXT")
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_history_artifact ON history (artifact_hash)
+        WHERE artifact_hash IS NOT NULL
+    """)
+
+    # Полнотекстовый индекс по history.content (FTS5, external content):
+    # сам текст не дублируется, индекс поддерживают триггеры
+    fts_exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'history_fts'"
+    ).fetchone()
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+            content,
+            content='history',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS history_fts_ai AFTER INSERT ON history BEGIN
+            INSERT INTO history_fts(rowid, content) VALUES (new.id, new.content);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS history_fts_ad AFTER DELETE ON history BEGIN
+            INSERT INTO history_fts(history_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS history_fts_au AFTER UPDATE OF content ON history BEGIN
+            INSERT INTO history_fts(history_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO history_fts(rowid, content) VALUES (new.id, new.content);
+        END
+    """)
+    if not fts_exists:
+        # индекс появился на уже заполненной базе → строим по существующим строкам
+        cursor.execute("INSERT INTO history_fts(history_fts) VALUES ('rebuild')")
+
+    # Резюме беседы по чатам (обновляется в фоне)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chat_summary (
+            chat_id INTEGER PRIMARY KEY,
+            summary TEXT,
+            last_history_id INTEGER DEFAULT 0,
+            updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Журнал вызовов LLM (токены + задержка)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS usage_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            chat_id INTEGER,
+            user_id INTEGER,
+            model TEXT,
+            stage TEXT,
+            input_tokens INTEGER DEFAULT 0,
+            output_tokens INTEGER DEFAULT 0,
+            cached_tokens INTEGER DEFAULT 0,
+            latency_ms INTEGER DEFAULT 0
+        )
+    """)
+
+    # Агрегаты по дням (обновляются инкрементально при записи журнала)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS usage_daily (
+            day TEXT,
+            chat_id INTEGER,
+            model TEXT,
+            stage TEXT,
+            calls INTEGER DEFAULT 0,
+            input_tokens INTEGER DEFAULT 0,
+            output_tokens INTEGER DEFAULT 0,
+            cached_tokens INTEGER DEFAULT 0,
+            latency_ms INTEGER DEFAULT 0,
+            PRIMARY KEY (day, chat_id, model, stage)
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS usage_user_daily (
+            day TEXT,
+            user_id INTEGER,
+            calls INTEGER DEFAULT 0,
+            input_tokens INTEGER DEFAULT 0,
+            output_tokens INTEGER DEFAULT 0,
+            PRIMARY KEY (day, user_id)
+        )
+    """)
+
     conn.commit()
     conn.close()
     print("✅ База данных инициализирована:", DB_PATH)
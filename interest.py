@@ -5,31 +5,40 @@ import os
 import re
 import sqlite3
 import json
+import gzip
 import asyncio
-from openai import AsyncOpenAI
+import logging
 from telegram import Update
 from telegram.ext import ContextTypes
-from config import OWNER_ID, OPENAI_API_KEY, get_current_time
+from config import OWNER_ID, COALESCE_MIN_TEXT, DB_BUSY_TIMEOUT, get_current_time
+from clients import get_openai
+from usage_tracker import extract_usage, record_usage, run_flusher as run_usage_flusher
+from prompt_cache import read_prompt
+from metrics import span, timed
+from resilience import CircuitOpen, call_async, stage_timeout
+import cassette
+from singleflight import SingleFlight, normalize
+from records import InterestResult
 
 # Подключение OpenAI
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
-
 DB_PATH = os.path.join(os.getcwd(), "group_history.db")
 PROMPT_FILE = os.path.join("data", "interest_prompt.txt")
 
+logger = logging.getLogger(__name__)
+
 # ✅ Разрешённые реакции (Telegram)
 ALLOWED_REACTIONS = ["👍","👎","❤️","🔥","🥰","😁","🤔","😢","😱","🤬","🎉","🙏"]
 
 
 def load_prompt():
-    with open(PROMPT_FILE, "r", encoding="utf-8") as f:
-        return f.read()
+    return read_prompt(PROMPT_FILE)
 
 
 def get_db_connection():
-    return sqlite3.connect(DB_PATH)
+    return sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT)
 
 
+@timed("sqlite.recent_messages")
 def get_recent_messages(chat_id: int, limit: int = 3):
     conn = get_db_connection()
     cur = conn.cursor()
@@ -45,6 +54,11 @@ def get_recent_messages(chat_id: int, limit: int = 3):
     return rows[::-1]
 
 
+def format_history(rows) -> str:
+    """Строки (user_id, role, content, created) → текст истории для промпта."""
+    return "\n".join([f"[{row[3]}] user_id={row[0]} role={row[1]}: {row[2]}" for row in rows])
+
+
 def _is_channel_message(msg) -> bool:
     """Определяем, что сообщение связано с каналом (написано от имени канала или переслано)."""
     try:
@@ -107,34 +121,108 @@ def _pick_model_heuristic(text: str) -> str:
     return "FUN"
 
 
-async def analyze_message(message_text: str, chat_id: int = None, msg=None):
+def replied_to_bot(msg) -> bool:
+    reply = getattr(msg, "reply_to_message", None)
+    return bool(reply and reply.from_user and reply.from_user.is_bot)
+
+
+def fallback_result(message_text: str, msg=None, model: str = None) -> InterestResult:
+    """
+    Решение без GPT (перегрузка или OpenAI недоступен):
+    отвечаем только на реплаи коту и посты каналов, без поиска.
+    """
+    interesting = replied_to_bot(msg) or bool(msg and _is_channel_message(msg))
+    return InterestResult(
+        interest="YES" if interesting else "NO",
+        model=model or _pick_model_heuristic(message_text or ""),
+    )
+
+
+_flights = SingleFlight("interest")
+
+
+async def analyze_message(
+    message_text: str,
+    chat_id: int = None,
+    msg=None,
+    user_id: int = None,
+    history_text: str = None,
+    meta: dict = None,
+    deadline=None,
+) -> InterestResult:
     """
     Анализирует сообщение: INTEREST, REACTION, SEARCH, QUERY, MODEL
     GPT — главный источник решения; эвристика применяется только как fallback.
+
+    history_text — готовая история (пакетный режим); иначе берём 3 последних из БД.
+    meta — если передан словарь, в него кладём usage и elapsed вызова
+    (usage пустой, если вызов склеен с чужим — см. singleflight).
+    deadline — бюджет сообщения (resilience.Deadline); если задан, то при
+    таймауте или отключённом OpenAI возвращаем fallback_result вместо ошибки.
+
+    Одинаковый текст, пришедший одновременно в несколько групп, классифицируется
+    одним запросом (с историей той группы, где он появился первым). Короткие
+    реплики («да», «лол») не склеиваем: их смысл целиком в истории чата.
     """
+    explicit_history = history_text is not None
     channel_hint = bool(msg and _is_channel_message(msg))
 
+    # Промпт из файла идёт первым и байт-в-байт одинаков → OpenAI кэширует префикс.
+    # Время и история — только после него.
     system_prompt = load_prompt()
-    system_prompt = f"{system_prompt}\n\n⚡️ Сейчас {get_current_time()} (локальное время НейроКота)."
+    now_text = f"⚡️ Сейчас {get_current_time()} (локальное время НейроКота)."
 
-    history_text = ""
-    if chat_id:
-        history = get_recent_messages(chat_id, limit=3)
-        history_text = "\n".join([f"[{row[3]}] user_id={row[0]} role={row[1]}: {row[2]}" for row in history])
+    if history_text is None:
+        history_text = ""
+        if chat_id:
+            history = get_recent_messages(chat_id, limit=3)
+            history_text = format_history(history)
 
-    resp = await client.chat.completions.create(
+    request = dict(
         model="gpt-4o-mini",
         temperature=0,
         messages=[
             {"role":"system","content":system_prompt},
-            {"role":"system","content":f"История последних сообщений:\n{history_text}"},
+            {"role":"system","content":f"{now_text}\n\nИстория последних сообщений:\n{history_text}"},
             {"role":"user","content":message_text},
-        ]
+        ],
     )
 
-    raw = resp.choices[0].message.content.strip()
+    async def _call():
+        timeout = stage_timeout(deadline, "interest")
+        with span("openai.chat"):
+            resp = await call_async("openai", lambda: get_openai().chat.completions.create(
+                **request,
+                extra_body={"prompt_cache_key": "interest"},
+                timeout=timeout,
+            ), timeout)
+        return {"text": resp.choices[0].message.content, "usage": extract_usage(resp)}
+
+    coalesced = False
+    try:
+        if len(message_text or "") >= COALESCE_MIN_TEXT:
+            # в пакетном режиме история — часть ключа: разметка не должна зависеть от соседей
+            key = (normalize(message_text), history_text if explicit_history else None)
+            (reply, elapsed), coalesced = await _flights.do(
+                key, lambda: cassette.acall("interest", request, _call)
+            )
+        else:
+            reply, elapsed = await cassette.acall("interest", request, _call)
+    except (CircuitOpen, asyncio.TimeoutError) as e:
+        if deadline is None:
+            raise
+        logger.warning("⚠️ Классификатор недоступен (%s), решаем эвристикой", type(e).__name__)
+        return fallback_result(message_text, msg)
+
+    if not coalesced:  # запрос был один — и учитываем его один раз
+        record_usage("interest", "gpt-4o-mini", reply["usage"], elapsed, chat_id=chat_id, user_id=user_id)
+    if meta is not None:
+        # склеенному вызову токены не пишем: их уже посчитал тот, кто делал запрос
+        meta.update(usage={} if coalesced else reply["usage"], elapsed=elapsed)
+
+    raw = reply["text"].strip()
     if os.environ.get("SHOW_RAW", "").strip() == "1":
-        print("\n🔎 RAW GPT ANSWER:", raw)
+        logger.info("🔎 RAW GPT ANSWER: %s", raw)
 
     # Значения по умолчанию
     result = {"INTEREST":"NO","REACTION":["🤔"],"SEARCH":"NO","QUERY":"","MODEL":"FUN"}
@@ -167,14 +255,14 @@ async def analyze_message(message_text: str, chat_id: int = None, msg=None):
             # не словарь → fallback
             result["MODEL"] = _pick_model_heuristic(message_text or "")
     except Exception as e:
-        print(f"⚠️ Ошибка парсинга JSON: {e}")
+        logger.warning("⚠️ Ошибка парсинга JSON: %s", e)
         # полностью fallback
         result["MODEL"] = _pick_model_heuristic(message_text or "")
 
     if channel_hint:
         result["INTEREST"] = "YES"
 
-    return result
+    return InterestResult.from_dict(result)
 
 
 def format_author_info(msg):
@@ -191,8 +279,8 @@ def format_author_info(msg):
         return "❓ Неизвестный отправитель"
 
 
-async def report_interest(update: Update, context: ContextTypes.DEFAULT_TYPE, result: dict):
-    """Шлёт админу отчёт о проверке интересности + сохраняет оценку в БД."""
+async def report_interest(update: Update, context: ContextTypes.DEFAULT_TYPE, result: InterestResult, notify: bool = True):
+    """Шлёт админу отчёт о проверке интересности + сохраняет оценку в БД (notify=False — только БД)."""
     msg = update.message
     if not msg:
         return
@@ -201,18 +289,19 @@ async def report_interest(update: Update, context: ContextTypes.DEFAULT_TYPE, re
     message_id = msg.message_id
     text = msg.text or msg.caption or "[без текста]"
 
-    interesting = (result.get("INTEREST") == "YES")
-    reactions = result.get("REACTION", [])
+    interesting = result.interesting
+    reactions = list(result.reaction)
 
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
+    with span("sqlite.update_interest"):
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("""
         UPDATE history
         SET is_interesting = ?, reaction = ?
         WHERE chat_id = ? AND message_id = ?
     """, (1 if interesting else 0, ",".join(reactions), chat_id, message_id))
-    conn.commit()
-    conn.close()
+        conn.commit()
+        conn.close()
 
     status = "✨ ИНТЕРЕСНОЕ" if interesting else "😴 НЕИНТЕРЕСНОЕ"
     preview = text if len(text) <= 400 else text[:400] + "…"
@@ -221,15 +310,241 @@ async def report_interest(update: Update, context: ContextTypes.DEFAULT_TYPE, re
         f"Отправитель: {format_author_info(msg)}\n\n"
         f"Текст: {preview}\n"
         f"🟢 Реакция: {reactions}\n"
-        f"🌍 Поиск: {result.get('SEARCH')} | Запрос: {result.get('QUERY') or '—'}\n"
-        f"🤖 Модель: {result.get('MODEL')}"
+        f"🌍 Поиск: {result.search} | Запрос: {result.query or '—'}\n"
+        f"🤖 Модель: {result.model}"
     )
 
-    if not interesting:
+    if notify and not interesting:
         try:
-            await context.bot.send_message(chat_id=OWNER_ID, text=msg_info)
+            with span("telegram.send_message"):
+                await context.bot.send_message(chat_id=OWNER_ID, text=msg_info)
         except Exception as e:
-            print(f"⚠️ Ошибка при отправке отчёта админу: {e}")
+            logger.warning("⚠️ Ошибка при отправке отчёта админу: %s", e)
+
+
+# ==============================
+# 📦 Пакетная переоценка (история из БД или JSONL)
+# ==============================
+def iter_db_messages(chat_id=None, since=None, until=None):
+    """
+    Сообщения пользователей из group_history.db (по одному, без загрузки всей таблицы).
+    from_db=True — id это history.id живой БД, по нему run_batch берёт историю (history_before).
+    """
+    sql = """
+        SELECT id, chat_id, user_id, content, created, is_interesting
+        FROM history
+        WHERE role = 'user' AND COALESCE(source, 'chat') = 'chat'
+          AND content IS NOT NULL AND content != ''
+    """
+    params = []
+    if chat_id is not None:
+        sql += " AND chat_id = ?"
+        params.append(chat_id)
+    if since:
+        sql += " AND created >= ?"
+        params.append(since)
+    if until:
+        sql += " AND created < ?"
+        params.append(until)
+    sql += " ORDER BY id"
+
+    conn = get_db_connection()
+    try:
+        for row in conn.execute(sql, params):
+            yield {
+                "id": row[0], "chat_id": row[1], "user_id": row[2],
+                "text": row[3], "created": row[4], "is_interesting": row[5],
+                "from_db": True,
+            }
+    finally:
+        conn.close()
+
+
+def iter_jsonl_messages(path):
+    """JSONL (или .jsonl.gz): {"id", "text", "chat_id"?, "is_interesting"?} — id по умолчанию номер строки."""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            if line.strip():
+                item = json.loads(line)
+                item.setdefault("id", n)
+                yield item
+
+
+def history_before(chat_id, row_id, limit=3):
+    """История для сообщения из прошлого: limit строк чата перед ним."""
+    conn = get_db_connection()
+    try:
+        rows = conn.execute("""
+            SELECT user_id, role, content, created
+            FROM history
+            WHERE chat_id = ? AND id < ?
+            ORDER BY id DESC
+            LIMIT ?
+        """, (chat_id, row_id, limit)).fetchall()
+    finally:
+        conn.close()
+    return format_history(rows[::-1])
+
+
+def _done_ids(out_path):
+    """id, уже успешно обработанные в прошлых запусках (для продолжения)."""
+    done = set()
+    if os.path.exists(out_path):
+        with open(out_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    continue  # недописанная строка после обрыва
+                if "error" not in item:
+                    done.add(item["id"])
+    return done
+
+
+async def run_batch(items, out_path, concurrency=8, with_history=True, retries=3):
+    """
+    Классифицирует сообщения параллельно (не больше concurrency запросов сразу),
+    результаты сразу дописываются в out_path. Уже обработанные id пропускаются.
+    История из БД — только для сообщений из iter_db_messages: у JSONL id — номер
+    строки, у архива — id строки, которой в живой БД уже нет.
+    """
+    done = _done_ids(out_path)
+    sem = asyncio.Semaphore(concurrency)
+    tasks = set()
+    counters = {"new": 0, "skipped": 0, "errors": 0}
+    flusher = asyncio.create_task(run_usage_flusher())  # учёт токенов пишется по ходу, остаток — atexit
+
+    with open(out_path, "a", encoding="utf-8") as out:
+
+        async def one(item):
+            try:
+                history_text = ""
+                if with_history and item.get("from_db") and item.get("chat_id"):
+                    history_text = await asyncio.to_thread(history_before, item["chat_id"], item["id"])
+
+                for attempt in range(retries):
+                    meta = {}
+                    try:
+                        result = await analyze_message(
+                            item["text"], chat_id=item.get("chat_id"),
+                            user_id=item.get("user_id"), history_text=history_text, meta=meta,
+                        )
+                        break
+                    except Exception as e:
+                        if attempt == retries - 1:
+                            counters["errors"] += 1
+                            out.write(json.dumps({"id": item["id"], "error": str(e)}, ensure_ascii=False) + "\n")
+                            out.flush()
+                            return
+                        await asyncio.sleep(2 ** attempt)
+
+                usage = meta.get("usage", {})
+                record = {
+                    "id": item["id"],
+                    "chat_id": item.get("chat_id"),
+                    "label": item.get("is_interesting"),
+                    **result.as_dict(),
+                    "latency": round(meta.get("elapsed", 0.0), 3),
+                    "input_tokens": usage.get("input_tokens", 0),
+                    "output_tokens": usage.get("output_tokens", 0),
+                    "cached_tokens": usage.get("cached_tokens", 0),
+                }
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                counters["new"] += 1
+                if counters["new"] % 100 == 0:
+                    print(f"… обработано {counters['new']}")
+            finally:
+                sem.release()
+
+        for item in items:
+            if item["id"] in done:
+                counters["skipped"] += 1
+                continue
+            await sem.acquire()  # ограничиваем и число запросов, и число задач в памяти
+            task = asyncio.create_task(one(item))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    flusher.cancel()
+    return counters
+
+
+def batch_report(out_path) -> str:
+    """Сводка по файлу результатов: согласие с is_interesting, задержки, токены."""
+    from usage_tracker import estimate_cost
+
+    total = agree = labelled = 0
+    confusion = {}
+    latencies = []
+    tin = tout = tcached = 0
+    with open(out_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+            except ValueError:
+                continue
+            if "error" in item:
+                continue
+            total += 1
+            latencies.append(item.get("latency", 0.0))
+            tin += item.get("input_tokens", 0)
+            tout += item.get("output_tokens", 0)
+            tcached += item.get("cached_tokens", 0)
+            if item.get("label") in (0, 1):
+                labelled += 1
+                old = "YES" if item["label"] == 1 else "NO"
+                new = item.get("INTEREST")
+                confusion[(old, new)] = confusion.get((old, new), 0) + 1
+                agree += old == new
+
+    if not total:
+        return "Нет результатов."
+    latencies.sort()
+    p = lambda q: latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+    lines = [
+        f"📦 Сообщений: {total}",
+        f"⏱ Задержка p50/p95/p99: {p(0.5):.2f} / {p(0.95):.2f} / {p(0.99):.2f} с",
+        f"🔢 Токены: вход {tin} (кэш {tcached}), выход {tout}, ≈ ${estimate_cost('gpt-4o-mini', tin, tout, tcached):.4f}",
+    ]
+    if labelled:
+        lines.append(f"🤝 Согласие с прежней оценкой: {agree}/{labelled} ({100 * agree / labelled:.1f}%)")
+        for (old, new), n in sorted(confusion.items()):
+            lines.append(f"   было {old} → стало {new}: {n}")
+    return "\n".join(lines)
+
+
+def batch_main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="interest.py batch", description="Пакетная переоценка интересности")
+    parser.add_argument("--jsonl", help="входной JSONL (.jsonl.gz) вместо БД")
+    parser.add_argument("--archive", action="store_true", help="сообщения из архива retention.py вместо БД")
+    parser.add_argument("--chat", type=int, help="только этот чат (БД/архив)")
+    parser.add_argument("--since", help="с даты, напр. 2025-09-01 (БД/архив)")
+    parser.add_argument("--until", help="до даты, не включая (БД/архив)")
+    parser.add_argument("--out", required=True, help="файл результатов JSONL (дописывается)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--no-history", action="store_true", help="без контекста предыдущих сообщений")
+    parser.add_argument("--report", action="store_true", help="только сводка по --out")
+    args = parser.parse_args(argv)
+
+    if not args.report:
+        if args.jsonl:
+            items = iter_jsonl_messages(args.jsonl)
+        elif args.archive:
+            from retention import iter_archive_messages
+            items = iter_archive_messages(args.chat, args.since, args.until)
+        else:
+            items = iter_db_messages(args.chat, args.since, args.until)
+        counters = asyncio.run(run_batch(
+            items, args.out, concurrency=args.concurrency, with_history=not args.no_history,
+        ))
+        print(f"✅ Новых: {counters['new']}, пропущено (уже было): {counters['skipped']}, ошибок: {counters['errors']}")
+    print(batch_report(args.out))
 
 
 # ==============================
@@ -272,6 +587,16 @@ def _read_multiline() -> str:
 
 
 if __name__ == "__main__":
+    import sys
+    from logs import setup_logging
+
+    setup_logging(json_output=False)  # SHOW_RAW=1 и ошибки — через логгер
+
+    # python interest.py batch --out results.jsonl [--chat ID --since 2025-09-01 | --jsonl in.jsonl]
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        batch_main(sys.argv[2:])
+        sys.exit(0)
+
     async def main():
         print("😼 Тестовый режим НейроКота. Напиши сообщение (или 'exit' одной строкой, чтобы выйти).")
         while True:
@@ -290,6 +615,6 @@ if __name__ == "__main__":
 
             result = await analyze_message(text)
             print("\n✨ РЕЗУЛЬТАТ АНАЛИЗА:")
-            print(json.dumps(result, ensure_ascii=False, indent=2))
+            print(json.dumps(result.as_dict(), ensure_ascii=False, indent=2))
 
     asyncio.run(main())
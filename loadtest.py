@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Офлайн нагрузочный тест конвейера handle_message — без Telegram, OpenAI,
+Anthropic и сети.
+
+Синтетические (или записанные) апдейты подаются прямо в process_message,
+а вместо внешних клиентов стоят заглушки с настраиваемой задержкой и
+долей ошибок. Всё пишется во временную group_history.db.
+
+    python loadtest.py --groups 1,10,50 --rate 5,20 --messages 300
+    python loadtest.py --updates recorded.jsonl --llm-latency 0.8
+
+Отчёт: сообщений/с, задержка end-to-end (p50/p95/p99), лаг event loop,
+время в SQLite. Сообщения, обработка которых упала, считаются отдельно
+и в сообщения/с и задержки не входят.
+
+Приватных модулей бота (insult_detect, photo_responder, prompt_updater)
+в репозитории нет — loadtest подставляет заглушки, если их не найти.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import importlib.util
+from types import SimpleNamespace
+
+import metrics
+
+
+# ==============================
+# Заглушки внешних сервисов
+# ==============================
+
+class Latency:
+    """Задержка ~ логнормальная вокруг mean, с долей ошибок error_rate."""
+
+    def __init__(self, mean: float, error_rate: float = 0.0, sigma: float = 0.5):
+        self.mean = mean
+        self.error_rate = error_rate
+        self.sigma = sigma
+
+    def sample(self) -> float:
+        if self.mean <= 0:
+            return 0.0
+        return random.lognormvariate(0, self.sigma) * self.mean
+
+    def maybe_fail(self, what: str):
+        if random.random() < self.error_rate:
+            raise RuntimeError(f"loadtest: искусственная ошибка {what}")
+
+    async def wait(self, what: str):
+        await asyncio.sleep(self.sample())
+        self.maybe_fail(what)
+
+    def block(self, what: str):
+        # как настоящий синхронный клиент — блокирует поток (и event loop!)
+        time.sleep(self.sample())
+        self.maybe_fail(what)
+
+
+def _openai_usage(prompt_tokens=900, completion_tokens=60):
+    return SimpleNamespace(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=prompt_tokens // 2),
+    )
+
+
+def _anthropic_usage(input_tokens=1500, output_tokens=200):
+    return SimpleNamespace(
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        cache_read_input_tokens=0,
+        cache_creation_input_tokens=0,
+    )
+
+
+class FakeOpenAI:
+    """client.chat.completions.create — и для interest, и для конспекта поиска."""
+
+    def __init__(self, latency: Latency, p_interest: float, p_search: float):
+        self.latency = latency
+        self.p_interest = p_interest
+        self.p_search = p_search
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model=None, messages=None, **kwargs):
+        await self.latency.wait("openai")
+        system = messages[0]["content"] if messages else ""
+        if "конспект" in system:
+            content = "Краткий конспект найденного: факты, факты и ещё раз факты."
+        else:
+            search = random.random() < self.p_search
+            content = json.dumps({
+                "INTEREST": "YES" if random.random() < self.p_interest else "NO",
+                "REACTION": ["👍"],
+                "SEARCH": "YES" if search else "NO",
+                "QUERY": "новости нейросетей" if search else "",
+                "MODEL": random.choice(["FUN", "SMART"]),
+            }, ensure_ascii=False)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=_openai_usage(),
+        )
+
+
+class _FakeStream:
+    def __init__(self, latency: Latency, text: str):
+        self.latency = latency
+        self.text = text
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    @property
+    async def text_stream(self):
+        words = self.text.split(" ")
+        per_word = self.latency.sample() / max(len(words), 1)
+        for w in words:
+            await asyncio.sleep(per_word)
+            yield w + " "
+        self.latency.maybe_fail("anthropic stream")
+
+    async def get_final_message(self):
+        return SimpleNamespace(usage=_anthropic_usage())
+
+
+class FakeAnthropic:
+    """client.messages.create (синхронный, как в responder_claude) и messages.stream."""
+
+    REPLY = "Мур. Это интересный вопрос, и вот что я думаю по этому поводу: всё не так просто."
+
+    def __init__(self, latency: Latency):
+        self.latency = latency
+        self.messages = SimpleNamespace(create=self.create, stream=self.stream)
+
+    def create(self, **kwargs):
+        self.latency.block("anthropic")
+        return SimpleNamespace(
+            content=[SimpleNamespace(type="text", text=self.REPLY)],
+            usage=_anthropic_usage(),
+        )
+
+    def stream(self, **kwargs):
+        return _FakeStream(self.latency, self.REPLY)
+
+
+class FakeDDGS:
+    latency = Latency(0.5)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def text(self, query, max_results=10):
+        self.latency.block("ddg")
+        return [
+            {"href": f"https://example.org/{i}", "title": f"Результат {i}", "body": "Текст результата. " * 20}
+            for i in range(max_results)
+        ]
+
+
+class FakeBot:
+    """context.bot: отправка, реакции, удаление — с задержкой сети Telegram."""
+
+    def __init__(self, latency: Latency):
+        self.latency = latency
+        self.id = 999
+        self._next_id = 10_000_000
+
+    async def _call(self, what):
+        await self.latency.wait(f"telegram {what}")
+        self._next_id += 1
+        return FakeMessage(chat_id=0, message_id=self._next_id, text="", bot=self)
+
+    async def send_message(self, chat_id=None, text=None, **kwargs):
+        return await self._call("send_message")
+
+    async def set_message_reaction(self, **kwargs):
+        await self.latency.wait("telegram set_message_reaction")
+
+    async def delete_message(self, **kwargs):
+        await self.latency.wait("telegram delete_message")
+
+
+class FakeMessage:
+    """Минимум полей telegram.Message, которые читает конвейер."""
+
+    def __init__(self, chat_id, message_id, text, bot, user_id=1, first_name="Тест", reply_to_bot=False):
+        self.chat_id = chat_id
+        self.chat = SimpleNamespace(id=chat_id, title=f"Группа {chat_id}", type="supergroup")
+        self.message_id = message_id
+        self.text = text
+        self.caption = None
+        self.photo = []
+        self.document = None
+        self.sender_chat = None
+        self.is_automatic_forward = False
+        self.forward_origin = None
+        self.forward_from_chat = None
+        self.from_user = SimpleNamespace(id=user_id, first_name=first_name, username=None, is_bot=False)
+        self.reply_to_message = (
+            SimpleNamespace(from_user=SimpleNamespace(id=bot.id, is_bot=True)) if reply_to_bot else None
+        )
+        self._bot = bot
+
+    async def reply_text(self, text, **kwargs):
+        return await self._bot._call("reply_text")
+
+    async def edit_text(self, text, **kwargs):
+        await self._bot.latency.wait("telegram edit_text")
+
+
+SAMPLE_TEXTS = [
+    "Кот, как думаешь, заменят ли нейросети программистов?",
+    "всем привет))",
+    "Почему трансформеры так хорошо работают на длинных текстах? Объясни на пальцах, пожалуйста.",
+    "лол",
+    "Вот ссылка на новость про новую модель, прочитай: https://example.org/news",
+    "Кто идёт вечером на митап?",
+]
+
+
+def make_update(bot, chat_id, message_id, text=None, user_id=None):
+    user_id = user_id or random.randint(1, 5000)
+    msg = FakeMessage(
+        chat_id=chat_id,
+        message_id=message_id,
+        text=text or random.choice(SAMPLE_TEXTS),
+        bot=bot,
+        user_id=user_id,
+        first_name=f"user{user_id}",
+        reply_to_bot=random.random() < 0.1,
+    )
+    return SimpleNamespace(
+        update_id=message_id, message=msg, effective_message=msg,
+        effective_user=msg.from_user, effective_chat=msg.chat,
+    )
+
+
+def load_recorded_updates(path, bot):
+    """JSONL с апдейтами Telegram (как их отдаёт Bot API) → фейковые апдейты."""
+    updates = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            data = json.loads(line).get("message")
+            if not data:
+                continue
+            user = data.get("from") or {}
+            updates.append(make_update(
+                bot,
+                chat_id=data["chat"]["id"],
+                message_id=data["message_id"],
+                text=data.get("text") or data.get("caption") or "",
+                user_id=user.get("id"),
+            ))
+    return updates
+
+
+# ==============================
+# Подмена модулей бота
+# ==============================
+
+def _stub(module, **attrs):
+    """Модуль, которого нет в репозитории (приватные зависимости бота), — заглушкой в sys.modules."""
+    if module not in sys.modules and importlib.util.find_spec(module) is None:
+        sys.modules[module] = SimpleNamespace(**attrs)
+
+
+async def _no_prompt_update(context):
+    return None
+
+
+def install_stub_modules():
+    """Приватные модули бота не лежат в репозитории — без них не импортируются message_handler и bot_ai."""
+    _stub("insult_detect", insult_detect=lambda text, prompt: False, load_prompt=lambda *a, **kw: "")
+    _stub("photo_responder", analyze_photo=lambda path: "На фото кот.")
+    _stub("prompt_updater", check_and_update_prompt=_no_prompt_update, register_handlers=lambda app: None)
+
+
+def install_fakes(args, db_path, groups):
+    """Подменяет внешних клиентов и пути к БД в уже импортированных модулях бота."""
+    install_stub_modules()
+    import init_group_db
+    import message_handler
+    import interest
+    import web_search
+    import responder_claude
+    import moderator
+    import usage_tracker
+    import chat_summary
+    import history_search
+    import clients
+    import runtime_config
+
+    for module in (init_group_db, message_handler, interest, responder_claude, usage_tracker, chat_summary, history_search):
+        module.DB_PATH = db_path
+    init_group_db.init_db()
+
+    openai_fake = FakeOpenAI(Latency(args.llm_latency / 3, args.error_rate), args.p_interest, args.p_search)
+    anthropic_fake = FakeAnthropic(Latency(args.llm_latency, args.error_rate))
+    FakeDDGS.latency = Latency(args.web_latency, args.error_rate)
+    web_latency = Latency(args.web_latency, args.error_rate)
+
+    async def fake_fetch_html(session, url, timeout=5):
+        await asyncio.sleep(web_latency.sample())
+        return "<html><body><p>" + "Содержимое страницы. " * 50 + "</p></body></html>"
+
+    def fake_insult_detect(text, prompt):
+        Latency(args.llm_latency / 4, 0).block("moderation")
+        return False
+
+    def fake_analyze_photo(path):
+        Latency(args.llm_latency, 0).block("vision")
+        return "На фото кот."
+
+    clients.set_client("openai", openai_fake)
+    clients.set_client("anthropic", anthropic_fake)
+    clients.set_client("async_anthropic", anthropic_fake)
+    sys.modules["ddgs"] = SimpleNamespace(DDGS=FakeDDGS)  # web_search импортирует ddgs при поиске
+    web_search.fetch_html = fake_fetch_html
+    moderator.insult_detect = fake_insult_detect
+    message_handler.analyze_photo = fake_analyze_photo
+    message_handler.check_and_update_prompt = _no_prompt_update
+    runtime_config.apply(allowed_groups=groups)
+
+
+# ==============================
+# Прогон
+# ==============================
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+async def _loop_lag_probe(samples, interval=0.05):
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - started - interval)
+
+
+async def run_once(args, groups, rate, updates=None):
+    from bot_ai import process_message
+    import admission
+    import background
+    import usage_tracker
+
+    metrics.reset()
+    bot = FakeBot(Latency(args.tg_latency, args.error_rate))
+    context = SimpleNamespace(bot=bot, args=[])
+    if updates is None:
+        updates = [
+            make_update(bot, chat_id=random.choice(groups), message_id=i + 1)
+            for i in range(args.messages)
+        ]
+    else:
+        for u in updates:
+            u.message._bot = bot
+
+    latencies = []
+    lag = []
+    errors = 0
+    probe = asyncio.create_task(_loop_lag_probe(lag))
+    usage_flusher = asyncio.create_task(usage_tracker.run_flusher())  # как в боте (post_init)
+
+    outcome = {}  # id(update) → process_message вернул True (обработано) / False (упало)
+
+    async def handler(update, context, degrade=0, moderated=False):
+        outcome[id(update)] = await process_message(update, context, degrade=degrade, moderated=moderated)
+
+    queue = admission.start(handler) if args.admission else None
+
+    async def one(update):
+        nonlocal errors
+        started = time.perf_counter()
+        if queue is None:
+            await handler(update, context)
+        elif not await queue.submit(update, context):
+            return  # выброшено очередью допуска
+        if not outcome.pop(id(update), False):
+            errors += 1  # упавшие не входят ни в msg/s, ни в задержки
+            return
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    tasks = []
+    for update in updates:
+        if args.sequential:
+            # как Application по умолчанию: апдейты по одному
+            await one(update)
+        else:
+            tasks.append(asyncio.create_task(one(update)))
+            if rate > 0:
+                await asyncio.sleep(random.expovariate(rate))
+    if tasks:
+        await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    await background.flush()  # реакции и отчёты, которые ответ не ждал
+    probe.cancel()
+    usage_flusher.cancel()
+    if queue is not None:
+        admission.stop()
+
+    hists, counters = metrics.snapshot()
+    db_time = sum(h.total for name, h in hists.items() if name.startswith("sqlite."))
+    ttr = hists.get("reply.time_to_reply")
+    return {
+        "groups": len(groups),
+        "rate": rate,
+        "messages": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "lag_p50": percentile(lag, 0.5),
+        "lag_p99": percentile(lag, 0.99),
+        "lag_max": max(lag) if lag else 0.0,
+        "db_time": db_time,
+        "ttr_p50": ttr.quantile(0.5) if ttr else 0.0,
+        "ttr_p95": ttr.quantile(0.95) if ttr else 0.0,
+        "shed": sum(v for name, v in counters.items() if name.startswith("admission.shed.")),
+        "degraded": sum(v for name, v in counters.items() if name.startswith("admission.degraded.")),
+        "coalesced": sum(v for name, v in counters.items() if name.endswith(".coalesced")),
+    }
+
+
+def print_result(r):
+    print(
+        f"👥 групп {r['groups']:>4} | 📨 {r['rate']:>5} msg/s | "
+        f"⚡ {r['throughput']:6.1f} msg/s | "
+        f"e2e p50/p95/p99 {r['p50']:.2f}/{r['p95']:.2f}/{r['p99']:.2f} с | "
+        f"до ответа p50/p95 {r['ttr_p50']:.2f}/{r['ttr_p95']:.2f} с | "
+        f"лаг loop p50/p99/max {r['lag_p50'] * 1000:.0f}/{r['lag_p99'] * 1000:.0f}/{r['lag_max'] * 1000:.0f} мс | "
+        f"SQLite {r['db_time']:.2f} с ({1000 * r['db_time'] / max(r['messages'], 1):.1f} мс/сообщ.)"
+        + (f" | выброшено {r['shed']}, деградация {r['degraded']}" if r["shed"] or r["degraded"] else "")
+        + (f" | склеено запросов {r['coalesced']}" if r["coalesced"] else "")
+        + (f" | ❌ упало {r['errors']}" if r["errors"] else "")
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн нагрузочный тест НейроКота")
+    parser.add_argument("--groups", default="1,10", help="кол-во групп, через запятую")
+    parser.add_argument("--rate", default="5,20", help="входящих сообщений/с, через запятую (0 = все сразу)")
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--updates", help="JSONL с записанными апдейтами вместо синтетики")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="средняя задержка Claude, с")
+    parser.add_argument("--web-latency", type=float, default=0.5)
+    parser.add_argument("--tg-latency", type=float, default=0.08)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--p-interest", type=float, default=0.5)
+    parser.add_argument("--p-search", type=float, default=0.1)
+    parser.add_argument("--sequential", action="store_true", help="обрабатывать апдейты по одному, как Application")
+    parser.add_argument("--admission", action="store_true", help="пропускать через очередь допуска (admission.py)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    workdir = tempfile.mkdtemp(prefix="neurocat-loadtest-")
+    db_path = os.path.join(workdir, "group_history.db")
+
+    group_counts = [int(x) for x in args.groups.split(",")]
+    rates = [float(x) for x in args.rate.split(",")]
+    install_fakes(args, db_path, groups=[-100_000_000 - i for i in range(max(group_counts))])
+    # как бот в post_init: тяжёлые импорты — до замеров, а не в первом сообщении
+    import clients
+    asyncio.run(clients.warm_up(network=False))
+
+    if args.updates:
+        import runtime_config
+        recorded = load_recorded_updates(args.updates, FakeBot(Latency(0)))
+        groups = sorted({u.message.chat_id for u in recorded})
+        runtime_config.apply(allowed_groups=groups)
+        runs = [(groups, rate, recorded) for rate in rates]
+    else:
+        runs = [
+            ([-100_000_000 - i for i in range(n)], rate, None)
+            for n in group_counts
+            for rate in rates
+        ]
+
+    # не засоряем вывод логами конвейера
+    real_stdout = sys.stdout
+    for groups, rate, updates in runs:
+        sys.stdout = open(os.devnull, "w")
+        try:
+            r = asyncio.run(run_once(args, groups, rate, updates))
+        finally:
+            sys.stdout.close()
+            sys.stdout = real_stdout
+        print_result(r)
+
+    print(f"\n🗂 Временная БД: {db_path}")
+
+
+if __name__ == "__main__":
+    main()
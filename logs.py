@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Логирование бота: записи уходят в очередь (QueueHandler), в файл/stderr их
+пишет отдельный поток (QueueListener) — медленный терминал или пайп не
+тормозит event loop. Формат — JSON по строке на запись (LOG_JSON в config.py).
+
+К каждой записи добавляется контекст сообщения (chat_id, message_id, corr) из
+contextvars: его выставляет bot_ai.process_message, и он виден во всех
+корутинах и asyncio.to_thread этого сообщения.
+
+Подробные дампы (промпт Claude, веб-резюме) пишутся на DEBUG и только для доли
+LOG_DUMP_SAMPLE сообщений; вызывающий проверяет dump_enabled() до того,
+как собирать текст дампа, — выключенный дамп ничего не стоит.
+"""
+
+import sys
+import copy
+import json
+import zlib
+import queue
+import random
+import uuid
+import atexit
+import logging
+import logging.handlers
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from config import LOG_LEVEL, LOG_JSON, LOG_FILE, LOG_QUEUE_SIZE, LOG_DUMP_SAMPLE
+
+_log_context = contextvars.ContextVar("log_context", default={})
+_listener = None
+_dropped = 0
+_plain = logging.Formatter()
+
+# стандартные поля LogRecord — всё остальное из extra= попадает в JSON
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "ctx"}
+
+
+def bind(**fields):
+    """Добавляет поля в контекст текущей задачи; возвращает токен для unbind."""
+    return _log_context.set({**_log_context.get(), **fields})
+
+
+def unbind(token):
+    _log_context.reset(token)
+
+
+def new_corr_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+@contextmanager
+def log_context(**fields):
+    token = bind(**fields)
+    try:
+        yield
+    finally:
+        unbind(token)
+
+
+def current_context() -> dict:
+    return _log_context.get()
+
+
+def dump_enabled(logger: logging.Logger) -> bool:
+    """Писать ли подробный дамп: DEBUG включён и сообщение попало в выборку."""
+    if not logger.isEnabledFor(logging.DEBUG) or LOG_DUMP_SAMPLE <= 0:
+        return False
+    corr = _log_context.get().get("corr")
+    if corr is None:
+        return random.random() < LOG_DUMP_SAMPLE
+    # по corr решение одно на сообщение: дамп целый, а не по кусочку
+    return zlib.crc32(corr.encode()) % 10_000 < LOG_DUMP_SAMPLE * 10_000
+
+
+class _ContextFilter(logging.Filter):
+    """Снимает контекст в потоке, где вызвали логгер (до очереди)."""
+
+    def filter(self, record):
+        record.ctx = _log_context.get()
+        return True
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Очередь ограничена: при переполнении запись выбрасываем, а не ждём."""
+
+    def prepare(self, record):
+        # текст и traceback фиксируем здесь (аргументы могут измениться), JSON собирает фоновый поток
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _plain.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        global _dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "ctx", None) or {})
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Человекочитаемый вариант (LOG_JSON = False): контекст — в квадратных скобках."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    def format(self, record):
+        text = super().format(record)
+        ctx = getattr(record, "ctx", None)
+        if ctx:
+            text += " [" + " ".join(f"{k}={v}" for k, v in ctx.items()) + "]"
+        return text
+
+
+def setup_logging(level=LOG_LEVEL, json_output=LOG_JSON, path=LOG_FILE):
+    """Корневой логгер → очередь → фоновый поток → файл/stderr. Повторный вызов ничего не делает."""
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    target = logging.FileHandler(path, encoding="utf-8") if path else logging.StreamHandler(sys.stderr)
+    target.setFormatter(JsonFormatter() if json_output else TextFormatter())
+
+    handler = _DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(_ContextFilter())
+
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    # 🔇 лишние логи от httpx и telegram
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("telegram").setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(handler.queue, target, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+    return _listener
+
+
+def shutdown_logging():
+    """Дописывает очередь и останавливает фоновый поток."""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+    if _dropped:
+        print(f"⚠️ Логи: выброшено {_dropped} записей (очередь переполнена)", file=sys.stderr)
+
+
+def dropped_count() -> int:
+    return _dropped
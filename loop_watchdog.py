@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сторож event loop: непрерывно меряет лаг (насколько позже срабатывает
+asyncio.sleep) и пишет его в метрики loop.lag.
+
+В отладочном режиме (NEUROCAT_WATCHDOG_DEBUG=1) отдельный поток следит за
+«сердцебиением» loop и, если оно замерло дольше порога, снимает стек потока
+loop — так видно, какая именно функция блокирует (sqlite3, insult_detect,
+синхронный Claude, DDGS...). Раз в WATCHDOG_REPORT_INTERVAL — сводка владельцу.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import Counter
+
+import metrics
+from config import (
+    OWNER_ID,
+    WATCHDOG_INTERVAL,
+    WATCHDOG_THRESHOLD,
+    WATCHDOG_DEBUG,
+    WATCHDOG_REPORT_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class LoopWatchdog:
+    def __init__(self, bot=None, interval=WATCHDOG_INTERVAL, threshold=WATCHDOG_THRESHOLD, debug=WATCHDOG_DEBUG):
+        self.bot = bot
+        self.interval = interval
+        self.threshold = threshold
+        self.debug = debug
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = None
+        self._stop = threading.Event()
+        self._tasks = []
+        self._reset_period()
+
+    def _reset_period(self):
+        self.lags = metrics.Histogram()
+        self.stalls = 0
+        self.blockers = Counter()
+        self.last_stack = ""
+
+    # ---------- замер лага в самом loop ----------
+
+    async def _measure(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - started - self.interval, 0.0)
+            self._heartbeat = time.monotonic()
+            metrics.observe("loop.lag", lag)
+            self.lags.observe(lag)
+            if lag > self.threshold:
+                self.stalls += 1
+                metrics.inc("loop.stalls")
+
+    # ---------- отладка: кто блокирует ----------
+
+    def _culprit(self, frame):
+        """Самый глубокий кадр из кода проекта (а не из библиотек) + полный стек."""
+        stack = traceback.extract_stack(frame)
+        ours = [
+            f for f in stack
+            if f.filename.startswith(PROJECT_DIR) and not f.filename.endswith("loop_watchdog.py")
+        ]
+        target = ours[-1] if ours else stack[-1]
+        name = f"{os.path.basename(target.filename)}:{target.lineno} {target.name}"
+        return name, "".join(traceback.format_list(stack[-12:]))
+
+    def _sampler(self):
+        captured_for = None
+        while not self._stop.wait(self.threshold / 2):
+            beat = self._heartbeat
+            if time.monotonic() - beat < self.threshold or captured_for == beat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            name, stack = self._culprit(frame)
+            captured_for = beat  # один снимок на одно зависание
+            self.blockers[name] += 1
+            self.last_stack = stack
+            metrics.inc(f"loop.blocker:{name}")
+            logger.warning("🐢 Event loop заблокирован > %.0f мс: %s", self.threshold * 1000, name)
+
+    # ---------- сводка ----------
+
+    def summary(self) -> str:
+        h = self.lags
+        lines = [
+            "🩺 Event loop",
+            f"Лаг p50/p99/max: {h.quantile(0.5) * 1000:.0f} / {h.quantile(0.99) * 1000:.0f} / {h.max * 1000:.0f} мс",
+            f"Зависаний > {self.threshold * 1000:.0f} мс: {self.stalls}",
+        ]
+        if self.blockers:
+            lines.append("Кто блокировал:")
+            for name, n in self.blockers.most_common(5):
+                lines.append(f"- {name}: {n}")
+        return "\n".join(lines)
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(WATCHDOG_REPORT_INTERVAL)
+            text = self.summary()
+            self._reset_period()
+            if self.bot:
+                try:
+                    await self.bot.send_message(chat_id=OWNER_ID, text=text)
+                except Exception as e:
+                    logger.warning("⚠️ Ошибка отправки сводки event loop: %s", e)
+
+    # ---------- запуск/остановка ----------
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._tasks.append(loop.create_task(self._measure()))
+        if WATCHDOG_REPORT_INTERVAL:
+            self._tasks.append(loop.create_task(self._report()))
+        if self.debug:
+            # asyncio сам назовёт медленные колбэки в логах
+            loop.slow_callback_duration = self.threshold
+            loop.set_debug(True)
+            threading.Thread(target=self._sampler, name="loop-watchdog", daemon=True).start()
+        logger.info("🩺 Сторож event loop запущен (порог %.0f мс, debug=%s)", self.threshold * 1000, self.debug)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        for task in self._tasks:
+            task.cancel()
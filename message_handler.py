@@ -2,29 +2,58 @@
 # -*- coding: utf-8 -*-
 
 import asyncio
+import logging
 import os
+import time
 import sqlite3
 from datetime import datetime
 from telegram import Update
 from telegram.ext import ContextTypes
+from telegram.error import BadRequest, RetryAfter
 
 from moderator import moderate_message
-from photo_responder import analyze_photo
-from responder_claude import generate_response
+from responder_claude import generate_response, stream_response
 from prompt_updater import check_and_update_prompt
-from config import ALLOWED_GROUPS, OWNER_ID
-from interest import analyze_message, report_interest
+from config import (
+    OWNER_ID,
+    STREAM_REPLIES,
+    STREAM_FIRST_CHUNK_CHARS,
+    STREAM_EDIT_INTERVAL,
+    DB_BUSY_TIMEOUT,
+    MESSAGE_DEADLINE,
+    IDLE_ENABLED,
+)
+from interest import analyze_message, report_interest, fallback_result
 from web_search import search_and_summarize
-import pprint
+from chat_summary import note_new_message
+from artifacts import ARTIFACT_LABELS, store_artifact
+import idle_scheduler
+import background
+import runtime_config
+from admission import DEGRADE_EXTRAS, DEGRADE_INTEREST
+from resilience import Deadline, CircuitOpen, call_async, stage_timeout
+from metrics import span, timed, observe
+from logs import dump_enabled
 
 DB_PATH = os.path.join(os.getcwd(), "group_history.db")
 PHOTO_DIR = os.path.join(os.getcwd(), "channel_pics")
+TG_MAX_LEN = 4096
+
+logger = logging.getLogger(__name__)
 
 
 def get_db_connection():
-    return sqlite3.connect(DB_PATH)
+    return sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT)
+
+
+def analyze_photo(path):
+    # vision-модуль тянет клиента OpenAI — импортируем при первом фото
+    from photo_responder import analyze_photo as _analyze_photo
+
+    return _analyze_photo(path)
 
 
+@timed("sqlite.save_message")
 def save_message(
     chat_id,
     message_id,
@@ -34,17 +63,24 @@ def save_message(
     content,
     reply_to_user_id=None,
     source=None,
+    artifact_kind=None,
 ):
     """
     Сохраняем сообщение в БД (таблица history в group_history.db).
+    artifact_kind ("web", "vision") — крупный производный текст: сам он уходит
+    в artifacts (один раз на одинаковое содержимое), в history — метка и хэш.
     """
     conn = get_db_connection()
     try:
         cursor = conn.cursor()
+        digest = None
+        if artifact_kind:
+            digest = store_artifact(conn, artifact_kind, content)
+            content = ARTIFACT_LABELS.get(artifact_kind, f"[{artifact_kind}]")
         cursor.execute(
             """
-            INSERT INTO history (chat_id, message_id, user_id, first_name, role, created, content, reply_to_user_id, source)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO history (chat_id, message_id, user_id, first_name, role, created, content, reply_to_user_id, source, artifact_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """,
             (
                 chat_id,
@@ -56,29 +92,159 @@ def save_message(
                 content,
                 reply_to_user_id,
                 source,
+                digest,
             ),
         )
         conn.commit()
     finally:
         conn.close()
 
+    # резюме беседы обновляется в фоне каждые N строк
+    try:
+        note_new_message(chat_id)
+    except Exception as e:
+        logger.warning("⚠️ Ошибка учёта строки для резюме: %s", e)
+
+    # тишина в чате отсчитывается от сообщений людей, не кота
+    if IDLE_ENABLED and role == "user":
+        idle_scheduler.touch(chat_id)
 
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+async def _edit_reply(sent, text, wait=False):
+    """
+    Правка стримингового сообщения; возвращает False, если Telegram просит подождать.
+    wait=True (финальная правка) — выжидаем паузу и пробуем ещё раз.
+    """
+    try:
+        with span("telegram.edit"):
+            await sent.edit_text(text)
+    except RetryAfter as e:
+        logger.info("⏳ Telegram просит паузу %s с перед правкой", e.retry_after)
+        if not wait:
+            return False
+        await asyncio.sleep(e.retry_after)
+        return await _edit_reply(sent, text)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            raise
+    return True
+
+
+async def send_streamed_reply(msg, chunks, started=None):
+    """
+    Показывает ответ по мере генерации: первое сообщение — как только набралось
+    STREAM_FIRST_CHUNK_CHARS символов, дальше правки не чаще STREAM_EDIT_INTERVAL.
+    Возвращает текст ответа, который в итоге видят пользователи, без служебных
+    пометок вроде «ответ оборвался» (или None) — он уходит в историю.
+    started — perf_counter начала обработки: первое показанное сообщение идёт в reply.time_to_reply.
+    """
+    loop = asyncio.get_running_loop()
+    buffer = ""
+    shown = ""
+    sent = None
+    next_edit = 0.0
+    failed = False
+
+    try:
+        async for chunk in chunks:
+            buffer += chunk
+            view = buffer[:TG_MAX_LEN - 2]
+            if sent is None:
+                if len(buffer.strip()) >= STREAM_FIRST_CHUNK_CHARS:
+                    sent = await msg.reply_text(view + " ▌", reply_to_message_id=msg.message_id)
+                    if started is not None:
+                        observe("reply.time_to_reply", time.perf_counter() - started)
+                    shown = view
+                    next_edit = loop.time() + STREAM_EDIT_INTERVAL
+            elif view != shown and loop.time() >= next_edit:
+                if await _edit_reply(sent, view + " ▌"):
+                    shown = view
+                next_edit = loop.time() + STREAM_EDIT_INTERVAL
+    except Exception as e:
+        logger.error("❌ Обрыв стриминга Claude: %s", e)
+        failed = True
+
+    answer = buffer.strip()
+    if not answer:
+        if sent:
+            try:
+                await _edit_reply(sent, "⚠️ Не получилось ответить, попробуй ещё раз.", wait=True)
+            except Exception as e:
+                logger.warning("⚠️ Ошибка правки оборванного ответа: %s", e)
+        return None
+
+    # пометка — только для чата: в историю (и в контекст следующих ответов) она не попадает
+    display = answer + "\n\n⚠️ (ответ оборвался)" if failed else answer
+
+    # финальная правка: полный текст без курсора; хвост сверх 4096 — отдельными сообщениями
+    head, tail = display[:TG_MAX_LEN], display[TG_MAX_LEN:]
+    try:
+        if sent is None:
+            await msg.reply_text(head, reply_to_message_id=msg.message_id)
+            if started is not None:
+                observe("reply.time_to_reply", time.perf_counter() - started)
+        elif not await _edit_reply(sent, head, wait=True):
+            return shown or None
+        for i in range(0, len(tail), TG_MAX_LEN):
+            await msg.reply_text(tail[i:i + TG_MAX_LEN], reply_to_message_id=msg.message_id)
+    except Exception as e:
+        logger.warning("⚠️ Ошибка финальной правки ответа: %s", e)
+        if sent is None:
+            return None
+        return shown or None
+
+    return answer
+
+
+async def _set_reaction(bot, chat_id, message_id, reaction, deadline):
+    # таймаут считаем здесь, когда фоновая задача дошла до вызова; floor — реакцию ставим
+    # даже при исчерпанном бюджете, как и уже готовый ответ
+    with span("stage.reaction"), span("telegram.set_reaction"):
+        await bot.set_message_reaction(
+            chat_id=chat_id,
+            message_id=message_id,
+            reaction=reaction,
+            read_timeout=stage_timeout(deadline, "telegram", floor=5),
+        )
+    logger.info("✅ Реакция установлена: %s", reaction)
+
+
+async def _send_owner_report(bot, report_text):
+    # Telegram ограничение = 4096 символов → режем по 3500
+    MAX_LEN = 3500
+    with span("stage.owner_report"):
+        for i in range(0, len(report_text), MAX_LEN):
+            with span("telegram.send_message"):
+                await bot.send_message(chat_id=OWNER_ID, text=report_text[i:i + MAX_LEN])
+
+
+@timed("handle_message")
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE, degrade: int = 0, deadline=None,
+                         moderated: bool = False):
     """
     Главная функция обработки входящих сообщений.
+    degrade — уровень деградации от очереди допуска (admission.py):
+    1 — без веб-поиска и отчётов владельцу, 2 — ещё и без классификатора.
+    moderated — модерацию уже сделала очередь допуска (приоритет moderation).
+    deadline — бюджет времени на всё сообщение (resilience.Deadline).
     """
     msg = update.message
     if not msg:
         return
 
+    deadline = deadline or Deadline(MESSAGE_DEADLINE)
+    started = time.perf_counter()
+
     chat_id = msg.chat_id
-    if chat_id not in ALLOWED_GROUPS:
+    if chat_id not in runtime_config.snapshot().allowed_groups:
         return  # игнорируем чаты, которые не разрешены
 
     # --- 1. Проверка модерации ---
-    is_ok = await moderate_message(update, context)
-    if not is_ok:
-        return
+    if not moderated:
+        with span("stage.moderation"):
+            is_ok = await moderate_message(update, context)
+        if not is_ok:
+            return
 
     # --- 2. Определяем отправителя ---
     user_id = msg.from_user.id if msg.from_user else None
@@ -97,20 +263,21 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Если это фото или документ → сохраняем
         os.makedirs(PHOTO_DIR, exist_ok=True)
 
-        if msg.photo:
-            file_obj = await msg.photo[-1].get_file()
-            filename = os.path.join(PHOTO_DIR, f"{msg.message_id}.jpg")
-        else:
-            file_obj = await msg.document.get_file()
-            ext = (
-                os.path.splitext(msg.document.file_name)[-1]
-                if msg.document.file_name
-                else ".jpg"
-            )
-            filename = os.path.join(PHOTO_DIR, f"{msg.message_id}{ext}")
-
-        await file_obj.download_to_drive(custom_path=filename)
-        print(f"📷 Фото сохранено: {filename}")
+        with span("stage.photo_download"), span("telegram.download"):
+            if msg.photo:
+                file_obj = await msg.photo[-1].get_file()
+                filename = os.path.join(PHOTO_DIR, f"{msg.message_id}.jpg")
+            else:
+                file_obj = await msg.document.get_file()
+                ext = (
+                    os.path.splitext(msg.document.file_name)[-1]
+                    if msg.document.file_name
+                    else ".jpg"
+                )
+                filename = os.path.join(PHOTO_DIR, f"{msg.message_id}{ext}")
+
+            await file_obj.download_to_drive(custom_path=filename)
+        logger.info("📷 Фото сохранено: %s", filename)
         image_path = filename
 
         # Сохраняем текстовое описание фото в историю
@@ -118,13 +285,23 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             user_content = f"📷 Фото + подпись: {text}"
         else:
             user_content = "📷 Пользователь прислал фото"
-        save_message(chat_id, msg.message_id, user_id, username, "user", user_content)
+        with span("stage.save"):
+            save_message(chat_id, msg.message_id, user_id, username, "user", user_content)
 
         # Анализ фото (vision модель)
-        vision_description = await asyncio.to_thread(analyze_photo, filename)
+        try:
+            with span("stage.vision"), span("openai.vision"):
+                vision_description = await call_async(
+                    "openai",
+                    lambda: asyncio.to_thread(analyze_photo, filename),
+                    stage_timeout(deadline, "vision"),
+                )
+        except (CircuitOpen, asyncio.TimeoutError) as e:
+            logger.warning("⚠️ Анализ фото пропущен: %s", type(e).__name__)
+            vision_description = None
         if vision_description:
             vision_content = f"🔎 Анализ фото: {vision_description}"
-            save_message(chat_id, msg.message_id, user_id, username, "vision", vision_content)
+            save_message(chat_id, msg.message_id, user_id, username, "vision", vision_content, artifact_kind="vision")
 
     else:
         # --- Обычный текст ---
@@ -132,10 +309,12 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if msg.from_user and msg.from_user.is_bot:
             if msg.from_user.id == context.bot.id:
                 role = "assistant"
-        save_message(chat_id, msg.message_id, user_id, username, role, text)
+        with span("stage.save"):
+            save_message(chat_id, msg.message_id, user_id, username, role, text)
 
     # --- 4. Проверка апдейта промптов ---
-    await check_and_update_prompt(context)
+    with span("stage.prompt_update"):
+        await check_and_update_prompt(context)
 
     if not text.strip() and not image_path:
         return  # пустое сообщение → игнор
@@ -146,12 +325,17 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         message_text = text
 
-    result = await analyze_message(message_text, chat_id, msg=msg)
+    if degrade >= DEGRADE_INTEREST:
+        # перегрузка: без GPT — отвечаем только на реплаи коту, быстрой моделью
+        result = fallback_result(message_text, msg, model="FUN")
+    else:
+        with span("stage.interest"):
+            result = await analyze_message(message_text, chat_id, msg=msg, user_id=user_id, deadline=deadline)
 
-    # Отправляем отчёт админу и сохраняем в БД
-    await report_interest(update, context, result)
+            # Отправляем отчёт админу и сохраняем в БД
+            await report_interest(update, context, result, notify=not degrade)
 
-    interesting = result.get("INTEREST") == "YES"
+    interesting = result.interesting
 
     # --- 6. Логика "реплай коту" ---
     # Раньше: бот ВСЕГДА отвечал, если это реплай к его сообщению.
@@ -167,35 +351,31 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not interesting and not must_answer:
         return
 
-    # --- 8. Ставим реакцию (если есть) ---
-    if result.get("REACTION"):
-        try:
-            reaction = result["REACTION"][0]  # только одна реакция
-            await context.bot.set_message_reaction(
-                chat_id=chat_id,
-                message_id=msg.message_id,
-                reaction=reaction,
-            )
-            print(f"✅ Реакция установлена: {reaction}")
-        except Exception as e:
-            print(f"❌ Ошибка при установке реакции: {e}")
+    # --- 8. Реакция — в фоне, ответ её не ждёт ---
+    if result.reaction:
+        reaction = result.reaction[0]  # только одна реакция
+        background.spawn(
+            _set_reaction(context.bot, chat_id, msg.message_id, reaction, deadline),
+            "reaction",
+        )
 
     # --- 9. Веб-поиск (если нужен) ---
     web_summary = None
-    if result.get("SEARCH") == "YES":
-        query = result.get("QUERY") or text
-        print(f"🌍 Выполняем веб-поиск: {query}")
+    if result.wants_search and degrade >= DEGRADE_EXTRAS:
+        logger.info("⏭ Перегрузка: веб-поиск пропущен")
+    elif result.wants_search:
+        query = result.query or text
+        logger.info("🌍 Выполняем веб-поиск: %s", query)
         try:
-            web_summary, sources = await asyncio.wait_for(
-                search_and_summarize(query, num_results=5),
-                timeout=20,
-            )
+            with span("stage.web_search"):
+                web_summary, sources = await asyncio.wait_for(
+                    search_and_summarize(query, num_results=5, chat_id=chat_id, user_id=user_id, deadline=deadline),
+                    timeout=stage_timeout(deadline, "web_search"),
+                )
 
-            # Лог результатов поиска
-            print("=== WEB SUMMARY (debug) ===")
-            print(web_summary)
-            print("=== SOURCES (debug) ===")
-            print(sources)
+            # полный текст — только в выборочном дампе (LOG_DUMP_SAMPLE)
+            if dump_enabled(logger):
+                logger.debug("=== WEB SUMMARY ===\n%s\n=== SOURCES ===\n%s", web_summary, sources)
 
             if sources:
                 web_summary += "\n\n🔗 Источники:\n" + "\n".join(f"- {s}" for s in sources[:5])
@@ -209,17 +389,21 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "assistant",
                 web_summary,
                 source="web",
+                artifact_kind="web",
             )
 
         except asyncio.TimeoutError:
-            print("⚠️ Поиск превысил лимит времени")
+            logger.warning("⚠️ Поиск превысил лимит времени")
             web_summary = "⚠️ Источники не ответили вовремя."
+        except CircuitOpen as e:
+            logger.warning("⚠️ Поиск отключён предохранителем (%s) — отвечаем без него", e)
+            web_summary = None
         except Exception as e:
-            print(f"❌ Ошибка веб-поиска: {e}")
+            logger.error("❌ Ошибка веб-поиска: %s", e)
             web_summary = None
 
-    # --- 10. Отчёт админу ---
-    try:
+    # --- 10. Отчёт админу — в фоне, ответ его не ждёт ---
+    if not degrade:  # под нагрузкой отчёты отключаем первыми
         report_lines = [
             "🔎 RAW GPT ANSWER:",
             f"{result}",
@@ -229,53 +413,57 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"Отправитель: {username} (ID: {user_id})",
             f"Текст: {text or '[без текста]'}",
             f"Статус: {'РЕПЛАЙ КОТУ — ответ (если интересное) ✅' if must_answer else ('ИНТЕРЕСНО ✅' if interesting else 'НЕИНТЕРЕСНО ❌')}",
-            f"🟢 Реакция: {result.get('REACTION')}",
-            f"🌍 Поиск: {result.get('SEARCH')} | Запрос: {result.get('QUERY') or '—'}",
-            f"🤖 Модель: {result.get('MODEL')}",
+            f"🟢 Реакция: {list(result.reaction)}",
+            f"🌍 Поиск: {result.search} | Запрос: {result.query or '—'}",
+            f"🤖 Модель: {result.model}",
         ]
 
         if web_summary:
             report_lines.append("\n🌍 РЕЗУЛЬТАТ ПОИСКА:")
             report_lines.append(web_summary)
 
-        report_text = "\n".join(report_lines)
-
-        # Telegram ограничение = 4096 символов → режем по 3500
-        MAX_LEN = 3500
-        for i in range(0, len(report_text), MAX_LEN):
-            await context.bot.send_message(
-                chat_id=OWNER_ID,
-                text=report_text[i:i+MAX_LEN]
-            )
-
-    except Exception as e:
-        print(f"⚠️ Ошибка при отправке отчёта админу: {e}")
+        background.spawn(_send_owner_report(context.bot, "\n".join(report_lines)), "owner_report")
 
     # --- 11. Генерация ответа от Claude ---
-    answer = generate_response(
-        chat_id,
+    reply_kwargs = dict(
         current_user=username,
         user_id=user_id,
         text=text,
         image_path=image_path,
         msg=msg,
         web_summary=web_summary,
-        forced_model=result.get("MODEL"),
+        forced_model=result.model,
+        deadline=deadline,
     )
-    if answer:
-        await msg.reply_text(answer, reply_to_message_id=msg.message_id)
+    with span("stage.claude"):
+        if STREAM_REPLIES:
+            # ответ уже показан в чате по кускам, здесь — итоговый текст
+            answer = await send_streamed_reply(msg, stream_response(chat_id, **reply_kwargs), started=started)
+        else:
+            # синхронный клиент Anthropic — в потоке, чтобы не стоял event loop (и фоновые задачи)
+            answer = await asyncio.to_thread(generate_response, chat_id, **reply_kwargs)
+            if answer:
+                with span("telegram.reply"):
+                    await msg.reply_text(
+                        answer,
+                        reply_to_message_id=msg.message_id,
+                        read_timeout=stage_timeout(deadline, "telegram", floor=5),
+                    )
+                observe("reply.time_to_reply", time.perf_counter() - started)
 
+    if answer:
         # ✅ Сохраняем ответ кота в историю
         try:
-            save_message(
-                chat_id,
-                msg.message_id,
-                0,
-                "Neurocat",
-                "assistant",
-                answer,
-                reply_to_user_id=user_id,
-                source="claude",
-            )
+            with span("stage.save_reply"):
+                save_message(
+                    chat_id,
+                    msg.message_id,
+                    0,
+                    "Neurocat",
+                    "assistant",
+                    answer,
+                    reply_to_user_id=user_id,
+                    source="claude",
+                )
         except Exception as e:
-            print(f"⚠️ Ошибка при сохранении ответа кота: {e}")
+            logger.error("⚠️ Ошибка при сохранении ответа кота: %s", e)
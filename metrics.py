@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Лёгкие метрики внутри процесса: таймеры этапов (span) и счётчики.
+
+Время копится в гистограммах с фиксированными корзинами — запись O(1),
+память не растёт. p50/p95/p99 оцениваются интерполяцией внутри корзины.
+Смотреть: команда /stats у владельца или Prometheus-текст по HTTP
+(METRICS_PORT в config.py).
+"""
+
+import time
+import asyncio
+import logging
+import threading
+import functools
+from bisect import bisect_left
+from contextlib import contextmanager
+from telegram import Update
+from telegram.ext import ContextTypes, CommandHandler
+
+from config import OWNER_ID
+
+logger = logging.getLogger(__name__)
+
+# границы корзин, секунды
+BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 0.75,
+    1, 1.5, 2, 3, 5, 7.5, 10, 15, 20, 30, 60,
+)
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # последняя — «больше 60 с»
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if seen + c >= rank and c:
+                low = BUCKETS[i - 1] if i > 0 else 0.0
+                high = min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+                return low + (high - low) * (rank - seen) / c
+            seen += c
+        return self.max
+
+
+def observe(name: str, seconds: float):
+    with _lock:
+        hist = _histograms.get(name)
+        if hist is None:
+            hist = _histograms[name] = Histogram()
+        hist.observe(seconds)
+
+
+def inc(name: str, n: int = 1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+@contextmanager
+def span(name: str):
+    """Замер времени блока: `with span("stage.interest"): ...` (подходит и для async-кода)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started)
+
+
+def timed(name: str):
+    """Декоратор-таймер для обычных и async-функций."""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def reset():
+    """Обнуляет все метрики (для бенчмарков между прогонами)."""
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def snapshot():
+    """Копия текущих метрик: ({name: Histogram}, {name: int})."""
+    with _lock:
+        hists = {}
+        for name, h in _histograms.items():
+            copy = Histogram()
+            copy.counts = list(h.counts)
+            copy.count, copy.total, copy.max = h.count, h.total, h.max
+            hists[name] = copy
+        return hists, dict(_counters)
+
+
+def stats_text(prefix: str = "") -> str:
+    """Текстовая сводка для /stats: count, p50/p95/p99, max — в миллисекундах."""
+    hists, counters = snapshot()
+    lines = ["⏱ Задержки (мс): count | p50 / p95 / p99 | max"]
+    for name in sorted(hists):
+        if not name.startswith(prefix):
+            continue
+        h = hists[name]
+        lines.append(
+            f"{name}: {h.count} | {h.quantile(0.5) * 1000:.0f} / "
+            f"{h.quantile(0.95) * 1000:.0f} / {h.quantile(0.99) * 1000:.0f} | {h.max * 1000:.0f}"
+        )
+    if counters:
+        lines.append("\n🔢 Счётчики:")
+        for name in sorted(counters):
+            if name.startswith(prefix):
+                lines.append(f"{name}: {counters[name]}")
+    return "\n".join(lines)
+
+
+def prometheus_text() -> str:
+    """Метрики в текстовом формате Prometheus."""
+    hists, counters = snapshot()
+    out = ["# TYPE neurocat_span_seconds histogram"]
+    for name in sorted(hists):
+        h = hists[name]
+        cumulative = 0
+        for bound, c in zip(BUCKETS, h.counts):
+            cumulative += c
+            out.append(f'neurocat_span_seconds_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+        out.append(f'neurocat_span_seconds_bucket{{span="{name}",le="+Inf"}} {h.count}')
+        out.append(f'neurocat_span_seconds_sum{{span="{name}"}} {h.total:.6f}')
+        out.append(f'neurocat_span_seconds_count{{span="{name}"}} {h.count}')
+    out.append("# TYPE neurocat_events_total counter")
+    for name in sorted(counters):
+        out.append(f'neurocat_events_total{{event="{name}"}} {counters[name]}')
+    return "\n".join(out) + "\n"
+
+
+# ------------------ HTTP для Prometheus ------------------
+
+async def _serve_client(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # дочитываем заголовки
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+        if request_line.split(b" ")[1:2] == [b"/metrics"]:
+            body = prometheus_text().encode("utf-8")
+            status = b"200 OK"
+        else:
+            body = b"not found\n"
+            status = b"404 Not Found"
+        writer.write(
+            b"HTTP/1.1 " + status + b"\r\n"
+            b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+            b"Connection: close\r\n\r\n" + body
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.warning("⚠️ Ошибка HTTP метрик: %s", e)
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str, port: int):
+    """Поднимает локальный HTTP: GET /metrics → Prometheus-текст."""
+    server = await asyncio.start_server(_serve_client, host, port)
+    logger.info("📈 Метрики: http://%s:%s/metrics", host, port)
+    return server
+
+
+# ------------------ команды ------------------
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/stats [префикс] — задержки этапов и внешних вызовов (только владелец)"""
+    if update.message.chat.id != OWNER_ID:
+        return
+    prefix = context.args[0] if context.args else ""
+    text = stats_text(prefix)
+    for i in range(0, len(text), 3500):
+        await update.message.reply_text(text[i:i + 3500])
+
+
+def register_metrics_handlers(app):
+    app.add_handler(CommandHandler("stats", stats_command))
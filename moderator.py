@@ -3,12 +3,16 @@
 
 import os
 import json
+import time
+import logging
 from telegram import Update
 from telegram.ext import ContextTypes, CommandHandler
 
 from insult_detect import insult_detect, load_prompt
 from config import OWNER_ID
 
+logger = logging.getLogger(__name__)
+
 TRUSTED_FILE = os.path.join("data", "trusted_users.json")
 PROMPT_FILE = os.path.join("data", "moderation_prompt.txt")
 
@@ -23,15 +27,63 @@ def load_trusted_users():
 
 
 def save_trusted_users(data):
+    global _trusted_checked
     try:
         with open(TRUSTED_FILE, "w", encoding="utf-8") as f:
             json.dump(data, f, indent=2, ensure_ascii=False)
+        _trusted_checked = 0.0  # следующий is_trusted перечитает файл
         return True
     except Exception as e:
-        print(f"❌ Ошибка сохранения trusted.json: {e}")
+        logger.error("❌ Ошибка сохранения trusted.json: %s", e)
         return False
 
 
+# Кэш доверенных: is_trusted зовётся на каждый апдейт (admission.classify — прямо в event loop),
+# поэтому файл перечитываем, только когда сменилось его mtime; mtime смотрим не чаще раза в секунду.
+TRUSTED_CHECK_INTERVAL = 1.0
+_trusted = None
+_trusted_mtime = None
+_trusted_checked = 0.0
+
+
+def _trusted_mtime_now():
+    try:
+        return os.stat(TRUSTED_FILE).st_mtime_ns
+    except OSError:
+        return None
+
+
+def trusted_users():
+    """Доверенные как frozenset'ы (users, chats, usernames); при правке файла перечитываются."""
+    global _trusted, _trusted_mtime, _trusted_checked
+    now = time.monotonic()
+    if _trusted is not None and now - _trusted_checked < TRUSTED_CHECK_INTERVAL:
+        return _trusted
+    _trusted_checked = now
+    mtime = _trusted_mtime_now()
+    if _trusted is None or mtime != _trusted_mtime:
+        try:
+            data = load_trusted_users()
+        except (OSError, ValueError) as e:
+            logger.error("❌ Ошибка чтения trusted.json: %s", e)
+            data = {}
+        _trusted = {key: frozenset(data.get(key, ())) for key in ("users", "chats", "usernames")}
+        _trusted_mtime = mtime
+    return _trusted
+
+
+def is_trusted(message, trusted=None) -> bool:
+    """Сообщение от доверенного пользователя/канала (модерацию не проходит)"""
+    trusted = trusted or trusted_users()
+    sender = message.from_user
+    sender_username = f"@{sender.username}" if sender and sender.username else "@None"
+    return bool(
+        (sender and sender.id in trusted["users"])
+        or sender_username in trusted["usernames"]
+        or (message.sender_chat and message.sender_chat.id in trusted["chats"])
+    )
+
+
 # ------------------ модерация ------------------
 
 async def moderate_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
@@ -44,14 +96,8 @@ async def moderate_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     sender_name = sender.first_name if sender else "?"
     sender_username = f"@{sender.username}" if sender and sender.username else "@None"
 
-    trusted = load_trusted_users()
-
     # --- доверенные пользователи/чаты ---
-    if (
-        sender_id in trusted["users"]
-        or sender_username in trusted["usernames"]
-        or (update.message.sender_chat and update.message.sender_chat.id in trusted["chats"])
-    ):
+    if is_trusted(update.message):
         await context.bot.send_message(
             chat_id=OWNER_ID,
             text=(
@@ -112,7 +158,7 @@ async def moderate_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     try:
         await context.bot.send_message(chat_id=OWNER_ID, text=msg_info)
     except Exception as e:
-        print(f"⚠️ Ошибка при отправке отчёта админу: {e}")
+        logger.warning("⚠️ Ошибка при отправке отчёта админу: %s", e)
 
     return not is_bad
 
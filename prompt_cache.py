@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Помощники для кэширования промптов на стороне API.
+
+И Anthropic, и OpenAI кэшируют только ОДИНАКОВЫЙ ПО БАЙТАМ префикс запроса.
+Поэтому статичная часть (файл промпта + постоянные инструкции) всегда идёт
+первой и без подстановок, а всё изменчивое — время, резюме, веб-поиск,
+история — только после неё.
+"""
+
+import os
+import threading
+
+_files = {}
+_lock = threading.Lock()
+
+
+def read_prompt(path: str) -> str:
+    """
+    Читает файл промпта, перечитывая его только при изменении mtime
+    (prompt_updater может переписать файл на лету).
+    """
+    mtime = os.path.getmtime(path)
+    with _lock:
+        cached = _files.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    with _lock:
+        _files[path] = (mtime, text)
+    return text
+
+
+def anthropic_system(static_text: str, volatile_text: str = ""):
+    """
+    system для Claude: статичный блок с точкой кэша (cache_control)
+    и отдельный изменчивый блок после неё.
+    """
+    blocks = [{
+        "type": "text",
+        "text": static_text,
+        "cache_control": {"type": "ephemeral"},
+    }]
+    if volatile_text:
+        blocks.append({"type": "text", "text": volatile_text})
+    return blocks
+
+
+def system_text(system) -> str:
+    """Текст system-промпта независимо от формы (строка или блоки) — для логов."""
+    if isinstance(system, str):
+        return system
+    return "\n\n".join(b.get("text", "") for b in system)
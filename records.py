@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Компактные записи, которые живут в памяти пачками: строки истории для контекста,
+решения классификатора, события учёта токенов.
+
+__slots__ вместо dict/tuple: у объекта нет __dict__, поля — по имени, а не
+по индексу (row[4] больше не гадаем). Повторяющиеся короткие строки — роль,
+источник, модель, этап — интернируются: sqlite3 отдаёт новую строку "user" на
+каждую строку выборки, после sys.intern это один объект на всех.
+
+Сколько это экономит — bench_records.py.
+"""
+
+import sys
+
+_intern = sys.intern
+
+
+def intern_or_none(value):
+    return _intern(value) if isinstance(value, str) else value
+
+
+class HistoryEntry:
+    """Строка history для контекста Claude (см. context_builder.build_context)."""
+
+    __slots__ = ("role", "first_name", "content", "is_interesting", "source", "artifact_hash", "id")
+
+    def __init__(self, role, first_name, content, is_interesting=None, source=None, artifact_hash=None, id=None):
+        self.role = intern_or_none(role)
+        self.first_name = first_name
+        self.content = content
+        self.is_interesting = is_interesting
+        self.source = intern_or_none(source)
+        self.artifact_hash = artifact_hash
+        self.id = id  # history.id — чтобы поиск по истории не повторял то, что уже в контексте
+
+    @classmethod
+    def from_row(cls, row):
+        """(role, first_name, content, is_interesting, source[, artifact_hash]) из SQLite."""
+        return cls(*row)
+
+    def __repr__(self):
+        return f"HistoryEntry({self.role!r}, {self.first_name!r}, {(self.content or '')[:40]!r}, source={self.source!r})"
+
+
+class InterestResult:
+    """Решение классификатора interest.analyze_message."""
+
+    __slots__ = ("interest", "reaction", "search", "query", "model")
+
+    def __init__(self, interest="NO", reaction=(), search="NO", query="", model="FUN"):
+        self.interest = _intern(interest)
+        self.reaction = tuple(reaction)
+        self.search = _intern(search)
+        self.query = query
+        self.model = _intern(model)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Из JSON классификатора (ключи INTEREST, REACTION, ...); лишние ключи игнорируются."""
+        return cls(
+            interest=str(data.get("INTEREST", "NO")),
+            reaction=data.get("REACTION") or (),
+            search=str(data.get("SEARCH", "NO")),
+            query=data.get("QUERY") or "",
+            model=str(data.get("MODEL", "FUN")),
+        )
+
+    def as_dict(self):
+        """Прежний вид — для JSONL пакетной переоценки и отчётов."""
+        return {
+            "INTEREST": self.interest,
+            "REACTION": list(self.reaction),
+            "SEARCH": self.search,
+            "QUERY": self.query,
+            "MODEL": self.model,
+        }
+
+    @property
+    def interesting(self):
+        return self.interest == "YES"
+
+    @property
+    def wants_search(self):
+        return self.search == "YES"
+
+    def __repr__(self):
+        return repr(self.as_dict())
+
+
+class UsageEvent:
+    """Один вызов LLM в буфере usage_tracker до записи в usage_log."""
+
+    __slots__ = (
+        "created", "chat_id", "user_id", "model", "stage",
+        "input_tokens", "output_tokens", "cached_tokens", "latency_ms",
+    )
+
+    def __init__(self, created, chat_id, user_id, model, stage,
+                 input_tokens, output_tokens, cached_tokens, latency_ms):
+        self.created = created
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.model = _intern(model)
+        self.stage = _intern(stage)
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.cached_tokens = cached_tokens
+        self.latency_ms = latency_ms
+
+    def as_row(self):
+        """Параметры для INSERT INTO usage_log."""
+        return (
+            self.created, self.chat_id, self.user_id, self.model, self.stage,
+            self.input_tokens, self.output_tokens, self.cached_tokens, self.latency_ms,
+        )
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бюджет времени на сообщение (Deadline) и предохранители провайдеров (CircuitBreaker).
+
+handle_message создаёт Deadline(MESSAGE_DEADLINE) и передаёт его дальше:
+каждый внешний вызов получает min(остаток бюджета, STAGE_TIMEOUTS[этап]).
+Если у провайдера BREAKER_FAILURES ошибок подряд, предохранитель размыкается:
+вызовы сразу падают с CircuitOpen, и код идёт по запасному пути
+(эвристика вместо классификатора, ответ без поиска). Через BREAKER_RESET
+секунд пропускается один пробный вызов — удачный замыкает цепь обратно.
+"""
+
+import time
+import asyncio
+import logging
+import threading
+
+import metrics
+from config import STAGE_TIMEOUTS, BREAKER_FAILURES, BREAKER_RESET
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """Бюджет времени сообщения исчерпан ещё до вызова."""
+
+
+class CircuitOpen(Exception):
+    """Провайдер временно отключён предохранителем."""
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return self.expires - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, stage: str = None, floor: float = None) -> float:
+        """
+        Таймаут для этапа: остаток бюджета, но не больше STAGE_TIMEOUTS[stage].
+        floor — минимум, который даём даже при исчерпанном бюджете
+        (отправить уже готовый ответ); без floor исчерпанный бюджет → DeadlineExceeded.
+        """
+        left = self.remaining()
+        cap = STAGE_TIMEOUTS.get(stage) if stage else None
+        if cap is not None:
+            left = min(left, cap)
+        if floor is not None:
+            return max(left, floor)
+        if left <= 0:
+            metrics.inc(f"deadline.exceeded.{stage or 'unknown'}")
+            raise DeadlineExceeded(f"нет времени на этап {stage}")
+        return left
+
+
+def stage_timeout(deadline, stage, floor=None):
+    """Таймаут этапа с учётом бюджета; без бюджета — просто потолок этапа."""
+    if deadline is None:
+        return STAGE_TIMEOUTS.get(stage)
+    return deadline.timeout(stage, floor=floor)
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, failures: int = BREAKER_FAILURES, reset_after: float = BREAKER_RESET):
+        self.name = name
+        self.failures = failures
+        self.reset_after = reset_after
+        self.state = self.CLOSED
+        self._errors = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()  # sync-клиенты вызываются и из потоков
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            # OPEN: пора пробовать; HALF_OPEN: пробный вызов пропал без исхода — пускаем новый
+            if self.state != self.CLOSED and now - self._opened_at >= self.reset_after:
+                self.state = self.HALF_OPEN  # пропускаем один пробный вызов
+                self._opened_at = now
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("🟢 %s: снова доступен", self.name)
+            self.state = self.CLOSED
+            self._errors = 0
+
+    def failure(self):
+        with self._lock:
+            self._errors += 1
+            if self.state == self.HALF_OPEN or self._errors >= self.failures:
+                if self.state != self.OPEN:
+                    logger.warning("🔴 %s: %s ошибок подряд, отключаем на %s с", self.name, self._errors, self.reset_after)
+                    metrics.inc(f"breaker.{self.name}.opened")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def release(self):
+        """Вызов ушёл без исхода (отмена, GeneratorExit): не ошибка, но пробный слот освобождаем."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic() - self.reset_after  # следующий allow() пустит новый пробный
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(name: str) -> CircuitBreaker:
+    with _breakers_lock:
+        br = _breakers.get(name)
+        if br is None:
+            br = _breakers[name] = CircuitBreaker(name)
+        return br
+
+
+def _admit(provider):
+    br = breaker(provider)
+    if not br.allow():
+        metrics.inc(f"breaker.{provider}.rejected")
+        raise CircuitOpen(provider)
+    return br
+
+
+async def call_async(provider: str, func, timeout: float = None):
+    """await func() под предохранителем провайдера и с таймаутом."""
+    br = _admit(provider)
+    try:
+        result = await asyncio.wait_for(func(), timeout)
+    except Exception:  # в т.ч. таймаут
+        br.failure()
+        raise
+    except BaseException:
+        # отмена — не вина провайдера, но пробный вызов не должен держать HALF_OPEN
+        br.release()
+        raise
+    br.success()
+    return result
+
+
+def call_sync(provider: str, func):
+    """func() под предохранителем (таймаут func передаёт клиенту сама)."""
+    br = _admit(provider)
+    try:
+        result = func()
+    except Exception:
+        br.failure()
+        raise
+    except BaseException:
+        br.release()
+        raise
+    br.success()
+    return result
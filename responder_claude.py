@@ -2,24 +2,37 @@
 # -*- coding: utf-8 -*-
 
 import os
+import time
+import asyncio
+import logging
 import sqlite3
 import base64
-import anthropic
 
 from config import (
-    USER_DAILY_LIMIT,
-    BOT_DAILY_LIMIT,
-    ANTHROPIC_API_KEY,
     OWNER_ID,
-    SYSTEM_USER_IDS,
-    TRUSTED_CHANNELS,
+    CONTEXT_FETCH_ROWS,
+    SUMMARY_RECENT_TURNS,
+    DB_BUSY_TIMEOUT,
     get_current_time,
 )
-
-client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+from context_builder import build_context
+from records import HistoryEntry
+from chat_summary import get_summary
+from history_search import search_history, format_retrieved
+from prompt_cache import read_prompt, anthropic_system, system_text
+from metrics import span, timed, observe
+from resilience import CircuitOpen, breaker, call_sync, stage_timeout
+import cassette
+from usage_tracker import extract_usage, record_usage
+from clients import get_anthropic, get_async_anthropic
+import runtime_config
+from logs import dump_enabled
 
 DB_PATH = os.path.join(os.getcwd(), "group_history.db")
 PROMPT_PATH = os.path.join("data", "claude_prompt.txt")
+IDLE_PROMPT_PATH = os.path.join("data", "prompt_idle.txt")
+
+logger = logging.getLogger(__name__)
 
 # 🔹 Карта ярлыков interest.py → реальные модели Anthropic
 MODEL_MAP = {
@@ -33,9 +46,10 @@ MODEL_FALLBACK = "claude-3-5-haiku-20241022"
 
 
 def get_db_connection():
-    return sqlite3.connect(DB_PATH)
+    return sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT)
 
 
+@timed("sqlite.user_daily_count")
 def user_daily_count(user_id, chat_id):
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -54,6 +68,7 @@ def user_daily_count(user_id, chat_id):
     return count
 
 
+@timed("sqlite.total_daily_count")
 def get_total_daily_count():
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -70,57 +85,65 @@ def get_total_daily_count():
 
 
 def load_system_prompt():
-    with open(PROMPT_PATH, "r", encoding="utf-8") as f:
-        return f.read()
+    return read_prompt(PROMPT_PATH)
 
 
-def get_chat_history(chat_id, limit=15):
-    """Берём последние сообщения чата для контекста (до 15)."""
+@timed("sqlite.history")
+def fetch_history_rows(chat_id, limit=CONTEXT_FETCH_ROWS, after_id=0, keep_recent=0):
+    """
+    Последние строки истории чата (от старых к новым, HistoryEntry) — кандидаты в контекст.
+    Если есть резюме, берём только строки после него (id > after_id),
+    но не меньше keep_recent самых свежих. Текст артефактов подставляется из artifacts.
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
-        SELECT role, first_name, content, is_interesting, source
-        FROM history
-        WHERE chat_id = ?
-        ORDER BY created DESC
+        SELECT h.id, h.role, h.first_name, COALESCE(a.content, h.content),
+               h.is_interesting, h.source, h.artifact_hash
+        FROM history h
+        LEFT JOIN artifacts a ON a.hash = h.artifact_hash
+        WHERE h.chat_id = ?
+        ORDER BY h.created DESC
         LIMIT ?
         """,
         (chat_id, limit),
     )
     rows = cursor.fetchall()
     conn.close()
-
-    history = []
-    for role, name, content, is_interesting, source in reversed(rows):
-        if not content:
-            continue
-
-        if is_interesting == 1:
-            interest_text = "(✨ помечено как интересное)"
-        elif is_interesting == 0:
-            interest_text = "(😴 помечено как неинтересное)"
-        else:
-            interest_text = "(без оценки)"
-
-        if role == "assistant":
-            history.append({"role": "assistant", "content": content})
-        else:
-            history.append({
-                "role": "user",
-                "content": f"{name}: {content} {interest_text}"
-            })
-
-    return history
+    rows = [HistoryEntry(*r[1:], id=r[0]) for i, r in enumerate(rows) if r[0] > after_id or i < keep_recent]
+    return rows[::-1]
+
+
+def get_chat_history(chat_id, model=None, final_message=None, web_summary=None, after_id=0):
+    """
+    Контекст для Claude в рамках бюджета токенов модели
+    (см. context_builder.build_context). Последнее сообщение идёт целиком.
+    Возвращает (messages, history.id попавших в контекст строк).
+    """
+    rows = fetch_history_rows(chat_id, after_id=after_id, keep_recent=SUMMARY_RECENT_TURNS if after_id else 0)
+    history, stats = build_context(
+        rows,
+        final_message=final_message,
+        model=model,
+        skip_texts=[web_summary] if web_summary else (),
+    )
+    logger.info(
+        "🧮 Контекст: %s ток. из %s (выброшено %s, обрезано %s)",
+        stats["tokens"], stats["raw_tokens"], stats["dropped"], stats["truncated"],
+        extra={"context_tokens": stats["tokens"]},
+    )
+    return history, stats["ids"]
 
 
 def is_exempt_from_limits(user_id, msg=None):
     if not user_id:
         return False
-    if user_id in SYSTEM_USER_IDS:
+    cfg = runtime_config.snapshot()
+    if user_id in cfg.system_user_ids:
         return True
     if user_id == 136817688 and msg and msg.sender_chat:
-        return msg.sender_chat.id in TRUSTED_CHANNELS
+        return msg.sender_chat.id in cfg.trusted_channels
     return False
 
 
@@ -135,7 +158,7 @@ def encode_image(image_path):
         return base64.b64encode(f.read()).decode("utf-8")
 
 
-def generate_response(
+def build_request(
     chat_id,
     current_user=None,
     user_id=None,
@@ -145,33 +168,37 @@ def generate_response(
     web_summary=None,
     forced_model=None
 ):
+    """
+    Собирает запрос к Claude: {"model", "system", "messages"}.
+    Возвращает None, если пользователь исчерпал дневной лимит.
+    """
     # --- лимиты ---
     if user_id and not is_exempt_from_limits(user_id, msg) and user_id != OWNER_ID:
-        if user_daily_count(user_id, chat_id) >= USER_DAILY_LIMIT:
-            print(f"⛔ Лимит {USER_DAILY_LIMIT} ответов/сутки для user_id={user_id}")
+        limit = runtime_config.snapshot().user_daily_limit
+        if user_daily_count(user_id, chat_id) >= limit:
+            logger.info("⛔ Лимит %s ответов/сутки для user_id=%s", limit, user_id)
             return None
 
     # --- системный промпт ---
-    system_prompt = load_system_prompt()
-    system_prompt = (
-        f"{system_prompt}\n\n"
-        f"⚡️ Сейчас {get_current_time()} (локальное время НейроКота).\n\n"
+    # Статичная часть идёт первой и не меняется между запросами → кэшируется API.
+    # Всё изменчивое (время, резюме, веб-поиск) — отдельным блоком после неё.
+    static_prompt = (
+        f"{load_system_prompt()}\n\n"
         "‼️ ВАЖНО: всегда отвечай именно на последнее сообщение в истории. "
         "Предыдущие реплики учитывай только как фон."
     )
-
-    history = get_chat_history(chat_id)
-
-    # 🔹 web_summary всегда идёт отдельным блоком
-    if web_summary:
-        system_prompt += (
-            "\n\n📌 ВНИМАНИЕ: Ниже приведены результаты веб-поиска по запросу пользователя. "
-            "Это уже готовая информация из интернета, используй её для ответа. "
-            "Не говори, что у тебя нет доступа к сети.\n"
-            f"{web_summary.strip()}"
+    volatile_prompt = f"⚡️ Сейчас {get_current_time()} (локальное время НейроКота)."
+
+    # 🧾 резюме давней части беседы (обновляется в фоне, см. chat_summary.py)
+    summary, summary_last_id = get_summary(chat_id)
+    if summary:
+        volatile_prompt += (
+            "\n\n🧾 Краткое содержание беседы до последних сообщений:\n"
+            f"{summary}"
         )
 
     # 📷 если фото
+    final_message = None
     if image_path:
         base64_img = encode_image(image_path)
         user_content = [
@@ -184,13 +211,13 @@ def generate_response(
             user_content.append({"type": "text", "text": f"‼️ Вот последнее сообщение, на которое нужно ответить: {text}"})
         else:
             user_content.append({"type": "text", "text": f"‼️ Вот последнее сообщение, на которое нужно ответить: [Фото]"})
-        history.append({"role": "user", "content": user_content})
+        final_message = {"role": "user", "content": user_content}
     else:
         if current_user and text:
-            history.append({
+            final_message = {
                 "role": "user",
                 "content": f"‼️ Вот последнее сообщение, на которое нужно ответить: {current_user}: {text}"
-            })
+            }
 
     # --- выбор модели ---
     if forced_model and forced_model in MODEL_MAP:
@@ -198,23 +225,158 @@ def generate_response(
     else:
         model = choose_model(image_path)
 
-    try:
-        print("=== PROMPT TO CLAUDE ===")
-        print("SYSTEM:", system_prompt[:400], "...\n")
-        for h in history[-10:]:
-            print(f"{h['role'].upper()}: {str(h['content'])[:200]} ...")
+    # --- история в рамках бюджета токенов модели ---
+    history, context_ids = get_chat_history(
+        chat_id,
+        model=model,
+        final_message=final_message,
+        web_summary=web_summary,
+        after_id=summary_last_id,
+    )
 
-        response = client.messages.create(
-            model=model,
-            max_tokens=800,
-            temperature=0.7,
-            system=system_prompt,
-            messages=history,
+    # 🔎 давние, но относящиеся к вопросу сообщения (FTS5, history_search.py) — кроме уже попавших в историю
+    if text:
+        retrieved = format_retrieved(search_history(chat_id, text, exclude_ids=context_ids))
+        if retrieved:
+            volatile_prompt += "\n\n🔎 Из давней истории чата (может пригодиться):\n" + retrieved
+
+    # 🔹 web_summary всегда идёт отдельным блоком
+    if web_summary:
+        volatile_prompt += (
+            "\n\n📌 ВНИМАНИЕ: Ниже приведены результаты веб-поиска по запросу пользователя. "
+            "Это уже готовая информация из интернета, используй её для ответа. "
+            "Не говори, что у тебя нет доступа к сети.\n"
+            f"{web_summary.strip()}"
+        )
+
+    system_prompt = anthropic_system(static_prompt, volatile_prompt)
+
+    # полный промпт — только в выборочном дампе (LOG_DUMP_SAMPLE), иначе даже не собираем строку
+    if dump_enabled(logger):
+        logger.debug(
+            "=== PROMPT TO CLAUDE (%s) ===\nSYSTEM: %s\n%s",
+            model,
+            system_text(system_prompt),
+            "\n".join(f"{h['role'].upper()}: {h['content']}" for h in history),
         )
-        answer = "".join([block.text for block in response.content if block.type == "text"]).strip()
-        print(f"=== RAW CLAUDE RESPONSE ({model}) ===\n{answer}\n")
-        return answer
+
+    return {"model": model, "system": system_prompt, "messages": history}
+
+
+def generate_response(chat_id, deadline=None, **kwargs):
+    """Ответ Claude целиком (без стриминга). Аргументы — как у build_request."""
+    request = build_request(chat_id, **kwargs)
+    if not request:
+        return None
+
+    try:
+        return _complete(chat_id, request, kwargs.get("user_id"), deadline=deadline)
+    except CircuitOpen:
+        logger.warning("⚠️ Claude временно отключён предохранителем — без ответа")
+        return None
+    except Exception as e:
+        logger.error("❌ Ошибка при вызове Claude API: %s", e)
+        return None
+
+
+def _complete(chat_id, request, user_id=None, deadline=None, stage="reply"):
+    """Один вызов messages.create (через кассету, если она включена)."""
+    model = request["model"]
+
+    def _call():
+        timeout = stage_timeout(deadline, "claude")
+        with span("anthropic.messages"):
+            response = call_sync("anthropic", lambda: get_anthropic().messages.create(
+                max_tokens=800,
+                temperature=0.7,
+                timeout=timeout,
+                **request,
+            ))
+        text = "".join([block.text for block in response.content if block.type == "text"])
+        return {"text": text, "usage": extract_usage(response)}
+
+    reply, elapsed = cassette.call("generate_response", request, _call)
+    record_usage(stage, model, reply["usage"], elapsed, chat_id=chat_id, user_id=user_id)
+    answer = reply["text"].strip()
+    if dump_enabled(logger):
+        logger.debug("=== RAW CLAUDE RESPONSE (%s) ===\n%s", model, answer)
+    return answer
+
+
+def generate_idle_message(chat_id):
+    """Реплика «первым» в затихший чат (промпт data/prompt_idle.txt)."""
+    model = MODEL_MAP["FUN"]
+    summary, summary_last_id = get_summary(chat_id)
+    volatile_prompt = f"⚡️ Сейчас {get_current_time()} (локальное время НейроКота)."
+    if summary:
+        volatile_prompt += f"\n\n🧾 Краткое содержание беседы:\n{summary}"
+
+    history, _ = get_chat_history(
+        chat_id,
+        model=model,
+        final_message={"role": "user", "content": "🤫 В чате тишина. Напиши короткую реплику первым."},
+        after_id=summary_last_id,
+    )
+    request = {
+        "model": model,
+        "system": anthropic_system(read_prompt(IDLE_PROMPT_PATH), volatile_prompt),
+        "messages": history,
+    }
+    try:
+        return _complete(chat_id, request, stage="idle")
     except Exception as e:
-        print(f"❌ Ошибка при вызове Claude API: {e}")
+        logger.error("❌ Ошибка генерации idle-сообщения: %s", e)
         return None
 
+
+async def stream_response(chat_id, deadline=None, **kwargs):
+    """
+    Стриминговый вариант generate_response: асинхронно отдаёт куски текста
+    по мере генерации. Ошибки API пробрасываются вызывающему —
+    он решает, что делать с уже показанной частью ответа.
+    """
+    # история из SQLite, FTS-поиск, резюме, base64 фото — всё синхронное, в поток
+    request = await asyncio.to_thread(build_request, chat_id, **kwargs)
+    if not request:
+        return
+
+    if cassette.enabled():
+        # запись/воспроизведение идёт по обычному (нестриминговому) вызову
+        answer = await asyncio.to_thread(_complete, chat_id, request, kwargs.get("user_id"), deadline)
+        if answer:
+            yield answer
+        return
+
+    model = request["model"]
+    br = breaker("anthropic")
+    if not br.allow():
+        raise CircuitOpen("anthropic")
+    started = time.perf_counter()
+    first_chunk = True
+    try:
+        async with get_async_anthropic().messages.stream(
+            max_tokens=800,
+            temperature=0.7,
+            timeout=stage_timeout(deadline, "claude"),
+            **request,
+        ) as stream:
+            async for chunk in stream.text_stream:
+                if first_chunk:
+                    observe("anthropic.stream_first_token", time.perf_counter() - started)
+                    first_chunk = False
+                yield chunk
+            final = await stream.get_final_message()
+    except Exception:
+        br.failure()
+        raise
+    except BaseException:  # отмена и GeneratorExit (читатель ушёл) — не ошибка провайдера
+        br.release()
+        raise
+    br.success()
+
+    observe("anthropic.stream", time.perf_counter() - started)
+    record_usage(
+        "reply_stream", model, extract_usage(final), time.perf_counter() - started,
+        chat_id=chat_id, user_id=kwargs.get("user_id"),
+    )
+
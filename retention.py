@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Архивация старой истории: строки history старше RETENTION_DAYS переезжают
+в gzip JSONL по месяцам (ARCHIVE_DIR/history-YYYY-MM.jsonl.gz) и удаляются
+из живой БД (триггеры чистят и FTS-индекс, осиротевшие artifacts — тоже).
+Потом PRAGMA incremental_vacuum возвращает освободившиеся страницы —
+файл БД не растёт бесконечно, горячие данные помещаются в page cache.
+
+Бот запускает чистку сам раз в сутки в окне RETENTION_WINDOW (ночью).
+Вручную:
+    python retention.py                 # архивировать и ужать сейчас
+    python retention.py --dry-run       # сколько строк уехало бы
+    python retention.py --vacuum-full   # один раз для старой БД: включить auto_vacuum
+
+Архив читают: `python interest.py batch --archive ...` и `/find archive слова`.
+"""
+
+import os
+import re
+import sys
+import glob
+import gzip
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+from datetime import datetime, timedelta
+
+import metrics
+from artifacts import gc_artifacts
+from config import (
+    RETENTION_DAYS,
+    ARCHIVE_DIR,
+    RETENTION_WINDOW,
+    RETENTION_BATCH,
+    RETENTION_VACUUM_PAGES,
+    DB_BUSY_TIMEOUT,
+    get_current_time,
+)
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.path.join(os.getcwd(), "group_history.db")
+
+COLUMNS = (
+    "id", "chat_id", "message_id", "user_id", "first_name", "role", "created",
+    "content", "reply_to_user_id", "reaction", "is_interesting", "source", "artifact_hash",
+)
+# в архив идёт полный текст артефакта, чтобы архив читался без таблицы artifacts
+_SELECT_COLUMNS = ", ".join(
+    "COALESCE(a.content, h.content)" if c == "content" else f"h.{c}" for c in COLUMNS
+)
+
+
+def get_db_connection():
+    return sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT)
+
+
+def archive_path(month: str) -> str:
+    return os.path.join(ARCHIVE_DIR, f"history-{month}.jsonl.gz")
+
+
+def _append(month, rows):
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    # каждая порция — отдельный gzip-member, файл остаётся читаемым целиком
+    with gzip.open(archive_path(month), "at", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False, default=str) + "\n")
+
+
+@metrics.timed("retention.archive")
+def archive_old_rows(days=RETENTION_DAYS, batch=RETENTION_BATCH, dry_run=False) -> int:
+    """Переносит строки старше days в архив; возвращает число перенесённых строк."""
+    cutoff = datetime.now() - timedelta(days=days)
+    conn = get_db_connection()
+    moved = 0
+    try:
+        if dry_run:
+            return conn.execute("SELECT COUNT(*) FROM history WHERE created < ?", (cutoff,)).fetchone()[0]
+
+        while True:
+            rows = conn.execute(
+                f"""
+                SELECT {_SELECT_COLUMNS}
+                FROM history h
+                LEFT JOIN artifacts a ON a.hash = h.artifact_hash
+                WHERE h.created < ?
+                ORDER BY h.id
+                LIMIT ?
+                """,
+                (cutoff, batch),
+            ).fetchall()
+            if not rows:
+                break
+
+            by_month = {}
+            for row in rows:
+                by_month.setdefault(str(row[6])[:7], []).append(row)
+            # сначала архив, потом удаление: при сбое строка окажется в обоих местах, но не потеряется
+            for month, month_rows in by_month.items():
+                _append(month, month_rows)
+
+            ids = [row[0] for row in rows]
+            conn.executemany("DELETE FROM history WHERE id = ?", [(i,) for i in ids])
+            conn.commit()
+            moved += len(rows)
+            metrics.inc("retention.archived_rows", len(rows))
+            time.sleep(0.05)  # даём пройти записям бота между порциями
+
+        if moved:
+            dropped = gc_artifacts(conn)
+            conn.commit()
+            metrics.inc("retention.artifacts_dropped", dropped)
+    finally:
+        conn.close()
+    return moved
+
+
+def incremental_vacuum(max_pages=RETENTION_VACUUM_PAGES) -> int:
+    """Возвращает ОС свободные страницы порциями; результат — сколько осталось свободных."""
+    conn = get_db_connection()
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            logger.warning("⚠️ auto_vacuum не INCREMENTAL — один раз запусти `python retention.py --vacuum-full`")
+            return conn.execute("PRAGMA freelist_count").fetchone()[0]
+        while conn.execute("PRAGMA freelist_count").fetchone()[0] > 0:
+            # executescript шагает прагму до конца; execute() освободил бы одну страницу
+            conn.executescript(f"PRAGMA incremental_vacuum({int(max_pages)});")
+            time.sleep(0.05)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return conn.execute("PRAGMA freelist_count").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def vacuum_full():
+    """Одноразово: включить incremental auto_vacuum на уже существующей БД (полный VACUUM)."""
+    conn = get_db_connection()
+    try:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+def run_retention(dry_run=False):
+    started = time.perf_counter()
+    size_before = os.path.getsize(DB_PATH) if os.path.exists(DB_PATH) else 0
+    moved = archive_old_rows(dry_run=dry_run)
+    if dry_run:
+        logger.info("🗄 Уехало бы в архив: %s строк старше %s дн.", moved, RETENTION_DAYS)
+        return moved
+    if moved:
+        incremental_vacuum()
+    size_after = os.path.getsize(DB_PATH)
+    logger.info(
+        "🗄 Архивировано %s строк за %.1f с, БД %.1f → %.1f МБ",
+        moved, time.perf_counter() - started, size_before / 1024 / 1024, size_after / 1024 / 1024,
+    )
+    return moved
+
+
+def in_window(window=RETENTION_WINDOW) -> bool:
+    start, end = window
+    hour = int(get_current_time("%H"))
+    return (start <= hour or hour < end) if start > end else (start <= hour < end)
+
+
+async def run_scheduler(check_every=600):
+    """Фоновая задача бота: раз в сутки, в окне RETENTION_WINDOW."""
+    last_run = 0.0
+    while True:
+        await asyncio.sleep(check_every)
+        if in_window() and time.time() - last_run > 20 * 3600:
+            last_run = time.time()
+            try:
+                await asyncio.to_thread(run_retention)
+            except Exception as e:
+                logger.error("❌ Ошибка архивации истории: %s", e, exc_info=True)
+
+
+# ==============================
+# Чтение архива
+# ==============================
+
+def archive_files(since=None, until=None):
+    """Файлы архива по порядку; since/until — даты 'YYYY-MM[-DD]' (фильтр по месяцу)."""
+    files = sorted(glob.glob(os.path.join(ARCHIVE_DIR, "history-*.jsonl.gz")))
+    out = []
+    for path in files:
+        month = re.search(r"history-(\d{4}-\d{2})", path).group(1)
+        if since and month < since[:7]:
+            continue
+        if until and month > until[:7]:
+            continue
+        out.append(path)
+    return out
+
+
+def iter_archive(chat_id=None, since=None, until=None):
+    """Строки архива (dict с колонками history), по одной."""
+    for path in archive_files(since, until):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                if chat_id is not None and row.get("chat_id") != chat_id:
+                    continue
+                created = str(row.get("created") or "")
+                if (since and created < since) or (until and created >= until):
+                    continue
+                yield row
+
+
+def iter_archive_messages(chat_id=None, since=None, until=None):
+    """Сообщения пользователей из архива — в формате interest.iter_db_messages."""
+    for row in iter_archive(chat_id, since, until):
+        if row.get("role") != "user" or (row.get("source") or "chat") != "chat" or not row.get("content"):
+            continue
+        yield {
+            "id": row["id"], "chat_id": row["chat_id"], "user_id": row.get("user_id"),
+            "text": row["content"], "created": row.get("created"),
+            "is_interesting": row.get("is_interesting"),
+        }
+
+
+def search_archive(words, chat_id=None, limit=10):
+    """Простой поиск по архиву: строки, где встречается больше всего слов (без индекса)."""
+    words = [w.lower() for w in words if w]
+    if not words:
+        return []
+    found = []
+    for row in iter_archive(chat_id):
+        text = (row.get("content") or "").lower()
+        score = sum(1 for w in words if w in text)
+        if score:
+            found.append((score, row))
+    found.sort(key=lambda x: (-x[0], str(x[1].get("created"))))
+    return [row for _, row in found[:limit]]
+
+
+if __name__ == "__main__":
+    from logs import setup_logging
+
+    setup_logging(json_output=False)
+    if "--vacuum-full" in sys.argv:
+        vacuum_full()
+        print("✅ VACUUM выполнен, auto_vacuum = INCREMENTAL")
+    else:
+        run_retention(dry_run="--dry-run" in sys.argv)
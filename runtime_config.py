@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Настройки, которые меняются без перезапуска бота: разрешённые группы,
+системные пользователи, доверенные каналы, дневные лимиты, задержки.
+
+Значения по умолчанию — из config.py, поверх — файл RUNTIME_CONFIG_PATH (JSON),
+поверх — переменные окружения NEUROCAT_<КЛЮЧ> (списки через запятую).
+Собранный снимок неизменяем, списки в нём — frozenset (проверка `in` за O(1)).
+
+Снимок подменяется целиком (одно присваивание ссылки):
+- фоновая задача watch() видит новое mtime файла и перечитывает его;
+- владелец: /config, /config reload, /config set|add|remove ключ значение
+  (ключи, заданные в окружении, команда не меняет — помечены 🔒).
+Новая версия сначала проходит validate(); с ошибкой остаётся старая.
+
+Обработка сообщения закрепляет снимок в contextvar (pinned() в bot_ai.process_message):
+всё сообщение, включая asyncio.to_thread, видит одну версию, даже если
+посередине пришла новая.
+"""
+
+import os
+import json
+import asyncio
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from telegram import Update
+from telegram.ext import ContextTypes, CommandHandler
+
+import metrics
+import config
+from config import OWNER_ID, RUNTIME_CONFIG_PATH, RUNTIME_CONFIG_CHECK_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# ключ → (атрибут config.py с умолчанием, тип)
+FIELDS = {
+    "allowed_groups": ("ALLOWED_GROUPS", frozenset),
+    "system_user_ids": ("SYSTEM_USER_IDS", frozenset),
+    "trusted_channels": ("TRUSTED_CHANNELS", frozenset),
+    "user_daily_limit": ("USER_DAILY_LIMIT", int),
+    "bot_daily_limit": ("BOT_DAILY_LIMIT", int),
+    "min_delay": ("MIN_DELAY", float),
+    "max_delay": ("MAX_DELAY", float),
+}
+
+
+class RuntimeConfig:
+    """Неизменяемый снимок настроек."""
+
+    __slots__ = ("version", "source") + tuple(FIELDS)
+
+    def __init__(self, values, version=0, source="config.py"):
+        for key in FIELDS:
+            object.__setattr__(self, key, values[key])
+        object.__setattr__(self, "version", version)
+        object.__setattr__(self, "source", source)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("RuntimeConfig неизменяем — используй apply()/reload()")
+
+    def as_dict(self):
+        return {
+            key: sorted(getattr(self, key)) if kind is frozenset else getattr(self, key)
+            for key, (_, kind) in FIELDS.items()
+        }
+
+
+def _coerce(key, value):
+    kind = FIELDS[key][1]
+    if kind is frozenset:
+        if isinstance(value, str):
+            value = [v for v in value.replace(";", ",").split(",") if v.strip()]
+        if not isinstance(value, (list, tuple, set, frozenset)):
+            raise ValueError(f"{key}: нужен список, получено {type(value).__name__}")
+        try:
+            return frozenset(int(v) for v in value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{key}: все значения должны быть числовыми ID")
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{key}: ожидается {kind.__name__}, получено {value!r}")
+
+
+def validate(values: dict) -> dict:
+    """Приводит типы и проверяет; ValueError со списком проблем, если что-то не так."""
+    unknown = set(values) - set(FIELDS)
+    if unknown:
+        raise ValueError(f"неизвестные ключи: {', '.join(sorted(unknown))}")
+
+    clean, errors = {}, []
+    for key, value in values.items():
+        try:
+            clean[key] = _coerce(key, value)
+        except ValueError as e:
+            errors.append(str(e))
+    if errors:
+        raise ValueError("; ".join(errors))
+
+    if "allowed_groups" in clean:
+        if not clean["allowed_groups"]:
+            errors.append("allowed_groups: пустой список — бот замолчит везде")
+        elif any(chat_id >= 0 for chat_id in clean["allowed_groups"]):
+            errors.append("allowed_groups: ID групп отрицательные")
+    for key in ("user_daily_limit", "bot_daily_limit", "min_delay", "max_delay"):
+        if key in clean and clean[key] < 0:
+            errors.append(f"{key}: не может быть отрицательным")
+    if "min_delay" in clean and "max_delay" in clean and clean["min_delay"] > clean["max_delay"]:
+        errors.append("min_delay больше max_delay")
+    if errors:
+        raise ValueError("; ".join(errors))
+    return clean
+
+
+def _defaults() -> dict:
+    return {key: getattr(config, attr) for key, (attr, _) in FIELDS.items()}
+
+
+def _read_file(path) -> dict:
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError(f"{path}: ожидается JSON-объект")
+    return data
+
+
+def _read_env() -> dict:
+    values = {}
+    for key in FIELDS:
+        raw = os.environ.get(f"NEUROCAT_{key.upper()}")
+        if raw is not None:
+            values[key] = raw
+    return values
+
+
+def load(path=RUNTIME_CONFIG_PATH, version=0) -> RuntimeConfig:
+    """config.py → файл → окружение; ValueError, если итог не проходит проверку."""
+    values = _defaults()
+    values.update(_read_file(path))
+    env = _read_env()
+    values.update(env)
+    source = "config.py" + (f" + {path}" if path and os.path.exists(path) else "") + (" + env" if env else "")
+    return RuntimeConfig(validate(values), version=version, source=source)
+
+
+try:
+    _current = load()
+except (ValueError, OSError) as e:
+    # битый файл не должен мешать старту: работаем на config.py, владелец увидит ошибку в логе
+    logger.error("❌ %s не применён: %s — используем config.py", RUNTIME_CONFIG_PATH, e)
+    _current = RuntimeConfig(validate(_defaults()))
+_pinned = contextvars.ContextVar("runtime_config", default=None)
+_swap_lock = threading.Lock()  # reload из команды и из watch() не должны перебить друг друга
+
+
+def current() -> RuntimeConfig:
+    return _current
+
+
+def snapshot() -> RuntimeConfig:
+    """Снимок для текущего сообщения (закреплённый) или самый свежий."""
+    return _pinned.get() or _current
+
+
+@contextmanager
+def pinned():
+    token = _pinned.set(_current)
+    try:
+        yield _current
+    finally:
+        _pinned.reset(token)
+
+
+def _swap(new: RuntimeConfig):
+    global _current
+    old, _current = _current, new
+    metrics.inc("config.reloads")
+    changed = [k for k in FIELDS if getattr(old, k) != getattr(new, k)]
+    logger.info("⚙️ Конфиг v%s (%s): изменено %s", new.version, new.source, ", ".join(changed) or "ничего")
+
+
+def reload(path=RUNTIME_CONFIG_PATH):
+    """Перечитывает файл и окружение. Возвращает (ok, текст для лога/владельца)."""
+    with _swap_lock:
+        return _reload(path)
+
+
+def _reload(path):
+    try:
+        new = load(path, version=_current.version + 1)
+    except (ValueError, OSError) as e:  # json.JSONDecodeError — тоже ValueError
+        metrics.inc("config.reload_errors")
+        logger.error("❌ Конфиг не применён, остаётся v%s: %s", _current.version, e)
+        return False, f"❌ Не применено (остаётся v{_current.version}): {e}"
+    if new.as_dict() == _current.as_dict():
+        return True, f"ℹ️ Без изменений (v{_current.version})"
+    _swap(new)
+    return True, f"✅ Конфиг v{new.version} применён"
+
+
+def apply(**changes):
+    """Меняет отдельные ключи в памяти (loadtest, тесты); файл не трогает."""
+    with _swap_lock:
+        values = {key: getattr(_current, key) for key in FIELDS}
+        values.update(validate(changes))
+        _swap(RuntimeConfig(validate(values), version=_current.version + 1, source="apply()"))
+
+
+def save_changes(changes: dict, path=RUNTIME_CONFIG_PATH):
+    """
+    Проверяет изменения, пишет файл атомарно (tmp + os.replace) и применяет.
+    Ключ, заданный в окружении, файлом не переопределить — ValueError, файл не трогаем.
+    """
+    env = _read_env()
+    pinned_keys = [key for key in changes if key in env]
+    if pinned_keys:
+        raise ValueError(
+            ", ".join(f"{key} задан через NEUROCAT_{key.upper()}" for key in pinned_keys)
+            + " — окружение главнее файла, сначала уберите переменную"
+        )
+    values = _read_file(path)
+    values.update({
+        key: sorted(value) if isinstance(value, frozenset) else value
+        for key, value in validate(changes).items()
+    })
+    merged = _defaults()
+    merged.update(values)
+    validate(merged)  # ValueError → файл не трогаем
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(values, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+    return reload(path)
+
+
+async def watch(path=RUNTIME_CONFIG_PATH, interval=RUNTIME_CONFIG_CHECK_INTERVAL):
+    """Фоновая задача: файл изменился (mtime) → reload(). Так же подхватывают правки и воркеры шардов."""
+    def _mtime():
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    seen = None  # первая проверка перечитает файл: правка между стартом и watch() не потеряется
+    while True:
+        await asyncio.sleep(interval)
+        mtime = _mtime()
+        if mtime != seen:
+            seen = mtime
+            await asyncio.to_thread(reload, path)
+
+
+# ------------------ команды ------------------
+
+async def config_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /config — текущие значения; /config reload — перечитать файл;
+    /config set ключ значение | add/remove ключ ID (только владелец)
+    """
+    if update.message.chat.id != OWNER_ID:
+        return
+
+    args = list(context.args or [])
+    if not args:
+        cfg = current()
+        env = _read_env()
+        lines = [f"⚙️ Конфиг v{cfg.version} ({cfg.source})"]
+        lines += [
+            f"{key}: {value}" + (f" 🔒 NEUROCAT_{key.upper()}" if key in env else "")
+            for key, value in cfg.as_dict().items()
+        ]
+        await update.message.reply_text("\n".join(lines))
+        return
+
+    action = args[0]
+    if action == "reload":
+        _, text = await asyncio.to_thread(reload)
+        await update.message.reply_text(text)
+        return
+
+    if action not in ("set", "add", "remove") or len(args) < 3 or args[1] not in FIELDS:
+        await update.message.reply_text(
+            "Использование: /config [reload | set ключ значение | add|remove ключ ID]\n"
+            f"Ключи: {', '.join(FIELDS)}"
+        )
+        return
+
+    key, value = args[1], " ".join(args[2:])
+    if action == "set":
+        change = value
+    else:
+        if FIELDS[key][1] is not frozenset:
+            await update.message.reply_text(f"❌ {key} — не список, используй set")
+            return
+        items = set(getattr(current(), key))
+        try:
+            item = int(value)
+        except ValueError:
+            await update.message.reply_text("❌ ID должен быть числом")
+            return
+        if action == "add":
+            items.add(item)
+        else:
+            items.discard(item)
+        change = sorted(items)
+
+    try:
+        _, text = await asyncio.to_thread(save_changes, {key: change})
+    except ValueError as e:
+        text = f"❌ Не применено: {e}"
+    await update.message.reply_text(text)
+
+
+def register_config_handlers(app):
+    app.add_handler(CommandHandler("config", config_command))
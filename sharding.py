@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Шардирование групп по процессам (SHARD_WORKERS > 0 в config.py).
+
+Супервизор получает апдейты (polling или webhook) и ничего сам не обрабатывает:
+каждый апдейт уходит воркеру crc32(chat_id) % N. Один чат всегда попадает
+в один процесс — порядок сообщений и память процесса (резюме, счётчики)
+сохраняются. Каждый воркер — обычный Application со всеми обработчиками,
+но без собственного updater, со своим GIL и event loop.
+
+БД общая: group_history.db в WAL (читатели не мешают писателю), а писатели
+ждут блокировку до DB_BUSY_TIMEOUT секунд. Упавший воркер перезапускается
+с той же очередью; апдейт, который он обрабатывал в момент падения, теряется.
+"""
+
+import zlib
+import time
+import signal
+import asyncio
+import logging
+import multiprocessing as mp
+
+import metrics
+from config import BOT_TOKEN, UPDATE_MODE, SHARD_CHECK_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+def shard_for(chat_id, workers: int) -> int:
+    """Стабильный номер шарда (hash() в Python рандомизирован между процессами)"""
+    return zlib.crc32(str(chat_id).encode()) % workers
+
+
+def update_chat_id(update) -> int:
+    chat = update.effective_chat
+    if chat:
+        return chat.id
+    user = update.effective_user
+    return user.id if user else 0
+
+
+# ==============================
+# Воркер
+# ==============================
+
+async def _worker_loop(shard: int, inbox):
+    from telegram import Update
+    from bot_ai import build_app
+
+    app = build_app(with_updater=False)
+    app.bot_data["shard"] = shard
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    logger.info("⚙️ Воркер #%s запущен", shard)
+
+    loop = asyncio.get_running_loop()
+    while True:
+        data = await loop.run_in_executor(None, inbox.get)
+        if data is None:
+            break
+        # дальше — обычная очередь Application (учитывает concurrent_updates)
+        await app.update_queue.put(Update.de_json(data, app.bot))
+
+    await app.stop()
+    if app.post_stop:
+        await app.post_stop(app)
+    await app.shutdown()
+    if app.post_shutdown:
+        await app.post_shutdown(app)
+    logger.info("⚙️ Воркер #%s остановлен", shard)
+
+
+def worker_main(shard: int, inbox):
+    # Ctrl+C ловит супервизор и сам присылает воркерам None
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from logs import setup_logging, bind
+
+    setup_logging()
+    bind(shard=shard)  # номер шарда — в каждой записи лога воркера
+    asyncio.run(_worker_loop(shard, inbox))
+
+
+# ==============================
+# Супервизор
+# ==============================
+
+class Supervisor:
+    def __init__(self, workers: int, target=worker_main, start_method="spawn"):
+        self.workers = workers
+        self.target = target
+        self.ctx = mp.get_context(start_method)
+        self.queues = [self.ctx.Queue() for _ in range(workers)]
+        self.procs = [None] * workers
+        self._stopping = False
+        self._monitor = None
+
+    def _spawn(self, shard: int):
+        proc = self.ctx.Process(
+            target=self.target,
+            args=(shard, self.queues[shard]),
+            name=f"neurocat-shard-{shard}",
+            daemon=False,
+        )
+        proc.start()
+        self.procs[shard] = proc
+
+    def start(self):
+        for shard in range(self.workers):
+            self._spawn(shard)
+        return self
+
+    def route(self, chat_id, data):
+        shard = shard_for(chat_id, self.workers)
+        self.queues[shard].put(data)
+        metrics.inc(f"shard.{shard}.routed")
+        return shard
+
+    def check(self):
+        """Перезапускает упавших воркеров. Возвращает список перезапущенных."""
+        restarted = []
+        if self._stopping:
+            return restarted
+        for shard, proc in enumerate(self.procs):
+            if proc is not None and not proc.is_alive():
+                logger.error("💀 Воркер #%s упал (код %s), перезапускаем", shard, proc.exitcode)
+                metrics.inc("shard.restarts")
+                self._spawn(shard)
+                restarted.append(shard)
+        return restarted
+
+    async def monitor(self, interval=SHARD_CHECK_INTERVAL):
+        while not self._stopping:
+            await asyncio.sleep(interval)
+            self.check()
+
+    def stop(self, timeout=30):
+        self._stopping = True
+        for q in self.queues:
+            q.put(None)
+        deadline = time.monotonic() + timeout
+        for shard, proc in enumerate(self.procs):
+            if proc is None:
+                continue
+            proc.join(max(deadline - time.monotonic(), 0))
+            if proc.is_alive():
+                logger.warning("⚠️ Воркер #%s не завершился вовремя, terminate()", shard)
+                proc.terminate()
+                proc.join()
+
+
+def run_sharded(workers: int):
+    from telegram import Update
+    from telegram.ext import Application, TypeHandler
+
+    supervisor = Supervisor(workers)
+
+    async def route(update: Update, context):
+        supervisor.route(update_chat_id(update), update.to_dict())
+
+    async def on_startup(app):
+        supervisor.start()
+        app.bot_data["shard_monitor"] = asyncio.get_running_loop().create_task(supervisor.monitor())
+
+    async def on_shutdown(app):
+        monitor = app.bot_data.get("shard_monitor")
+        if monitor:
+            monitor.cancel()
+        supervisor.stop()
+
+    app = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .read_timeout(60)
+        .connect_timeout(30)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+    app.add_handler(TypeHandler(Update, route))
+
+    if UPDATE_MODE == "webhook":
+        from webhook_server import run_webhook
+
+        run_webhook(app)
+    else:
+        app.run_polling()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Склейка одинаковых одновременных запросов (single-flight).
+
+Горячую ссылку кидают в несколько групп сразу — каждая копия просит тот же
+веб-поиск и ту же классификацию. Первый вызов по ключу запускает работу
+отдельной задачей, остальные, пришедшие пока она идёт, ждут её же результат
+(или исключение). После завершения ключ освобождается: кэша здесь нет,
+склеиваются только запросы, которые перекрываются по времени.
+
+Отмена:
+- ушёл (отменён, таймаут wait_for) один из ждущих — работа продолжается для остальных;
+- ушёл последний — работа отменяется, ключ освобождается сразу, новый вызов начнёт заново.
+
+Счётчики: singleflight.<имя>.leaders — запущенные работы,
+singleflight.<имя>.coalesced — вызовы, присоединившиеся к чужой,
+singleflight.<имя>.cancelled — работы, отменённые после ухода всех ждущих.
+"""
+
+import asyncio
+import logging
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(text: str) -> str:
+    """Ключ для текста: регистр и пробелы не важны."""
+    return " ".join((text or "").casefold().split())
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._flights = {}
+
+    def __len__(self):
+        return len(self._flights)
+
+    async def do(self, key, func):
+        """
+        func — без аргументов, возвращает корутину; вызывается только у первого по ключу.
+        Возвращает (результат, coalesced): coalesced=True — работу запускал другой вызов
+        (учёт токенов и прочие побочные эффекты уже сделал он).
+        """
+        flight = self._flights.get(key)
+        coalesced = flight is not None
+        if coalesced:
+            metrics.inc(f"singleflight.{self.name}.coalesced")
+        else:
+            metrics.inc(f"singleflight.{self.name}.leaders")
+            # задача копирует contextvars первого вызова: corr в логах и снимок конфига — его
+            task = asyncio.get_running_loop().create_task(func(), name=f"singleflight:{self.name}")
+            flight = self._flights[key] = _Flight(task)
+            task.add_done_callback(lambda _, key=key, flight=flight: self._release(key, flight))
+
+        flight.waiters += 1
+        try:
+            # shield: отмена одного ждущего не должна отменять общую работу
+            result = await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if not flight.task.done() and flight.waiters == 1:
+                self._release(key, flight)
+                flight.task.cancel()
+                metrics.inc(f"singleflight.{self.name}.cancelled")
+                logger.debug("singleflight %s: ждущих не осталось, работа отменена", self.name)
+            raise
+        finally:
+            flight.waiters -= 1
+        return result, coalesced
+
+    def _release(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Учёт токенов и задержек всех вызовов LLM.
+
+Каждый вызов (OpenAI / Anthropic) записывается в журнал usage_log
+с привязкой к чату, пользователю, модели и этапу конвейера.
+Записи копятся в памяти и пишутся в SQLite пачками, а агрегаты
+usage_daily / usage_user_daily обновляются в той же транзакции —
+команда /usage читает только агрегаты, без сканирования журнала.
+
+record_usage в БД не пишет никогда (его зовут и из event loop): пачку
+сбрасывает фоновая задача run_flusher() в потоке, остаток — flush_usage()
+при выходе.
+"""
+
+import asyncio
+
+import os
+import time
+import sqlite3
+import atexit
+import logging
+import threading
+from datetime import datetime
+from telegram import Update
+from telegram.ext import ContextTypes, CommandHandler
+
+from config import (
+    OWNER_ID,
+    USAGE_FLUSH_SIZE,
+    USAGE_FLUSH_INTERVAL,
+    USAGE_CHECK_INTERVAL,
+    MODEL_PRICES,
+    DB_BUSY_TIMEOUT,
+)
+from metrics import timed
+from records import UsageEvent
+
+DB_PATH = os.path.join(os.getcwd(), "group_history.db")
+
+logger = logging.getLogger(__name__)
+
+_buffer = []
+_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+
+def get_db_connection():
+    return sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT)
+
+
+def extract_usage(resp) -> dict:
+    """
+    Приводит поле usage ответа OpenAI или Anthropic к единому виду:
+    {"input_tokens", "output_tokens", "cached_tokens"}.
+    input_tokens — все входные токены, включая прочитанные из кэша.
+    """
+    usage = getattr(resp, "usage", None)
+    if usage is None:
+        return {"input_tokens": 0, "output_tokens": 0, "cached_tokens": 0}
+
+    # OpenAI: prompt_tokens уже включает закэшированные
+    if hasattr(usage, "prompt_tokens"):
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", 0) if details else 0
+        return {
+            "input_tokens": usage.prompt_tokens or 0,
+            "output_tokens": usage.completion_tokens or 0,
+            "cached_tokens": cached or 0,
+        }
+
+    # Anthropic: input_tokens не включает чтение/запись кэша
+    cache_read = getattr(usage, "cache_read_input_tokens", 0) or 0
+    cache_write = getattr(usage, "cache_creation_input_tokens", 0) or 0
+    return {
+        "input_tokens": (usage.input_tokens or 0) + cache_read + cache_write,
+        "output_tokens": usage.output_tokens or 0,
+        "cached_tokens": cache_read,
+    }
+
+
+def record_usage(stage, model, usage, latency, chat_id=None, user_id=None):
+    """
+    Кладёт запись о вызове в буфер (в БД её запишет run_flusher). latency — в секундах.
+    usage — словарь из extract_usage().
+    """
+    event = UsageEvent(
+        datetime.now(),
+        chat_id or 0,
+        user_id or 0,
+        model,
+        stage,
+        usage.get("input_tokens", 0),
+        usage.get("output_tokens", 0),
+        usage.get("cached_tokens", 0),
+        int(latency * 1000),
+    )
+    with _lock:
+        _buffer.append(event)
+
+
+def _flush_due() -> bool:
+    with _lock:
+        return bool(_buffer) and (
+            len(_buffer) >= USAGE_FLUSH_SIZE
+            or time.monotonic() - _last_flush >= USAGE_FLUSH_INTERVAL
+        )
+
+
+async def run_flusher(check_interval=USAGE_CHECK_INTERVAL):
+    """Фоновая задача: пора (размер или время) — flush_usage в потоке, event loop не ждёт SQLite."""
+    while True:
+        await asyncio.sleep(check_interval)
+        if _flush_due():
+            await asyncio.to_thread(flush_usage)
+
+
+@timed("sqlite.usage_flush")
+def flush_usage():
+    """Пишет накопленные записи в БД одной транзакцией."""
+    global _last_flush
+    with _lock:
+        events = list(_buffer)
+        _buffer.clear()
+        _last_flush = time.monotonic()
+    if not events:
+        return
+
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.executemany(
+            """
+            INSERT INTO usage_log (created, chat_id, user_id, model, stage,
+                                   input_tokens, output_tokens, cached_tokens, latency_ms)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [e.as_row() for e in events],
+        )
+        cur.executemany(
+            """
+            INSERT INTO usage_daily (day, chat_id, model, stage, calls,
+                                     input_tokens, output_tokens, cached_tokens, latency_ms)
+            VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?)
+            ON CONFLICT(day, chat_id, model, stage) DO UPDATE SET
+                calls = calls + 1,
+                input_tokens = input_tokens + excluded.input_tokens,
+                output_tokens = output_tokens + excluded.output_tokens,
+                cached_tokens = cached_tokens + excluded.cached_tokens,
+                latency_ms = latency_ms + excluded.latency_ms
+            """,
+            [
+                (e.created.strftime("%Y-%m-%d"), e.chat_id, e.model, e.stage,
+                 e.input_tokens, e.output_tokens, e.cached_tokens, e.latency_ms)
+                for e in events
+            ],
+        )
+        cur.executemany(
+            """
+            INSERT INTO usage_user_daily (day, user_id, calls, input_tokens, output_tokens)
+            VALUES (?, ?, 1, ?, ?)
+            ON CONFLICT(day, user_id) DO UPDATE SET
+                calls = calls + 1,
+                input_tokens = input_tokens + excluded.input_tokens,
+                output_tokens = output_tokens + excluded.output_tokens
+            """,
+            [(e.created.strftime("%Y-%m-%d"), e.user_id, e.input_tokens, e.output_tokens) for e in events if e.user_id],
+        )
+        conn.commit()
+    except Exception as e:
+        # транзакция откатилась целиком — возвращаем пачку в начало буфера, запишем со следующей
+        logger.error("⚠️ Ошибка записи usage в БД (%s записей вернули в буфер): %s", len(events), e)
+        with _lock:
+            _buffer[:0] = events
+    finally:
+        conn.close()
+
+
+atexit.register(flush_usage)
+
+
+def estimate_cost(model, input_tokens, output_tokens, cached_tokens) -> float:
+    """Стоимость в $ по таблице MODEL_PRICES (0, если модель неизвестна)."""
+    prices = MODEL_PRICES.get(model)
+    if not prices:
+        return 0.0
+    price_in, price_cached, price_out = prices
+    fresh = max(input_tokens - cached_tokens, 0)
+    return (fresh * price_in + cached_tokens * price_cached + output_tokens * price_out) / 1_000_000
+
+
+def usage_report(days: int = 1) -> str:
+    """Собирает текст отчёта по агрегатам за последние days дней."""
+    flush_usage()
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT model, stage, SUM(calls), SUM(input_tokens), SUM(output_tokens),
+               SUM(cached_tokens), SUM(latency_ms)
+        FROM usage_daily
+        WHERE day >= date('now', 'localtime', ?)
+        GROUP BY model, stage
+        ORDER BY SUM(input_tokens) DESC
+        """,
+        (f"-{days - 1} days",),
+    )
+    by_model = cur.fetchall()
+    cur.execute(
+        """
+        SELECT chat_id, SUM(calls), SUM(input_tokens), SUM(output_tokens)
+        FROM usage_daily
+        WHERE day >= date('now', 'localtime', ?)
+        GROUP BY chat_id
+        ORDER BY SUM(input_tokens) + SUM(output_tokens) DESC
+        LIMIT 5
+        """,
+        (f"-{days - 1} days",),
+    )
+    by_chat = cur.fetchall()
+    cur.execute(
+        """
+        SELECT user_id, SUM(calls), SUM(input_tokens), SUM(output_tokens)
+        FROM usage_user_daily
+        WHERE day >= date('now', 'localtime', ?)
+        GROUP BY user_id
+        ORDER BY SUM(input_tokens) + SUM(output_tokens) DESC
+        LIMIT 5
+        """,
+        (f"-{days - 1} days",),
+    )
+    by_user = cur.fetchall()
+    conn.close()
+
+    if not by_model:
+        return f"📊 За {days} дн. вызовов LLM не было."
+
+    lines = [f"📊 Расход токенов за {days} дн.", ""]
+    total_cost = 0.0
+    for model, stage, calls, tin, tout, tcached, lat in by_model:
+        cost = estimate_cost(model, tin, tout, tcached)
+        total_cost += cost
+        hit = 100 * tcached / tin if tin else 0
+        lines.append(
+            f"🤖 {model} [{stage}]: {calls} выз., вход {tin} (кэш {tcached}, {hit:.0f}%), "
+            f"выход {tout}, ср. {lat // max(calls, 1)} мс, ${cost:.4f}"
+        )
+    lines.append(f"\n💰 Итого: ${total_cost:.4f}")
+
+    lines.append("\n💬 Топ чатов:")
+    for chat_id, calls, tin, tout in by_chat:
+        lines.append(f"- {chat_id}: {calls} выз., {tin}/{tout} ток.")
+
+    if by_user:
+        lines.append("\n👤 Топ пользователей:")
+        for user_id, calls, tin, tout in by_user:
+            lines.append(f"- {user_id}: {calls} выз., {tin}/{tout} ток.")
+
+    return "\n".join(lines)
+
+
+# ------------------ команды ------------------
+
+async def usage_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/usage [дней] — сводка расхода токенов (только владелец)"""
+    if update.message.chat.id != OWNER_ID:
+        return
+
+    days = 1
+    if context.args:
+        try:
+            days = max(1, int(context.args[0]))
+        except ValueError:
+            await update.message.reply_text("Использование: /usage [дней]")
+            return
+
+    # flush и три выборки по usage_daily — в потоке, чтобы не стоял event loop
+    report = await asyncio.to_thread(usage_report, days)
+    await update.message.reply_text(report)
+
+
+def register_usage_handlers(app):
+    app.add_handler(CommandHandler("usage", usage_command))
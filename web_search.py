@@ -2,17 +2,29 @@
 # -*- coding: utf-8 -*-
 
 import asyncio
-import aiohttp
-from ddgs import DDGS   # современный пакет, замена duckduckgo_search
-from bs4 import BeautifulSoup
-from openai import AsyncOpenAI
-from config import OPENAI_API_KEY
+import logging
+from usage_tracker import extract_usage, record_usage
+from metrics import span, timed
+from resilience import CircuitOpen, call_async, stage_timeout
+from clients import get_openai
+from singleflight import SingleFlight, normalize
+import cassette
 
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+# aiohttp, bs4 и ddgs импортируются при первом поиске (или в clients.warm_up)
 
+logger = logging.getLogger(__name__)
 
+
+@timed("http.fetch")
 async def fetch_html(session, url, timeout=5):
-    """Скачивает HTML страницы"""
+    """Скачивает HTML страницы (через кассету, если включена запись/воспроизведение)"""
+    html, _ = await cassette.acall(
+        "fetch_html", {"url": url}, lambda: _fetch_html_live(session, url, timeout)
+    )
+    return html
+
+
+async def _fetch_html_live(session, url, timeout):
     try:
         async with session.get(
             url,
@@ -20,18 +32,20 @@ async def fetch_html(session, url, timeout=5):
             headers={"User-Agent": "Mozilla/5.0"}
         ) as resp:
             if resp.status == 200:
-                print(f"[web_search] response: {url} {resp.status}")
+                logger.debug("[web_search] response: %s %s", url, resp.status)
                 return await resp.text()
             else:
-                print(f"[web_search] ❌ {url} status {resp.status}")
+                logger.info("[web_search] ❌ %s status %s", url, resp.status)
     except Exception as e:
-        print(f"[web_search] ❌ Ошибка при загрузке {url}: {e}")
+        logger.info("[web_search] ❌ Ошибка при загрузке %s: %s", url, e)
     return ""
 
 
 def extract_text(html, limit=1200):
     """Достаёт читаемый текст из HTML"""
     try:
+        from bs4 import BeautifulSoup
+
         soup = BeautifulSoup(html, "html.parser")
         for script in soup(["script", "style", "noscript"]):
             script.extract()
@@ -41,26 +55,36 @@ def extract_text(html, limit=1200):
         return ""
 
 
-async def search_duckduckgo(query: str, num_results: int = 10):
+@timed("ddg.search")
+async def search_duckduckgo(query: str, num_results: int = 10, deadline=None):
     """Ищет ссылки через DuckDuckGo"""
+    def _search():
+        from ddgs import DDGS   # современный пакет, замена duckduckgo_search
+
+        with DDGS() as ddgs:
+            return list(ddgs.text(query, max_results=num_results))
+
     results = []
     try:
-        with DDGS() as ddgs:
-            for r in ddgs.text(query, max_results=num_results):
-                link = r.get("href") or r.get("url")
-                if link:
-                    print(f"[web_search] найдено: {link}")
-                    results.append({
-                        "title": r.get("title"),
-                        "link": link,
-                        "text": r.get("body", "")  # ⚡️ сохраняем body как текст
-                    })
+        # DDGS синхронный → в поток, чтобы таймаут и event loop работали
+        found = await call_async("ddg", lambda: asyncio.to_thread(_search), stage_timeout(deadline, "ddg"))
+        for r in found:
+            link = r.get("href") or r.get("url")
+            if link:
+                logger.debug("[web_search] найдено: %s", link)
+                results.append({
+                    "title": r.get("title"),
+                    "link": link,
+                    "text": r.get("body", "")  # ⚡️ сохраняем body как текст
+                })
+    except (CircuitOpen, asyncio.TimeoutError):
+        raise  # «поиск недоступен» — не «ничего не найдено»: решает вызывающий
     except Exception as e:
-        print(f"[web_search] ❌ Ошибка DuckDuckGo: {e}")
+        logger.error("[web_search] ❌ Ошибка DuckDuckGo: %s", e)
     return results
 
 
-async def summarize_texts(results, query):
+async def summarize_texts(results, query, chat_id=None, user_id=None, deadline=None):
     """Просит GPT сделать конспект из найденных текстов"""
     texts = [r.get("text", "") for r in results if r.get("text")]
     joined = "\n\n".join(texts[:6])  # ⚡️ максимум 6 источника
@@ -68,41 +92,73 @@ async def summarize_texts(results, query):
     if not joined.strip():
         return "⚠️ Не удалось собрать текст из источников."
 
-    prompt = f"""
-Ты — умный ассистент. У тебя есть результаты поиска по запросу: "{query}".
+    # Запрос — в сообщении пользователя, чтобы системный промпт был постоянным
+    # и кэшировался на стороне OpenAI.
+    prompt = """
+Ты — умный ассистент. Тебе дают поисковый запрос и результаты поиска по нему.
 
 Сделай краткий конспект (3–4 предложения), используй только факты.
 Не придумывай от себя, опирайся на текст.
 """
 
-    response = await client.chat.completions.create(
+    request = dict(
         model="gpt-4o-mini",
         temperature=0.3,
         messages=[
             {"role": "system", "content": prompt},
-            {"role": "user", "content": joined},
+            {"role": "user", "content": f"Запрос: \"{query}\"\n\n{joined}"},
         ],
     )
-    return response.choices[0].message.content.strip()
 
+    async def _call():
+        timeout = stage_timeout(deadline, "web_summary")
+        with span("openai.chat"):
+            response = await call_async(
+                "openai", lambda: get_openai().chat.completions.create(**request, timeout=timeout), timeout
+            )
+        return {"text": response.choices[0].message.content, "usage": extract_usage(response)}
 
-async def search_and_summarize(query: str, num_results: int = 5):
-    """Главная функция: ищет → парсит → конспектирует"""
-    results = await search_duckduckgo(query, num_results=num_results)
+    reply, elapsed = await cassette.acall("summarize_texts", request, _call)
+    record_usage("web_summary", "gpt-4o-mini", reply["usage"], elapsed, chat_id=chat_id, user_id=user_id)
+    return reply["text"].strip()
+
+
+_flights = SingleFlight("web_search")
+
+
+async def search_and_summarize(query: str, num_results: int = 5, chat_id=None, user_id=None, deadline=None):
+    """
+    Главная функция: ищет → парсит → конспектирует (deadline — бюджет сообщения).
+    Одинаковые запросы из разных групп, пришедшие одновременно, делают один поиск
+    (бюджет и учёт токенов — того, кто пришёл первым).
+    """
+    (summary, sources), _ = await _flights.do(
+        (normalize(query), num_results),
+        lambda: _search_and_summarize(query, num_results, chat_id, user_id, deadline),
+    )
+    return summary, list(sources)
+
+
+async def _search_and_summarize(query, num_results, chat_id, user_id, deadline):
+    results = await search_duckduckgo(query, num_results=num_results, deadline=deadline)
     if not results:
-        print("[web_search] ❌ Нет результатов поиска")
+        logger.info("[web_search] ❌ Нет результатов поиска")
         return "Ничего не найдено.", []
 
+    import aiohttp
+
     async with aiohttp.ClientSession() as session:
-        tasks = [fetch_html(session, r["link"]) for r in results]
+        fetch_timeout = stage_timeout(deadline, "fetch")
+        tasks = [fetch_html(session, r["link"], timeout=fetch_timeout) for r in results]
         pages = await asyncio.gather(*tasks)
 
-    for i, html in enumerate(pages):
-        if html:
-            results[i]["text"] += "\n" + extract_text(html)
-        # если html пустой, остаётся только body
+    with span("web.parse_html"):
+        for i, html in enumerate(pages):
+            if html:
+                results[i]["text"] += "\n" + extract_text(html)
+            # если html пустой, остаётся только body
 
-    summary = await summarize_texts(results, query)
+    summary = await summarize_texts(results, query, chat_id=chat_id, user_id=user_id, deadline=deadline)
     sources = [r["link"] for r in results if r.get("link")]
 
     return summary, sources
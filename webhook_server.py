@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Webhook-режим: апдейты приходят POST-запросами на встроенный aiohttp-сервер.
+
+Сервер проверяет секрет (X-Telegram-Bot-Api-Secret-Token), кладёт апдейт
+в ограниченную очередь и сразу отвечает 200 — обработка идёт воркерами.
+Если очередь полна, отвечаем 503, и Telegram пришлёт апдейт ещё раз.
+
+Секрет обязателен: со значением по умолчанию или пустым сервер не стартует.
+
+Локальная проверка без Telegram (UPDATE_MODE = "webhook", WEBHOOK_URL = None):
+    export NEUROCAT_WEBHOOK_SECRET=local-test
+    python bot_ai.py
+    python webhook_server.py post recorded_update.json
+"""
+
+import re
+import sys
+import json
+import hmac
+import time
+import signal
+import asyncio
+import logging
+from aiohttp import web, ClientSession
+
+import metrics
+from config import (
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_URL,
+    WEBHOOK_SECRET,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_WORKERS,
+)
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+DEFAULT_SECRET = "change-me"
+SECRET_RE = re.compile(r"[A-Za-z0-9_-]{1,256}")  # что Telegram принимает в secret_token
+
+
+def check_secret(secret):
+    """Без настоящего секрета сервер не запускаем: иначе апдейты может прислать кто угодно."""
+    if not secret or secret == DEFAULT_SECRET:
+        raise RuntimeError("WEBHOOK_SECRET не задан: укажи NEUROCAT_WEBHOOK_SECRET (1–256 символов A-Z a-z 0-9 _ -)")
+    if not SECRET_RE.fullmatch(secret):
+        raise RuntimeError("WEBHOOK_SECRET: Telegram принимает только 1–256 символов A-Z a-z 0-9 _ -")
+
+
+class WebhookServer:
+    def __init__(self, app, host=WEBHOOK_LISTEN, port=WEBHOOK_PORT, path=WEBHOOK_PATH,
+                 secret=WEBHOOK_SECRET, queue_size=WEBHOOK_QUEUE_SIZE, workers=WEBHOOK_WORKERS):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret = secret
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.workers = workers
+        self._runner = None
+        self._worker_tasks = []
+
+    async def _handle(self, request):
+        token = request.headers.get(SECRET_HEADER, "")
+        # сравниваем байты: compare_digest на str с не-ASCII падает TypeError (а это был бы 500)
+        if not hmac.compare_digest(token.encode("utf-8", "replace"), self.secret.encode("utf-8")):
+            metrics.inc("webhook.forbidden")
+            return web.Response(status=403)
+        try:
+            data = await request.json(loads=json.loads)
+        except Exception:
+            metrics.inc("webhook.bad_request")
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait((time.perf_counter(), data))
+        except asyncio.QueueFull:
+            metrics.inc("webhook.queue_full")
+            return web.Response(status=503)
+        metrics.inc("webhook.accepted")
+        return web.Response(status=200)
+
+    async def _worker(self):
+        from telegram import Update
+
+        while True:
+            received, data = await self.queue.get()
+            try:
+                metrics.observe("webhook.queue_wait", time.perf_counter() - received)
+                update = Update.de_json(data, self.app.bot)
+                await self.app.process_update(update)
+            except Exception as e:
+                logger.error("❌ Ошибка обработки апдейта из webhook: %s", e, exc_info=True)
+            finally:
+                self.queue.task_done()
+
+    async def start(self):
+        check_secret(self.secret)
+        web_app = web.Application()
+        web_app.router.add_post(self.path, self._handle)
+        self._runner = web.AppRunner(web_app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+        loop = asyncio.get_running_loop()
+        self._worker_tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+        if WEBHOOK_URL:
+            await self.app.bot.set_webhook(
+                url=WEBHOOK_URL,
+                secret_token=self.secret,
+                allowed_updates=["message", "callback_query"],
+            )
+            logger.info("🔗 Webhook зарегистрирован: %s", WEBHOOK_URL)
+        logger.info("🌐 Webhook-сервер слушает http://%s:%s%s", self.host, self.port, self.path)
+
+    async def stop(self, drain_timeout=10):
+        # дорабатываем то, что уже приняли
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("⚠️ В очереди webhook остались необработанные апдейты: %s", self.queue.qsize())
+        for task in self._worker_tasks:
+            task.cancel()
+        if self._runner:
+            await self._runner.cleanup()
+
+
+async def _run(app):
+    """Жизненный цикл Application без run_polling: init → start → сервер → стоп."""
+    check_secret(WEBHOOK_SECRET)  # до прогрева и подключения к Telegram
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+
+    server = WebhookServer(app)
+    await server.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass  # Windows
+    await stop.wait()
+
+    logger.info("🛑 Останавливаем webhook-сервер...")
+    await server.stop()
+    await app.stop()
+    if app.post_stop:
+        await app.post_stop(app)
+    await app.shutdown()
+    if app.post_shutdown:
+        await app.post_shutdown(app)
+
+
+def run_webhook(app):
+    asyncio.run(_run(app))
+
+
+# ==============================
+# 🧪 Локальный тест: отправить записанный апдейт
+# ==============================
+async def post_updates(path, url, secret):
+    """Файл с одним JSON-апдейтом или JSONL с несколькими → POST на webhook."""
+    with open(path, "r", encoding="utf-8") as f:
+        raw = f.read().strip()
+    try:
+        updates = [json.loads(raw)]
+    except ValueError:
+        updates = [json.loads(line) for line in raw.splitlines() if line.strip()]
+
+    async with ClientSession() as session:
+        for data in updates:
+            started = time.perf_counter()
+            async with session.post(url, json=data, headers={SECRET_HEADER: secret}) as resp:
+                print(f"update_id={data.get('update_id')}: HTTP {resp.status} за {(time.perf_counter() - started) * 1000:.1f} мс")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == "post":
+        default_url = f"http://{WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}"
+        target = sys.argv[3] if len(sys.argv) > 3 else default_url
+        asyncio.run(post_updates(sys.argv[2], target, WEBHOOK_SECRET))
+    else:
+        print("Использование: python webhook_server.py post <update.json|updates.jsonl> [url]")